@@ -6,6 +6,7 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 import logging
 from pathlib import Path
 
@@ -18,8 +19,10 @@ from api.routers import (
     modelos3d_router,
     pacientes_router,
     reportes_router,
-    
+    jobs_router,
+    visor_router,
 )
+from api.services.jobs_service import job_manager
 
 # ============ Configuración de logging ============
 logging.basicConfig(
@@ -55,6 +58,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cabeceras que el visor lee de /series/{id}/raw (geometría de los datos crudos)
+    expose_headers=[
+        "ETag",
+        "Content-Range",
+        "Accept-Ranges",
+        "X-Dicom-Dtype",
+        "X-Dicom-Shape",
+        "X-Dicom-Spacing",
+        "X-Dicom-Slope",
+        "X-Dicom-Intercept",
+        "X-Dicom-Z",
+    ],
 )
 
 # ============ Archivos estáticos ============
@@ -77,7 +92,7 @@ def root():
 def health():
     return {
         "status": "healthy",
-        "modules": ["auth", "dicom", "historial", "modelos3d", "pacientes"],
+        "modules": ["auth", "dicom", "historial", "modelos3d", "pacientes", "jobs", "visor"],
     }
 
 
@@ -88,6 +103,8 @@ app.include_router(historial_router.router, tags=["Historial"])
 app.include_router(modelos3d_router.router, tags=["Modelos3D"])
 app.include_router(pacientes_router.router, tags=["Pacientes"])
 app.include_router(reportes_router.router, tags=["Reportes"])
+app.include_router(jobs_router.router, tags=["Jobs"])
+app.include_router(visor_router.router, tags=["Visor"])
 
 
 # ============ Eventos ============
@@ -102,3 +119,4 @@ async def startup():
 @app.on_event("shutdown")
 async def shutdown():
     logger.info("Cerrando DICOM API")
+    await run_in_threadpool(job_manager.shutdown)
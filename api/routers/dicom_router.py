@@ -1,4 +1,5 @@
 # api/routers/dicom_router.py
+import math
 import tempfile
 from tkinter import Image
 from typing import Optional
@@ -6,20 +7,58 @@ import uuid
 import zipfile
 from fastapi import APIRouter, Form, HTTPException, Path, UploadFile, File, Header
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 import os
 import numpy as np
 import pydicom
 from fastapi import Query
 import json
 from pathlib import Path
-from ..services.segmentation3d_service import segmentar_serie_3d
+from ..services.segmentation3d_service import (
+    CLOSING_METHODS,
+    etiquetas_multi,
+    segmentar_region_3d,
+    segmentar_serie_3d,
+    segmentar_serie_3d_multi,
+)
 
 
 from ..services.dicom_service import convert_dicom_zip_to_png_paths
+from ..services.volume_cache_service import volume_lru
+from ..services.pipeline_cache_service import estadisticas as estadisticas_cache_segmentacion
+from .jobs_router import enviar_job
+from config.settings import UPLOAD_CHUNK_BYTES
 
 router = APIRouter()
 
 
+async def _spool_upload_to_disk(file: UploadFile, suffix: str = ".zip") -> str:
+    """
+    Vuelca el upload a un archivo temporal por bloques de UPLOAD_CHUNK_BYTES
+    (sin cargar el archivo completo en memoria). El llamador debe borrarlo.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, prefix="upload_")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                out.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _respuesta_upload(image_paths: dict) -> dict:
+    return {
+        "message": f"{len(image_paths['image_series'])} imágenes convertidas correctamente.",
+        "image_series": image_paths,
+        "timings_ms": image_paths["timings_ms"],
+    }
+
+
 @router.post("/upload-dicom")
 async def upload_dicom(file: UploadFile = File(...)):
     try:
@@ -62,23 +101,59 @@ async def upload_dicom(file: UploadFile = File(...)):
 async def upload_dicom_series(
     file: UploadFile = File(...),
     x_user_id: int = Header(..., alias="X-User-Id"),  
+    workers: Optional[int] = Form(None),
+    preview_mode: Optional[str] = Form(None, description="lut | clahe | none (render bajo demanda)"),
+    preview_window: Optional[str] = Form(None, description="ct_bone | ct_brain | ct_soft | auto"),
+    preview_encodings: Optional[str] = Form(None, description="p.ej. webp,png | jpeg | png"),
+    preview_quality: Optional[int] = Form(None, description="Calidad webp/jpeg (1-100)"),
+    async_mode: bool = Query(False, alias="async", description="Encolar y consultar en /jobs/{id}"),
 ):
     if not file.filename.endswith(".zip"):
         raise HTTPException(
             status_code=400, detail="Debe subir un archivo .zip con archivos DICOM"
         )
-    try:
-        zip_bytes = await file.read()
+    zip_path = await _spool_upload_to_disk(file)
+
+    def _limpiar():
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    if async_mode:
+        # El trabajo es dueño del ZIP temporal y lo borra al terminar
+        return enviar_job(
+            "ingest",
+            x_user_id,
+            lambda job: _respuesta_upload(
+                convert_dicom_zip_to_png_paths(
+                    zip_path,
+                    user_id=x_user_id,
+                    workers=workers,
+                    progress=job.report,
+                    preview_mode=preview_mode,
+                    preview_window=preview_window,
+                    preview_encodings=preview_encodings,
+                    preview_quality=preview_quality,
+                )
+            ),
+            cleanup=_limpiar,
+        )
 
-        image_paths = convert_dicom_zip_to_png_paths(zip_bytes, user_id=x_user_id)
-        return JSONResponse(
-            content={
-                "message": f"{len(image_paths)} imágenes convertidas correctamente.",
-                "image_series": image_paths,
-            }
+    try:
+        image_paths = await run_in_threadpool(
+            convert_dicom_zip_to_png_paths,
+            zip_path,
+            user_id=x_user_id,
+            workers=workers,
+            preview_mode=preview_mode,
+            preview_window=preview_window,
+            preview_encodings=preview_encodings,
+            preview_quality=preview_quality,
         )
+        return JSONResponse(content=_respuesta_upload(image_paths))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        _limpiar()
 
 
 @router.post("/segmentar-dicom/")
@@ -144,6 +219,9 @@ async def segmentar_desde_mapping(
         with open(mapping_path, "r") as f:
             mapping = json.load(f)
 
+        if image_name not in mapping:
+            # La vista previa puede venir en otra codificación (image_3.webp)
+            image_name = os.path.splitext(image_name)[0] + ".png"
         if image_name not in mapping:
             raise ValueError(f"No se encontró {image_name} en el mapping")
 
@@ -169,6 +247,33 @@ async def segmentar_desde_mapping(
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+def _parsear_numeros(value: Optional[str], nombre: str, n=(3,)):
+    if value is None:
+        return None
+    try:
+        numeros = [float(c) for c in value.split(",")]
+    except ValueError:
+        numeros = []
+    if len(numeros) not in n:
+        raise HTTPException(status_code=400, detail=f"{nombre} debe ser x,y,z")
+    return numeros
+
+
+def _parsear_radio(value: Optional[str], nombre: str, closing_method: str = "edt"):
+    """Radio en mm "r" o "rz,ry,rx" (>= 0): float o tupla (rz, ry, rx); None si no se envía."""
+    if value is None or not value.strip():
+        return None
+    try:
+        radios = [float(c) for c in value.split(",")]
+    except ValueError:
+        radios = []
+    if len(radios) not in (1, 3) or not all(math.isfinite(v) and v >= 0 for v in radios):
+        raise HTTPException(status_code=400, detail=f"{nombre} debe ser r o rz,ry,rx (mm, >= 0)")
+    if len(radios) == 3 and closing_method != "edt":
+        raise HTTPException(status_code=400, detail=f"{nombre} por eje (rz,ry,rx) requiere closing_method=edt")
+    return radios[0] if len(radios) == 1 else tuple(radios)
+
+
 @router.post("/segmentar-serie-3d/")
 def segmentar_serie_3d_endpoint(
     session_id: str = Form(...),
@@ -177,8 +282,39 @@ def segmentar_serie_3d_endpoint(
     thr_min: Optional[float] = Form(None),
     thr_max: Optional[float] = Form(None),
     min_size_voxels: Optional[int] = Form(2000),
-    close_radius_mm: Optional[float] = Form(1.5),
+    close_radius_mm: Optional[str] = Form("1.5", description="Radio del cierre (mm): r o rz,ry,rx (por eje sólo con closing_method=edt)"),
+    blockwise: Optional[bool] = Form(None, description="Por bloques en Z (memoria acotada); vacío = automático"),
+    workers: Optional[int] = Form(None, ge=1, description="Hilos de filtrado/morfología; vacío = DICOM_SEG_WORKERS"),
+    closing_method: str = Form("ball", description=" | ".join(CLOSING_METHODS)),
+    open_radius_mm: Optional[str] = Form(None, description="Radio (mm) de una apertura EDT previa al cierre: r o rz,ry,rx; vacío = sin apertura"),
+    coarse_factor: int = Form(1, ge=1, le=16, description="> 1: pasada gruesa submuestreada y pasada fina sólo en la ROI"),
+    async_mode: bool = Query(False, alias="async", description="Encolar y consultar en /jobs/{id}"),
 ):
+    if closing_method not in CLOSING_METHODS:
+        raise HTTPException(status_code=400, detail=f"closing_method inválido: {closing_method}")
+    radio = _parsear_radio(close_radius_mm, "close_radius_mm", closing_method)
+    close_radius_mm = 1.5 if radio is None else radio
+    open_radius_mm = _parsear_radio(open_radius_mm, "open_radius_mm") or 0.0
+    if async_mode:
+        return enviar_job(
+            "segmentacion3d",
+            x_user_id,
+            lambda job: segmentar_serie_3d(
+                session_id,
+                user_id=x_user_id,
+                preset=preset,
+                thr_min=thr_min,
+                thr_max=thr_max,
+                min_size_voxels=min_size_voxels,
+                close_radius_mm=close_radius_mm,
+                blockwise=blockwise,
+                workers=workers,
+                closing_method=closing_method,
+                coarse_factor=coarse_factor,
+                open_radius_mm=open_radius_mm,
+                progress=job.report,
+            ),
+        )
     try:
         result = segmentar_serie_3d(
             session_id,
@@ -188,7 +324,115 @@ def segmentar_serie_3d_endpoint(
             thr_max=thr_max,
             min_size_voxels=min_size_voxels,
             close_radius_mm=close_radius_mm,
+            blockwise=blockwise,
+            workers=workers,
+            closing_method=closing_method,
+            coarse_factor=coarse_factor,
+            open_radius_mm=open_radius_mm,
         )
         return result
     except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
\ No newline at end of file
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@router.post("/segmentar-serie-3d-multi/")
+def segmentar_serie_3d_multi_endpoint(
+    session_id: str = Form(...),
+    x_user_id: int = Header(..., alias="X-User-Id"),
+    labels: str = Form(..., description="Presets y/o rangos nombre:min:max separados por comas, p.ej. ct_bone,ct_soft,grasa:-190:-30"),
+    min_size_voxels: Optional[int] = Form(2000),
+    close_radius_mm: Optional[str] = Form("1.5", description="Radio del cierre (mm): r o rz,ry,rx (por eje sólo con closing_method=edt)"),
+    blockwise: Optional[bool] = Form(None, description="Por bloques en Z (memoria acotada); vacío = automático"),
+    workers: Optional[int] = Form(None, ge=1, description="Hilos de filtrado/morfología; vacío = DICOM_SEG_WORKERS"),
+    closing_method: str = Form("ball", description=" | ".join(CLOSING_METHODS)),
+    open_radius_mm: Optional[str] = Form(None, description="Radio (mm) de una apertura EDT previa al cierre: r o rz,ry,rx; vacío = sin apertura"),
+    async_mode: bool = Query(False, alias="async", description="Encolar y consultar en /jobs/{id}"),
+):
+    """Una segmentación 3D (y fila en segmentacion3d) por etiqueta, con carga y binarización compartidas."""
+    if closing_method not in CLOSING_METHODS:
+        raise HTTPException(status_code=400, detail=f"closing_method inválido: {closing_method}")
+    radio = _parsear_radio(close_radius_mm, "close_radius_mm", closing_method)
+    close_radius_mm = 1.5 if radio is None else radio
+    open_radius_mm = _parsear_radio(open_radius_mm, "open_radius_mm") or 0.0
+    try:
+        etiquetas = etiquetas_multi(labels)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    def _segmentar(progress=None):
+        return segmentar_serie_3d_multi(
+            session_id,
+            user_id=x_user_id,
+            etiquetas=etiquetas,
+            min_size_voxels=min_size_voxels,
+            close_radius_mm=close_radius_mm,
+            blockwise=blockwise,
+            workers=workers,
+            closing_method=closing_method,
+            open_radius_mm=open_radius_mm,
+            progress=progress,
+        )
+
+    if async_mode:
+        return enviar_job("segmentacion3d", x_user_id, lambda job: _segmentar(job.report))
+    try:
+        return _segmentar()
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@router.post("/segmentar-region-3d/")
+def segmentar_region_3d_endpoint(
+    session_id: str = Form(...),
+    x_user_id: int = Header(..., alias="X-User-Id"),
+    seed: str = Form(..., description="Voxel semilla x,y,z (índices del volumen)"),
+    tolerance: Optional[float] = Form(None, ge=0.0, description="Crece por |v - v_semilla| <= tolerance"),
+    thr_min: Optional[float] = Form(None),
+    thr_max: Optional[float] = Form(None),
+    roi_mm: Optional[str] = Form(None, description="Semiejes (mm) de la caja alrededor de la semilla: r o x,y,z"),
+    connectivity: int = Form(1, ge=1, le=3),
+    close_radius_mm: Optional[str] = Form("0", description="Radio del cierre (mm): r o rz,ry,rx (por eje sólo con closing_method=edt)"),
+    closing_method: str = Form("ball", description=" | ".join(CLOSING_METHODS)),
+    open_radius_mm: Optional[str] = Form(None, description="Radio (mm) de una apertura EDT previa al cierre: r o rz,ry,rx; vacío = sin apertura"),
+):
+    """Segmentación 3D interactiva por crecimiento de región desde una semilla."""
+    semilla = _parsear_numeros(seed, "seed")
+    if any(not math.isfinite(v) or v != int(v) for v in semilla):
+        raise HTTPException(status_code=400, detail="seed debe ser de índices enteros")
+    caja = _parsear_numeros(roi_mm, "roi_mm", n=(1, 3))
+    if caja is not None and not all(math.isfinite(v) and v > 0 for v in caja):
+        raise HTTPException(status_code=400, detail="roi_mm debe ser positivo")
+    radio = _parsear_radio(close_radius_mm, "close_radius_mm", closing_method)
+    apertura = _parsear_radio(open_radius_mm, "open_radius_mm")
+    try:
+        return segmentar_region_3d(
+            session_id,
+            user_id=x_user_id,
+            seed=tuple(int(v) for v in semilla),
+            tolerance=tolerance,
+            thr_min=thr_min,
+            thr_max=thr_max,
+            roi_mm=None if caja is None else (caja[0] if len(caja) == 1 else caja),
+            connectivity=connectivity,
+            close_radius_mm=radio or 0.0,
+            closing_method=closing_method,
+            open_radius_mm=apertura or 0.0,
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@router.get("/volume-cache/stats")
+def volume_cache_stats():
+    return volume_lru.stats()
+
+
+@router.get("/segmentation-cache/stats")
+def segmentation_cache_stats():
+    return estadisticas_cache_segmentacion()
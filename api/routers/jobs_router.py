@@ -0,0 +1,59 @@
+# api/routers/jobs_router.py
+from typing import Callable, Optional
+from fastapi import APIRouter, HTTPException, Header, Path
+from fastapi.responses import JSONResponse
+
+from api.services.jobs_service import ColaLlenaError, job_manager
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+def enviar_job(kind: str, user_id: int, fn: Callable, cleanup: Optional[Callable] = None) -> JSONResponse:
+    """
+    Encola un trabajo y responde 202 con su id y la URL de consulta.
+    Si la cola está llena responde 429 (el cleanup se ejecuta igualmente).
+    """
+    try:
+        job = job_manager.submit(kind, user_id, fn, cleanup=cleanup)
+    except ColaLlenaError as e:
+        if cleanup is not None:
+            cleanup()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Trabajo encolado",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+        },
+    )
+
+
+def _job_del_usuario(job_id: str, x_user_id: int):
+    job = job_manager.get(job_id)
+    if job is None or job.user_id != int(x_user_id):
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.get("/stats")
+def estadisticas_jobs(x_user_id: int = Header(..., alias="X-User-Id")):
+    return job_manager.stats(x_user_id)
+
+
+@router.get("")
+def listar_jobs(x_user_id: int = Header(..., alias="X-User-Id")):
+    return [j.to_dict() for j in job_manager.list_for_user(x_user_id)]
+
+
+@router.get("/{job_id}")
+def estado_job(job_id: str = Path(...), x_user_id: int = Header(..., alias="X-User-Id")):
+    return _job_del_usuario(job_id, x_user_id).to_dict()
+
+
+@router.delete("/{job_id}")
+def cancelar_job(job_id: str = Path(...), x_user_id: int = Header(..., alias="X-User-Id")):
+    _job_del_usuario(job_id, x_user_id)
+    job = job_manager.cancel(job_id)
+    return job.to_dict()
@@ -7,6 +7,7 @@ from api.services.modelos3d_services import (
     listar_modelos3d,
     borrar_modelo3d,
 )
+from api.routers.jobs_router import enviar_job
 
 router = APIRouter(prefix="/series", tags=["Modelos3D"])
 
@@ -15,13 +16,23 @@ def export_stl(
     session_id: str = Path(...),
     x_user_id: int = Header(None, alias="X-User-Id"),
     seg3d_id_q: Optional[int] = Query(None, description="ID de segmentación 3D (query)"),
-    seg3d_id_f: Optional[int] = Form(None, description="ID de segmentación 3D (form)")
+    seg3d_id_f: Optional[int] = Form(None, description="ID de segmentación 3D (form)"),
+    async_mode: bool = Query(False, alias="async", description="Encolar y consultar en /jobs/{id}"),
 ):
     if not x_user_id:
         raise HTTPException(status_code=401, detail="Falta X-User-Id")
 
     seg3d_id = seg3d_id_f if seg3d_id_f is not None else seg3d_id_q  
 
+    if async_mode:
+        return enviar_job(
+            "export_stl",
+            int(x_user_id),
+            lambda job: exportar_stl_desde_seg3d(
+                session_id, int(x_user_id), seg3d_id, progress=job.report
+            ),
+        )
+
     try:
         return exportar_stl_desde_seg3d(session_id, int(x_user_id), seg3d_id)
     except ValueError as ve:
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Query
 from fastapi.responses import FileResponse
 from api.services.reportes_service import generar_reporte_estudio
+from api.routers.jobs_router import enviar_job
 from pathlib import Path
 
 router = APIRouter(prefix="/reportes", tags=["Reportes"])
@@ -8,9 +9,19 @@ router = APIRouter(prefix="/reportes", tags=["Reportes"])
 @router.post("/generar/{session_id}")
 def generar_reporte_endpoint(
     session_id: str,
-    x_user_id: int = Header(..., alias="X-User-Id")
+    x_user_id: int = Header(..., alias="X-User-Id"),
+    async_mode: bool = Query(False, alias="async", description="Encolar y consultar en /jobs/{id}"),
 ):
     """Genera un reporte PDF completo del estudio"""
+    if async_mode:
+        return enviar_job(
+            "reporte",
+            x_user_id,
+            lambda job: {
+                "message": "Reporte generado exitosamente",
+                "pdf_url": generar_reporte_estudio(session_id, x_user_id, progress=job.report),
+            },
+        )
     try:
         pdf_path = generar_reporte_estudio(session_id, x_user_id)
         return {"message": "Reporte generado exitosamente", "pdf_url": pdf_path}
@@ -0,0 +1,313 @@
+# api/routers/visor_router.py
+import os
+import re
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Path, Query
+from fastapi.responses import Response, StreamingResponse
+
+from api.services.decode_service import decode_stats
+from api.services.mpr_service import MPR_MODES, MPR_PLANES
+from api.services.preview_service import negociar_encoding, normalizar_encoding
+from api.services.visor_service import (
+    CACHE_CONTROL_INMUTABLE,
+    RAW_DTYPE,
+    RENDER_SIZE_MAX,
+    RENDER_SIZE_MIN,
+    bundle_serie,
+    datos_crudos,
+    etag_bundle,
+    etag_coincide,
+    etag_corte,
+    histograma_volumen,
+    info_volumen,
+    media_type,
+    parsear_nombre_corte,
+    render_corte,
+    render_mpr,
+    z_de_imagen,
+)
+from api.services.volume_cache_service import render_lru
+
+router = APIRouter(prefix="/series", tags=["Visor"])
+
+
+@router.get("/render-cache/stats")
+def render_cache_stats():
+    return render_lru.stats()
+
+
+@router.get("/decode/stats")
+def decode_stats_por_sintaxis():
+    """Throughput de decodificación por sintaxis de transferencia (desde el arranque)."""
+    return decode_stats.stats()
+
+
+@router.get("/{session_id}/slices/{slice_name}")
+def obtener_corte(
+    session_id: str = Path(...),
+    slice_name: str = Path(..., description="{idx}.png o image_{idx}.png (como en mapping.json); .webp/.jpg fuerzan formato"),
+    wl: Optional[float] = Query(None, description="Nivel de ventana (HU en CT)"),
+    ww: Optional[float] = Query(None, description="Ancho de ventana (HU en CT)"),
+    window: Optional[str] = Query(None, description="ct_bone | ct_brain | ct_soft | auto"),
+    size: Optional[int] = Query(None, ge=RENDER_SIZE_MIN, le=RENDER_SIZE_MAX, description="Lado mayor en px"),
+    fmt: Optional[str] = Query(None, description="png | webp | jpeg (si falta: según Accept)"),
+    quality: Optional[int] = Query(None, ge=1, le=100, description="Calidad webp/jpeg"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    headers = {"Cache-Control": CACHE_CONTROL_INMUTABLE}
+    try:
+        idx, ext = parsear_nombre_corte(slice_name)
+        if fmt is not None:
+            fmt = normalizar_encoding(fmt)
+        elif ext is not None and ext != "png":
+            fmt = ext
+        else:
+            # .png (nombre del mapping) o sin extensión: negociación por Accept
+            fmt = negociar_encoding(accept)
+            headers["Vary"] = "Accept"
+        etag = etag_corte(session_id, idx, wl, ww, window, size, fmt, quality)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+
+    headers["ETag"] = etag
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        content, _ = render_corte(session_id, idx, wl, ww, window, size, fmt, quality, etag=etag)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(content=content, media_type=media_type(fmt), headers=headers)
+
+
+@router.get("/{session_id}/volume")
+def obtener_info_volumen(session_id: str = Path(...)):
+    """Geometría del volumen y escala de los datos crudos (ver /raw)."""
+    try:
+        return info_volumen(session_id)
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+
+@router.get("/{session_id}/histogram")
+def obtener_histograma(
+    session_id: str = Path(...),
+    bins: int = Query(256, ge=2, le=4096, description="Bins del histograma devuelto"),
+):
+    """Histograma de intensidades, percentiles, Otsu y presets (selector de umbral)."""
+    try:
+        return histograma_volumen(session_id, bins)
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+
+@router.get("/{session_id}/raw")
+def obtener_datos_crudos(
+    session_id: str = Path(...),
+    z: Optional[int] = Query(None, ge=0, description="Primer corte (índice Z del volumen)"),
+    idx: Optional[int] = Query(None, ge=0, description="Alternativa a z: imagen image_{idx}.png del mapping"),
+    count: int = Query(1, ge=1, description="Número de cortes del bloque"),
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    Píxeles reescalados de un corte o bloque de cortes como int16 little-endian
+    (Z, Y, X), comprimidos con deflate (zlib) si el cliente lo acepta.
+    Valor real (HU en CT) = X-Dicom-Slope * crudo + X-Dicom-Intercept.
+    """
+    try:
+        info = info_volumen(session_id)
+        z0 = z_de_imagen(info, idx) if idx is not None else (z or 0)
+        deflate = "deflate" in (accept_encoding or "").lower()
+        content, etag = datos_crudos(info, z0, count, deflate=deflate)
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL_INMUTABLE,
+        "Vary": "Accept-Encoding",
+        "X-Dicom-Dtype": RAW_DTYPE,
+        "X-Dicom-Shape": ",".join(str(v) for v in [count] + info["shape"][1:]),
+        "X-Dicom-Spacing": ",".join(str(v) for v in info["spacing"]),
+        "X-Dicom-Slope": repr(info["slope"]),
+        "X-Dicom-Intercept": repr(info["intercept"]),
+        "X-Dicom-Z": str(z0),
+    }
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if deflate:
+        headers["Content-Encoding"] = "deflate"
+    return Response(content=content, media_type="application/octet-stream", headers=headers)
+
+
+def _parsear_vector(value: Optional[str], nombre: str):
+    if value is None:
+        return None
+    try:
+        return [float(c) for c in value.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{nombre} debe ser x,y,z")
+
+
+@router.get("/{session_id}/mpr")
+def obtener_mpr(
+    session_id: str = Path(...),
+    plane: str = Query("sagittal", description=" | ".join(MPR_PLANES)),
+    offset: Optional[float] = Query(None, description="Desplazamiento (mm) del plano a lo largo de su normal"),
+    normal: Optional[str] = Query(None, description="Plano oblicuo: normal x,y,z"),
+    center: Optional[str] = Query(None, description="Punto x,y,z (mm desde el primer voxel); por defecto el centro"),
+    thickness: float = Query(0.0, ge=0.0, description="Grosor del slab en mm (0 = plano)"),
+    mode: str = Query("avg", description=" | ".join(MPR_MODES)),
+    pixel: Optional[float] = Query(None, gt=0.0, description="Tamaño de píxel de salida en mm"),
+    wl: Optional[float] = Query(None),
+    ww: Optional[float] = Query(None),
+    window: Optional[str] = Query(None, description="ct_bone | ct_brain | ct_soft | auto"),
+    size: Optional[int] = Query(None, ge=RENDER_SIZE_MIN, le=RENDER_SIZE_MAX),
+    fmt: Optional[str] = Query(None, description="png | webp | jpeg (si falta: según Accept)"),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """Reconstrucción multiplanar del volumen (interpolada con el spacing real)."""
+    headers = {"Cache-Control": CACHE_CONTROL_INMUTABLE}
+    try:
+        if fmt is None:
+            fmt = negociar_encoding(accept)
+            headers["Vary"] = "Accept"
+        content, etag = render_mpr(
+            session_id,
+            plane=plane,
+            offset_mm=offset,
+            normal=_parsear_vector(normal, "normal"),
+            center=_parsear_vector(center, "center"),
+            thickness_mm=thickness,
+            mode=mode,
+            pixel_mm=pixel,
+            wl=wl,
+            ww=ww,
+            window=window,
+            size=size,
+            fmt=fmt,
+            quality=quality,
+            if_none_match=if_none_match,
+        )
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers["ETag"] = etag
+    if content is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type(fmt), headers=headers)
+
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _rango_pedido(range_header: Optional[str], total: int):
+    """
+    (inicio, fin inclusive) de una cabecera Range de un solo rango; None si no hay
+    Range o es de varios rangos (se responde completo). ValueError si no es satisfacible.
+    """
+    if not range_header:
+        return None
+    m = _RANGE.match(range_header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        inicio = int(m.group(1))
+        fin = min(int(m.group(2)), total - 1) if m.group(2) else total - 1
+    else:
+        inicio = max(total - int(m.group(2)), 0)  # sufijo: últimos N bytes
+        fin = total - 1
+    if inicio >= total or inicio > fin:
+        raise ValueError("Rango no satisfacible")
+    return inicio, fin
+
+
+def _leer_archivo(path: str, bloque: int = 1 << 20):
+    with open(path, "rb") as f:
+        while True:
+            datos = f.read(bloque)
+            if not datos:
+                return
+            yield datos
+
+
+@router.get("/{session_id}/bundle")
+def obtener_bundle(
+    session_id: str = Path(...),
+    start: int = Query(0, ge=0, description="Posición de la primera imagen (orden de idx)"),
+    count: Optional[int] = Query(None, ge=1, description="Número de imágenes (por defecto hasta el final)"),
+    fmt: Optional[str] = Query(None, description="png | webp | jpeg (por defecto la de la ingesta)"),
+    size: Optional[int] = Query(None, ge=RENDER_SIZE_MIN, le=RENDER_SIZE_MAX, description="Lado mayor en px"),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None, alias="If-Range"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    Vistas previas de la serie en una sola respuesta (ver bundle_serie para el
+    formato). Admite Range de un solo rango (206) para carga progresiva: el ETag se
+    calcula sin construir el bundle (304 directo) y los rangos se leen del binario
+    cacheado en disco.
+    """
+    try:
+        etag = etag_bundle(session_id, start, count, fmt, size, quality)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_INMUTABLE, "Accept-Ranges": "bytes"}
+        if etag_coincide(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        path, etag, _ = bundle_serie(session_id, start, count, fmt, size, quality)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except FileNotFoundError as fe:
+        raise HTTPException(status_code=404, detail=str(fe))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    total = os.path.getsize(path)
+    rango = None
+    if if_range is None or if_range.strip() == etag:
+        try:
+            rango = _rango_pedido(range_header, total)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{total}"
+            return Response(status_code=416, headers=headers)
+    if rango is None:
+        # Sin FileResponse: aplicaría su propio Range (multi-rango, If-Range) sobre el nuestro
+        headers["Content-Length"] = str(total)
+        return StreamingResponse(_leer_archivo(path), media_type="application/octet-stream", headers=headers)
+
+    inicio, fin = rango
+    with open(path, "rb") as f:
+        f.seek(inicio)
+        content = f.read(fin + 1 - inicio)
+    headers["Content-Range"] = f"bytes {inicio}-{fin}/{total}"
+    return Response(
+        content=content,
+        status_code=206,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
@@ -0,0 +1,320 @@
+# api/services/blockwise_service.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage.filters import threshold_otsu
+
+# Un bloque es un rango [z0, z1) de cortes del volumen
+Bloque = Tuple[int, int]
+# Fábrica de iteradores de valores (1-D) por bloque: cada pasada vuelve a recorrer el volumen
+Valores = Callable[[], Iterable[np.ndarray]]
+
+
+# ========= Planificación =========
+
+def planificar_bloques(nz: int, voxeles_plano: int, halo: int, presupuesto_bytes: int,
+                       bytes_voxel: int) -> List[Bloque]:
+    """
+    Reparte nz cortes en bloques [z0, z1) tales que un bloque con su halo
+    (halo cortes a cada lado) quepa en el presupuesto a bytes_voxel por voxel.
+    Siempre al menos un corte útil por bloque.
+    """
+    profundidad = int(presupuesto_bytes // max(1, voxeles_plano * bytes_voxel))
+    nucleo = max(1, profundidad - 2 * halo)
+    return [(z0, min(nz, z0 + nucleo)) for z0 in range(0, nz, nucleo)]
+
+
+def repartir_bloques(nz: int, partes: int) -> List[Bloque]:
+    """Reparte nz cortes en `partes` bloques consecutivos de tamaño casi igual (sin vacíos)."""
+    partes = max(1, min(int(partes), nz))
+    cortes = np.linspace(0, nz, partes + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(cortes[:-1], cortes[1:])]
+
+
+def en_paralelo(fn: Callable, items: Sequence, workers: int = 1) -> list:
+    """
+    [fn(x) for x in items] en un pool de hilos de `workers` hilos (1 = en el hilo actual).
+    Para kernels de scipy/skimage que liberan el GIL (filtros, morfología, label).
+    """
+    if workers <= 1 or len(items) <= 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def con_halo(vol: np.ndarray, z0: int, z1: int, halo: int) -> Tuple[np.ndarray, slice]:
+    """Bloque [z0-halo, z1+halo) (recortado al volumen) y el slice del núcleo dentro de él."""
+    a = max(0, z0 - halo)
+    b = min(vol.shape[0], z1 + halo)
+    return np.asarray(vol[a:b]), slice(z0 - a, z0 - a + (z1 - z0))
+
+
+def filtrar_por_bloques(fuente: np.ndarray, destino: np.ndarray, bloques: Sequence[Bloque],
+                        halo: int, fn: Callable[[np.ndarray], np.ndarray], workers: int = 1) -> None:
+    """
+    destino = fn(fuente) bloque a bloque. Exacto si fn es local con alcance <= halo
+    cortes en Z (filtros, morfología): el halo aporta el contexto de los vecinos y
+    en los extremos del volumen el bloque termina donde termina el volumen.
+    Con workers > 1 los bloques se procesan a la vez en hilos (cada uno escribe
+    sólo su núcleo, así que el resultado no depende del orden).
+    """
+    def _bloque(zz):
+        bloque, nucleo = con_halo(fuente, zz[0], zz[1], halo)
+        destino[zz[0]:zz[1]] = fn(bloque)[nucleo]
+
+    en_paralelo(_bloque, list(bloques), workers)
+
+
+# ========= Estadísticas exactas por bloques =========
+
+def _claves(x: np.ndarray) -> np.ndarray:
+    """Claves enteras sin signo con el mismo orden que los floats (sin NaN)."""
+    bits = x.dtype.itemsize * 8
+    u = x.view(np.uint32 if bits == 32 else np.uint64)
+    signo = u >> np.array(bits - 1, dtype=u.dtype)
+    return np.where(signo == 1, ~u, u | (np.array(1, dtype=u.dtype) << np.array(bits - 1, dtype=u.dtype)))
+
+
+def _desde_clave(clave: int, dtype) -> np.generic:
+    dtype = np.dtype(dtype)
+    bits = dtype.itemsize * 8
+    tipo = np.uint32 if bits == 32 else np.uint64
+    k = tipo(clave)
+    alto = tipo(1) << tipo(bits - 1)
+    u = (k ^ alto) if (k & alto) else ~k
+    return np.array(u, dtype=tipo).view(dtype)[()]
+
+
+def k_esimos(valores: Valores, ks: Sequence[int], dtype) -> dict:
+    """
+    Estadísticos de orden exactos {k: k-ésimo menor valor} sin ordenar ni juntar los
+    datos: selección por radix sobre claves ordenables, 16 bits por pasada
+    (2 pasadas en float32, 4 en float64). Memoria: un histograma de 65536 por k.
+    """
+    bits = np.dtype(dtype).itemsize * 8
+    pendientes = {int(k): [0, int(k)] for k in ks}  # k -> [prefijo, rango restante]
+    for paso in range(bits // 16):
+        desplazamiento = bits - 16 * (paso + 1)
+        prefijos = sorted({p for p, _ in pendientes.values()})
+        hist = {p: np.zeros(65536, dtype=np.int64) for p in prefijos}
+        for bloque in valores():
+            claves = _claves(np.ascontiguousarray(bloque, dtype=dtype))
+            digitos = (claves >> desplazamiento) & 0xFFFF
+            altos = claves >> (desplazamiento + 16) if paso else None
+            for p in prefijos:
+                sel = digitos if altos is None else digitos[altos == p]
+                hist[p] += np.bincount(sel.astype(np.intp), minlength=65536)
+        for estado in pendientes.values():
+            acumulado = np.cumsum(hist[estado[0]])
+            digito = int(np.searchsorted(acumulado, estado[1], side="right"))
+            estado[1] -= int(acumulado[digito - 1]) if digito else 0
+            estado[0] = (estado[0] << 16) | digito
+    return {k: _desde_clave(p, dtype) for k, (p, _) in pendientes.items()}
+
+
+def contar(valores: Valores) -> int:
+    return int(sum(np.asarray(b).size for b in valores()))
+
+
+def rango(valores: Valores):
+    """(min, max) de todos los valores (None si no hay ninguno)."""
+    mn = mx = None
+    for b in valores():
+        if b.size:
+            bmn, bmx = b.min(), b.max()
+            mn = bmn if mn is None else min(mn, bmn)
+            mx = bmx if mx is None else max(mx, bmx)
+    return mn, mx
+
+
+def _lerp(a, b, t):
+    # Igual que numpy (_lerp de np.percentile), para que el resultado sea idéntico bit a bit
+    diff_b_a = np.subtract(b, a)
+    interp = np.asanyarray(np.add(a, diff_b_a * t))
+    np.subtract(b, diff_b_a * (1 - t), out=interp, where=t >= 0.5,
+                casting="unsafe", dtype=type(interp.dtype))
+    return interp[()] if interp.ndim == 0 else interp
+
+
+def percentil(valores: Valores, q, dtype, n: Optional[int] = None):
+    """
+    np.percentile(v, q) (método linear) de los valores v repartidos en bloques, sin
+    juntarlos: mismos índices virtuales, tipos y redondeo que numpy, así que el
+    resultado es idéntico al de la versión en memoria (escalar o array según q).
+    """
+    n = contar(valores) if n is None else n
+    return percentil_por_orden(lambda ks: k_esimos(valores, ks, dtype), q, dtype, n)
+
+
+def percentil_por_orden(k_esimos_fn: Callable[[set], dict], q, dtype, n: int):
+    """
+    np.percentile (método linear) de n valores de tipo dtype dados sus estadísticos
+    de orden: k_esimos_fn(ks) -> {k: k-ésimo menor valor} (por bloques, histograma...).
+    """
+    dtype = np.dtype(dtype)
+    if n == 0:
+        raise ValueError("percentil de un conjunto vacío")
+    q = np.asanyarray(np.true_divide(q, dtype.type(100)))
+    virtual = np.asanyarray((n - 1) * q)
+    previo = np.asanyarray(np.floor(virtual))
+    siguiente = np.asanyarray(previo + 1)
+    previo[virtual >= n - 1] = n - 1
+    siguiente[virtual >= n - 1] = n - 1
+    previo[virtual < 0] = 0
+    siguiente[virtual < 0] = 0
+    previo = previo.astype(np.intp)
+    siguiente = siguiente.astype(np.intp)
+    # numpy usa -1 (último) en los índices fuera de rango: gamma se calcula con ese -1
+    previo_np = np.where(virtual >= n - 1, -1, previo)
+    orden = k_esimos_fn(set(previo.ravel().tolist()) | set(siguiente.ravel().tolist()))
+    a = np.asarray([orden[int(k)] for k in previo.ravel()], dtype=dtype).reshape(previo.shape)
+    b = np.asarray([orden[int(k)] for k in siguiente.ravel()], dtype=dtype).reshape(siguiente.shape)
+    gamma = np.asanyarray(np.asanyarray(virtual - previo_np), dtype=virtual.dtype)
+    if a.ndim == 0:
+        a, b = a[()], b[()]
+    return _lerp(a, b, gamma)
+
+
+def otsu_histograma(cuentas: np.ndarray, valores: np.ndarray, nbins: int = 256) -> float:
+    """
+    threshold_otsu de un conjunto dado como valores distintos (ordenados) y sus
+    cuentas: mismo histograma que otsu()/threshold_otsu con todos los valores.
+    """
+    presentes = cuentas > 0
+    cuentas, valores = cuentas[presentes], valores[presentes]
+    if cuentas.size == 0:
+        raise ValueError("Otsu de un conjunto vacío")
+    mn, mx = valores[0], valores[-1]
+    if mn == mx:
+        return mn
+    hist, bordes = np.histogram(valores, bins=nbins, range=(mn.item(), mx.item()), weights=cuentas)
+    centros = (bordes[:-1] + bordes[1:]) / 2.0
+    return threshold_otsu(hist=(hist.astype(np.int64), centros))
+
+
+def otsu(valores: Valores, nbins: int = 256) -> float:
+    """
+    threshold_otsu(v) de los valores v repartidos en bloques: mismo rango, bins y
+    histograma (np.histogram sobre [min, max]) que skimage con la imagen completa.
+    Lanza ValueError si no hay valores, como threshold_otsu con un array vacío.
+    """
+    mn, mx = rango(valores)
+    if mn is None:
+        raise ValueError("Otsu de un conjunto vacío")
+    if mn == mx:
+        return mn
+    cuentas = np.zeros(nbins, dtype=np.int64)
+    bordes = None
+    for b in valores():
+        h, bordes = np.histogram(b, bins=nbins, range=(mn.item(), mx.item()))
+        cuentas += h
+    centros = (bordes[:-1] + bordes[1:]) / 2.0
+    return threshold_otsu(hist=(cuentas, centros))
+
+
+# ========= Componentes conexas por bloques =========
+
+def _pares_frontera(anterior: np.ndarray, actual: np.ndarray, estructura: np.ndarray) -> np.ndarray:
+    """Pares (etiqueta del plano anterior, etiqueta del plano actual) conectados por `estructura`."""
+    ny, nx = actual.shape
+    pares = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if not estructura[0, 1 + dy, 1 + dx]:
+                continue
+            ya, yb = slice(max(0, dy), ny + min(0, dy)), slice(max(0, -dy), ny + min(0, -dy))
+            xa, xb = slice(max(0, dx), nx + min(0, dx)), slice(max(0, -dx), nx + min(0, -dx))
+            a, b = anterior[ya, xa], actual[yb, xb]
+            sel = (a > 0) & (b > 0)
+            if sel.any():
+                pares.append(np.stack([a[sel], b[sel]], axis=1))
+    if not pares:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pares), axis=0)
+
+
+class ComponentesPorBloques:
+    """
+    Etiquetado conexo (scipy.ndimage.label) de una máscara 3D leída por bloques en Z.
+    Cada bloque se etiqueta por separado y las etiquetas que se tocan a través de la
+    frontera entre bloques se unen (grafo de pares + connected_components), así que
+    las componentes son las mismas que con el volumen completo.
+      - tamanos[c]: voxeles de la componente c
+      - primera[c]: su menor etiqueta local = su primer voxel en orden raster (como
+        ndi.label/measure.label numeran), para desempatar igual que en memoria
+      - borde[c]: si toca alguna cara del volumen
+    etiquetas(i, mascara) devuelve la componente de cada voxel del bloque i
+    (se re-etiqueta el bloque, que debe ser el mismo contenido de la primera pasada).
+    """
+
+    def __init__(self, leer: Callable[[int, int], np.ndarray], bloques: Sequence[Bloque],
+                 nz: int, estructura: np.ndarray, workers: int = 1):
+        self.bloques = list(bloques)
+        self.estructura = estructura
+
+        def _etiquetar(zz):
+            # Etiquetas locales del bloque: tamaños, las que tocan el borde y los planos extremos
+            z0, z1 = zz
+            etiquetas, n = ndi.label(leer(z0, z1), structure=estructura)
+            caras = [etiquetas[:, 0, :], etiquetas[:, -1, :], etiquetas[:, :, 0], etiquetas[:, :, -1]]
+            if z0 == 0:
+                caras.append(etiquetas[0])
+            if z1 == nz:
+                caras.append(etiquetas[-1])
+            en_borde = np.unique(np.concatenate([c.ravel() for c in caras]))
+            tamanos = np.bincount(etiquetas.ravel(), minlength=n + 1)[1:].astype(np.int64)
+            return n, tamanos, en_borde[en_borde > 0], etiquetas[0].copy(), etiquetas[-1].copy()
+
+        por_bloque = en_paralelo(_etiquetar, self.bloques, workers)
+        self.offsets = np.concatenate([[0], np.cumsum([r[0] for r in por_bloque])[:-1]]).astype(np.int64).tolist()
+        total = sum(r[0] for r in por_bloque)
+
+        def _glob(plano, offset):
+            return np.where(plano > 0, plano.astype(np.int64) + offset, 0)
+
+        pares = [
+            _pares_frontera(_glob(anterior[4], off_a), _glob(actual[3], off_b), estructura)
+            for anterior, actual, off_a, off_b in zip(por_bloque, por_bloque[1:], self.offsets, self.offsets[1:])
+        ]
+        en_borde = [r[2].astype(np.int64) + off for r, off in zip(por_bloque, self.offsets)]
+
+        n_nodos = total + 1
+        pares = np.concatenate(pares) if pares else np.empty((0, 2), dtype=np.int64)
+        grafo = coo_matrix(
+            (np.ones(len(pares), dtype=np.int8), (pares[:, 0], pares[:, 1])), shape=(n_nodos, n_nodos)
+        )
+        self.n_componentes, self.componente = connected_components(grafo, directed=False)
+        self.componente = self.componente.astype(np.int64)
+        tamanos_locales = [np.zeros(1, dtype=np.int64)] + [r[1] for r in por_bloque]
+        self.tamanos = np.bincount(self.componente, weights=np.concatenate(tamanos_locales),
+                                   minlength=self.n_componentes).astype(np.int64)
+        self.primera = np.full(self.n_componentes, n_nodos, dtype=np.int64)
+        np.minimum.at(self.primera, self.componente, np.arange(n_nodos))
+        self.borde = np.zeros(self.n_componentes, dtype=bool)
+        self.borde[self.componente[np.concatenate(en_borde + [np.zeros(0, dtype=np.int64)])]] = True
+        # El nodo 0 es el fondo: nunca es una componente
+        self.fondo = int(self.componente[0])
+        self.tamanos[self.fondo] = 0
+        self.borde[self.fondo] = False
+
+    def etiquetas(self, i: int, mascara: np.ndarray) -> np.ndarray:
+        etiquetas, _ = ndi.label(mascara, structure=self.estructura)
+        glob = np.where(etiquetas > 0, etiquetas.astype(np.int64) + self.offsets[i], 0)
+        return self.componente[glob]
+
+    def mayor(self) -> Optional[int]:
+        """Componente más grande (empate: la de menor etiqueta, como np.argmax en memoria)."""
+        if self.tamanos.max(initial=0) == 0:
+            return None
+        maximo = self.tamanos.max()
+        candidatas = np.flatnonzero(self.tamanos == maximo)
+        return int(candidatas[np.argmin(self.primera[candidatas])])
+
+
+def iterar_bloques(vol: np.ndarray, bloques: Sequence[Bloque]) -> Iterator[np.ndarray]:
+    for z0, z1 in bloques:
+        yield np.asarray(vol[z0:z1])
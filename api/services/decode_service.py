@@ -0,0 +1,284 @@
+# api/services/decode_service.py
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.filereader import read_file_meta_info
+from pydicom.pixels import get_decoder, iter_pixels, pixel_array
+from pydicom.dataset import FileMetaDataset
+from pydicom.uid import UID, ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian
+
+from config.settings import DECODE_PLUGINS, DECODE_WORKERS
+
+# Mínimo de frames por tarea al repartir un multi-frame entre varios procesos
+FRAMES_POR_TAREA_MIN = 8
+
+
+def contexto_procesos():
+    """
+    Contexto para los pools de procesos. Se llaman desde hilos del servidor y de
+    jobs: un fork heredaría locks tomados por otros hilos y el hijo podría quedar
+    bloqueado, así que se arranca con forkserver (spawn donde no existe).
+    """
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+
+def numero_frames(ds) -> int:
+    try:
+        return max(1, int(getattr(ds, "NumberOfFrames", 1) or 1))
+    except Exception:
+        return 1
+
+
+def sintaxis_transferencia(ds) -> str:
+    """TransferSyntaxUID del File Meta ('' si falta, p.ej. archivos sin preámbulo)."""
+    meta = getattr(ds, "file_meta", None)
+    return str(getattr(meta, "TransferSyntaxUID", "") or "")
+
+
+def _completar_sintaxis(ds) -> None:
+    """
+    Archivos sin File Meta (sin preámbulo DICM): pydicom no decodifica sin
+    TransferSyntaxUID; se deduce de la codificación con la que se leyó el dataset.
+    """
+    if sintaxis_transferencia(ds):
+        return
+    implicit, little = getattr(ds, "original_encoding", (None, None))
+    if implicit is None:
+        return
+    if not hasattr(ds, "file_meta"):
+        ds.file_meta = FileMetaDataset()
+    if implicit:
+        ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    else:
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian if little else ExplicitVRBigEndian
+
+
+def sintaxis_archivo(path: str) -> str:
+    """TransferSyntaxUID leyendo sólo el File Meta del archivo ('' si no se puede)."""
+    try:
+        return str(read_file_meta_info(path).get("TransferSyntaxUID", "") or "")
+    except Exception:
+        return ""
+
+
+def es_comprimida(ts: str) -> bool:
+    return bool(ts) and UID(ts).is_compressed
+
+
+@lru_cache(maxsize=64)
+def plugin_decodificador(ts: str) -> str:
+    """
+    Plugin de pydicom con el que se decodifica la sintaxis `ts`: el primero de
+    DECODE_PLUGINS que esté instalado y la soporte. '' = elección por defecto de
+    pydicom (sintaxis nativas, desconocidas o sin plugin preferido instalado).
+    """
+    if not es_comprimida(ts):
+        return ""
+    try:
+        disponibles = get_decoder(UID(ts)).available_plugins
+    except Exception:
+        return ""
+    for nombre in (p.strip() for p in DECODE_PLUGINS.split(",")):
+        if nombre in disponibles:
+            return nombre
+    return ""
+
+
+def _nombre_sintaxis(ts: str) -> str:
+    if not ts:
+        return "desconocida"
+    uid = UID(ts)
+    return uid.name if uid.is_transfer_syntax else ts
+
+
+class DecodeStats:
+    """Contadores de decodificación por sintaxis de transferencia (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_sintaxis: Dict[str, dict] = {}
+
+    def registrar(self, ts: str, plugin: str, frames: int, nbytes: int, segundos: float) -> None:
+        with self._lock:
+            c = self._por_sintaxis.setdefault(ts, {"plugin": plugin, "frames": 0, "bytes": 0, "seconds": 0.0})
+            c["plugin"] = plugin
+            c["frames"] += frames
+            c["bytes"] += nbytes
+            c["seconds"] += segundos
+
+    def fusionar(self, contadores: Dict[str, dict]) -> None:
+        """Suma contadores de otro proceso (ver `contadores`)."""
+        for ts, c in (contadores or {}).items():
+            self.registrar(ts, c["plugin"], c["frames"], c["bytes"], c["seconds"])
+
+    def contadores(self) -> Dict[str, dict]:
+        """Copia serializable de los contadores (para devolverla desde un worker)."""
+        with self._lock:
+            return {ts: dict(c) for ts, c in self._por_sintaxis.items()}
+
+    def stats(self) -> dict:
+        out = {}
+        for ts, c in self.contadores().items():
+            s = c["seconds"]
+            out[ts or "desconocida"] = {
+                "name": _nombre_sintaxis(ts),
+                "plugin": c["plugin"] or "pydicom",
+                "frames": c["frames"],
+                "mb": round(c["bytes"] / 1e6, 3),
+                "seconds": round(s, 4),
+                "frames_s": round(c["frames"] / s, 1) if s > 0 else None,
+                "mb_s": round(c["bytes"] / 1e6 / s, 1) if s > 0 else None,
+            }
+        return out
+
+
+# Métricas del proceso (los workers de ingesta devuelven las suyas y se fusionan aquí)
+decode_stats = DecodeStats()
+
+
+def _pixel_array(ds, plugin: str) -> np.ndarray:
+    if plugin:
+        try:
+            return pixel_array(ds, decoding_plugin=plugin)
+        except Exception as e:
+            print(f"⚠️ Plugin {plugin} falló ({e}); se usa la elección por defecto de pydicom")
+    return ds.pixel_array
+
+
+def iterar_frames(path: str, frames: Optional[List[int]] = None,
+                  ds=None, stats: Optional[DecodeStats] = decode_stats
+                  ) -> Iterator[Tuple[Optional[int], np.ndarray]]:
+    """
+    Decodifica un DICOM frame a frame: genera (frame, pixels) sin materializar
+    todos los frames a la vez (pydicom.pixels.iter_pixels lee cada frame del disco).
+      - frames=None: todos los frames del archivo.
+      - frames=[i, j, ...]: sólo esos frames (ordenados, sin repetir).
+    En archivos de un solo frame se genera (None, pixel_array).
+    ds: cabecera ya leída (opcional, evita releerla).
+    El plugin se elige según la sintaxis de transferencia (plugin_decodificador)
+    y el tiempo de cada frame se suma a `stats` (None: no se registra).
+    """
+    if ds is None:
+        # PixelData diferido: la cabecera se lee una vez y los píxeles al decodificar
+        ds = pydicom.dcmread(path, force=True, defer_size="1 KB")
+    ts = sintaxis_transferencia(ds)
+    plugin = plugin_decodificador(ts)
+
+    def _registrar(arr, t0):
+        if stats is not None:
+            stats.registrar(ts, plugin, 1, arr.nbytes, time.perf_counter() - t0)
+
+    n_frames = numero_frames(ds)
+    if n_frames <= 1:
+        t0 = time.perf_counter()
+        full = ds if "PixelData" in ds else pydicom.dcmread(path, force=True)
+        _completar_sintaxis(full)
+        arr = _pixel_array(full, plugin)
+        _registrar(arr, t0)
+        yield None, arr
+        return
+
+    indices = list(range(n_frames)) if frames is None else sorted(set(int(f) for f in frames))
+    entregados = 0
+    try:
+        it = zip(indices, iter_pixels(path, indices=indices, decoding_plugin=plugin))
+        while True:
+            t0 = time.perf_counter()
+            siguiente = next(it, None)
+            if siguiente is None:
+                break
+            _registrar(siguiente[1], t0)
+            entregados += 1
+            yield siguiente
+    except Exception as e:
+        if entregados:
+            raise
+        # Respaldo (p.ej. archivo sin File Meta): decodificación completa del archivo
+        print(f"⚠️ iter_pixels no disponible para {path} ({e}); se decodifica completo")
+        t0 = time.perf_counter()
+        full = pydicom.dcmread(path, force=True)
+        _completar_sintaxis(full)
+        full = full.pixel_array
+        if stats is not None:
+            stats.registrar(ts, "", len(indices), full[indices].nbytes, time.perf_counter() - t0)
+        for frame in indices:
+            yield frame, full[frame]
+
+
+def _decodificar_tarea(tarea: tuple) -> tuple:
+    """
+    Worker del pool: decodifica los frames pedidos de un archivo.
+    Devuelve (path, [(frame, pixels), ...], contadores, error).
+    """
+    path, frames = tarea
+    local = DecodeStats()
+    try:
+        return path, list(iterar_frames(path, frames, stats=local)), local.contadores(), None
+    except Exception as e:
+        return path, [], local.contadores(), str(e)
+
+
+def _repartir(pedidos: List[Tuple[str, Optional[List[int]]]], workers: int) -> list:
+    """Una tarea por archivo; los multi-frame grandes se parten en bloques de frames."""
+    tareas = []
+    for path, frames in pedidos:
+        if frames is None or len(frames) < 2 * FRAMES_POR_TAREA_MIN:
+            tareas.append((path, frames))
+            continue
+        frames = sorted(set(frames))
+        n = min(workers, len(frames) // FRAMES_POR_TAREA_MIN)
+        paso = -(-len(frames) // n)
+        tareas.extend((path, frames[i:i + paso]) for i in range(0, len(frames), paso))
+    return tareas
+
+
+def decodificar_paralelo(
+    pedidos: List[Tuple[str, Optional[List[int]]]],
+    workers: Optional[int] = None,
+) -> Dict[Tuple[str, Optional[int]], np.ndarray]:
+    """
+    Decodifica varios archivos: pedidos = [(path, frames | None), ...] (frames como
+    en iterar_frames). Devuelve {(path, frame): pixels}; los archivos que no se
+    pueden decodificar se avisan y no aparecen en el resultado.
+    Las sintaxis comprimidas (JPEG, JPEG 2000, RLE...) se reparten en un pool de
+    procesos (los decodificadores no liberan el GIL); las nativas se leen en el
+    proceso actual, donde el coste es sólo E/S y copiar los píxeles de vuelta no compensa.
+    """
+    workers = DECODE_WORKERS if workers is None else workers
+    tareas = _repartir(pedidos, max(1, workers))
+    if not tareas:
+        return {}
+    n_workers = max(1, min(workers, len(tareas)))
+    if n_workers > 1 and not es_comprimida(sintaxis_archivo(tareas[0][0])):
+        n_workers = 1
+
+    if n_workers > 1:
+        pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=contexto_procesos())
+        try:
+            resultados = list(pool.map(_decodificar_tarea, tareas))
+        finally:
+            pool.shutdown(cancel_futures=True)
+        for _, _, contadores, _ in resultados:
+            decode_stats.fusionar(contadores)
+    else:
+        resultados = []
+        for path, frames in tareas:
+            try:
+                resultados.append((path, list(iterar_frames(path, frames)), None, None))
+            except Exception as e:
+                resultados.append((path, [], None, str(e)))
+
+    out = {}
+    for path, decodificados, _, error in resultados:
+        if error is not None:
+            print(f"⚠️ No se pudo decodificar {path}: {error}")
+        for frame, arr in decodificados:
+            out[(path, frame)] = arr
+    return out
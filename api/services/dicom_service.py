@@ -2,108 +2,415 @@
 import json
 import os
 import io
+import shutil
+import time
 import uuid
 import zipfile
-from typing import List
-from skimage import exposure
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Union
 import pydicom
 from PIL import Image
-import numpy as np
 
-from .segmentation_services import get_or_create_archivo_dicom
+from config.settings import INGEST_WORKERS, PREVIEW_ENCODINGS, PREVIEW_MODE, PREVIEW_QUALITY, UPLOAD_CHUNK_BYTES
+from .decode_service import DecodeStats, contexto_procesos, decode_stats, iterar_frames, numero_frames
+from .manifest_service import entradas_manifest, guardar_manifest, sha1_archivo
+from .preview_service import PREVIEW_ENCODINGS as ENCODINGS, PREVIEW_MODES, codificar_preview, lista_encodings, render_preview
+from .segmentation_services import registrar_archivos_dicom_bulk
+from .visor_service import url_corte
 
+# "none": no se generan PNG en la ingesta; el visor los renderiza bajo demanda
+INGEST_PREVIEW_MODES = PREVIEW_MODES + ("none",)
 
-def convert_dicom_zip_to_png_paths(zip_file: bytes, user_id: int) -> dict:
+
+def _render_slice(task: tuple) -> dict:
+    """
+    Decodifica un DICOM ya extraído a disco, genera su vista previa y la guarda en
+    cada codificación pedida (p.ej. image_{idx}.webp).
+    Un multi-frame genera una imagen por frame (image_{idx}, image_{idx+1}, ...)
+    y se decodifica frame a frame, sin materializar todos los frames a la vez.
+    Se ejecuta tanto en el proceso principal (modo secuencial) como en el pool de procesos,
+    por eso vive a nivel de módulo y sólo recibe/devuelve tipos serializables.
+    """
+    idx, n_frames, dicom_name, dicom_path, output_dir, preview_mode, preview_window, encodings, quality = task
+    result = {"idx": idx, "dicom_name": dicom_name, "ok": False, "manifest": None,
+              "decode_s": 0.0, "render_s": 0.0, "write_s": 0.0, "decode_stats": None}
+    # Métricas propias: en el pool de procesos no llegan a decode_stats del proceso principal
+    stats = DecodeStats()
+    try:
+        # Leer DICOM (PixelData diferido: se lee al decodificar cada frame)
+        t0 = time.perf_counter()
+        ds = pydicom.dcmread(dicom_path, force=True, defer_size="1 KB")
+        if "PixelData" not in ds:
+            print(f"⚠️ Archivo sin datos de imagen: {dicom_name}")
+            result["decode_s"] = time.perf_counter() - t0
+            return result
+        entries = entradas_manifest(ds, os.path.basename(dicom_name), sha1=sha1_archivo(dicom_path))
+        if len(entries) != n_frames:
+            raise ValueError(f"{len(entries)} frames, se esperaban {n_frames}")
+        result["manifest"] = entries
+        if preview_mode == "none":
+            result.update(ok=True, decode_s=time.perf_counter() - t0)
+            return result
+
+        frames = iterar_frames(dicom_path, ds=ds, stats=stats)
+        for k, meta in enumerate(entries):
+            frame, pixels = next(frames)
+            t1 = time.perf_counter()
+
+            # === Generar imagen de vista previa (ventana LUT o CLAHE) ===
+            image = render_preview(
+                pixels,
+                modality=meta["modality"],
+                slope=meta["slope"] if meta["slope"] is not None else 1.0,
+                intercept=meta["intercept"] if meta["intercept"] is not None else 0.0,
+                mode=preview_mode,
+                window=preview_window,
+            )
+            im = Image.fromarray(image).convert("L")
+            t2 = time.perf_counter()
+
+            # Guardar en cada codificación pedida (las demás se sirven bajo demanda)
+            base_path = os.path.join(output_dir, f"image_{idx + k}")
+            for fmt in encodings:
+                with open(base_path + ENCODINGS[fmt][2], "wb") as f:
+                    f.write(codificar_preview(im, fmt, quality))
+            t3 = time.perf_counter()
+
+            result["decode_s"] += t1 - t0
+            result["render_s"] += t2 - t1
+            result["write_s"] += t3 - t2
+            t0 = t3
+
+        result["ok"] = True
+    except Exception as e:
+        print(f"⚠️ Error procesando {dicom_name}: {e}")
+    result["decode_stats"] = stats.contadores()
+    return result
+
+
+def es_dicom(cabecera: bytes) -> bool:
+    """Archivo DICOM Part 10: preámbulo de 128 bytes seguido de 'DICM'."""
+    return len(cabecera) >= 132 and cabecera[128:132] == b"DICM"
+
+
+def _leer_cabecera(archive: zipfile.ZipFile, nombre: str):
+    """
+    Cabecera (sin píxeles) de un miembro del ZIP, o None si no es una imagen DICOM.
+    Sólo se descomprime hasta PixelData. Los archivos sin preámbulo (exportaciones
+    antiguas) se aceptan si su cabecera describe una imagen.
+    """
+    with archive.open(nombre) as f:
+        preambulo = f.read(132)
+        f.seek(0)
+        if es_dicom(preambulo):
+            ds = pydicom.dcmread(f, stop_before_pixels=True)
+        else:
+            ds = pydicom.dcmread(f, force=True, stop_before_pixels=True)
+            if "SOPClassUID" not in ds:
+                return None
+    return ds if "Rows" in ds else None
+
+
+def preescanear_zip(archive: zipfile.ZipFile) -> List[dict]:
+    """
+    Pre-escaneo de sólo cabeceras: identifica los miembros DICOM del ZIP (por el
+    preámbulo, no por la extensión) sin decodificar píxeles ni extraerlos a disco.
+    Devuelve, en el orden del ZIP, {name, frames, series_uid, modality, description, samples}.
+    """
+    cabeceras = []
+    for nombre in archive.namelist():
+        if nombre.endswith("/") or os.path.basename(nombre).upper() == "DICOMDIR":
+            continue
+        try:
+            ds = _leer_cabecera(archive, nombre)
+        except Exception:
+            ds = None
+        if ds is None:
+            print(f"⚠️ Omitido (no es una imagen DICOM): {nombre}")
+            continue
+        cabeceras.append({
+            "name": nombre,
+            "frames": numero_frames(ds),
+            "series_uid": str(getattr(ds, "SeriesInstanceUID", "") or ""),
+            "modality": str(getattr(ds, "Modality", "")).upper(),
+            "description": str(getattr(ds, "SeriesDescription", "") or ""),
+            "samples": int(getattr(ds, "SamplesPerPixel", 1) or 1),
+        })
+    return cabeceras
+
+
+def agrupar_por_serie(cabeceras: List[dict]) -> List[List[dict]]:
+    """
+    Una sesión por SeriesInstanceUID, en el orden en que aparece cada serie en el ZIP.
+    Dentro de una serie, resolución y orientación se resuelven al armar el volumen
+    (ver _seleccionar_cortes): un localizador con el mismo UID no abre otra sesión.
+    """
+    grupos = {}
+    for c in cabeceras:
+        grupos.setdefault(c["series_uid"], []).append(c)
+    return list(grupos.values())
+
+
+def _serie_principal(series: List[dict]) -> dict:
+    """La serie que se abre en el visor: la volumétrica (no SC/RGB) con más imágenes."""
+    return max(series, key=lambda s: (s["modality"] != "SC" and s["samples"] == 1, s["images"]))
+
+
+def convert_dicom_zip_to_png_paths(
+    zip_file: Union[bytes, str],
+    user_id: int,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+    preview_mode: Optional[str] = None,
+    preview_window: Optional[str] = None,
+    preview_encodings=None,
+    preview_quality: Optional[int] = None,
+) -> dict:
     """
     Convierte un archivo ZIP con múltiples DICOMs en imágenes PNG y genera mapping.json
+
+    - zip_file: ruta al ZIP en disco (recomendado: los miembros se extraen uno a uno
+      por bloques y la memoria no depende del tamaño del ZIP) o su contenido en bytes.
+    - workers: procesos usados para decodificar y renderizar los cortes
+      (None = config.settings.INGEST_WORKERS, <= 1 = secuencial en el hilo actual).
+    - progress: callback opcional progress(fraccion, etapa) (usado por los trabajos
+      en segundo plano; puede lanzar una excepción para cancelar).
+    - preview_mode: "lut" (ventana/nivel por modalidad, rápido), "clahe" (calidad) o
+      "none" (sin PNG: las URLs del mapping apuntan a /series/{id}/slices/, que
+      renderiza cada corte bajo demanda); None = config.settings.PREVIEW_MODE.
+      preview_window: preset de ventana CT (ct_bone/ct_brain/ct_soft) o "auto".
+    - preview_encodings: codificaciones a guardar en orden de preferencia
+      ("webp", ["jpeg"], "webp,png", ...; las demás las sirve /series/{id}/slices/
+      bajo demanda); None = config.settings.PREVIEW_ENCODINGS. La primera es la que se devuelve en
+      image_series y cada entrada del mapping lista las disponibles en "encodings".
+      preview_quality: calidad 1-100 de webp/jpeg (None = PREVIEW_QUALITY).
+    El orden del mapping es siempre el del ZIP, independiente del modo.
+
+    Antes de extraer nada se pre-escanean las cabeceras (preescanear_zip): sólo se
+    ingieren miembros DICOM y un ZIP con varias series crea una sesión por serie.
+    La respuesta describe la serie principal (session_id, image_series, ...) y
+    lista todas en "series".
     """
-    # Crear carpeta única por sesión
-    session_id = str(uuid.uuid4())
-    output_dir = os.path.join("api", "static", "series", session_id)
-    os.makedirs(output_dir, exist_ok=True)
+    t_start = time.perf_counter()
+    workers = INGEST_WORKERS if workers is None else int(workers)
+    report = progress or (lambda fraccion, etapa: None)
+    preview = (
+        preview_mode or PREVIEW_MODE,
+        preview_window,
+        lista_encodings(PREVIEW_ENCODINGS if preview_encodings is None else preview_encodings),
+        int(preview_quality or PREVIEW_QUALITY),
+    )
+    if preview[0] not in INGEST_PREVIEW_MODES:
+        raise ValueError(f"Modo de vista previa no soportado: {preview[0]}")
+    if not 1 <= preview[3] <= 100:
+        raise ValueError("preview_quality debe estar entre 1 y 100")
+
+    carpetas = []
+    source = zip_file if isinstance(zip_file, (str, os.PathLike)) else io.BytesIO(zip_file)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            return _convertir_series(archive, user_id, workers, report, preview, carpetas, t_start)
+    except BaseException:
+        # Error o cancelación: no dejar series a medias en disco
+        for output_dir in carpetas:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
+
+def _extraer_y_renderizar(archive, cabeceras, output_dir, workers, report, preview):
+    """
+    Extrae a output_dir los miembros de una serie y genera sus vistas previas.
+    report(fraccion, etapa) recibe el avance de esta serie (0..1).
+    Devuelve (tasks, results, n_workers, segundos_extract, segundos_render).
+    """
+    t0 = time.perf_counter()
+    report(0.0, "extract")
+    # === Extraer los DICOM a disco ===
+    tasks = []
+    next_idx = 0
+    for cabecera in cabeceras:
+        dicom_name = cabecera["name"]
+        try:
+            dicom_output_path = os.path.join(output_dir, os.path.basename(dicom_name))
+            # Copia por bloques: nunca se tiene el miembro completo en memoria
+            with archive.open(dicom_name) as file, open(dicom_output_path, "wb") as f:
+                shutil.copyfileobj(file, f, UPLOAD_CHUNK_BYTES)
+        except Exception as e:
+            print(f"⚠️ Error extrayendo {dicom_name}: {e}")
+            continue
+        # Un multi-frame reserva un idx (una imagen) por frame (leído en el pre-escaneo)
+        tasks.append((next_idx, cabecera["frames"], dicom_name, dicom_output_path, output_dir) + preview)
+        next_idx += cabecera["frames"]
+    t1 = time.perf_counter()
+
+    # === Decodificar + vista previa + PNG (secuencial o en pool de procesos) ===
+    report(0.1, "render")
+    n_workers = max(1, min(workers, len(tasks)))
+    results = []
+    if n_workers > 1:
+        pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=contexto_procesos())
+        try:
+            # map conserva el orden de entrada: el mapping queda determinista
+            chunksize = max(1, len(tasks) // (n_workers * 4))
+            for res in pool.map(_render_slice, tasks, chunksize=chunksize):
+                results.append(res)
+                report(0.1 + 0.9 * len(results) / len(tasks), "render")
+        finally:
+            pool.shutdown(cancel_futures=True)
+    else:
+        for t in tasks:
+            results.append(_render_slice(t))
+            report(0.1 + 0.9 * len(results) / len(tasks), "render")
+    for res in results:
+        decode_stats.fusionar(res["decode_stats"])
+    return tasks, results, n_workers, t1 - t0, time.perf_counter() - t1
 
-    dicom_mapping = {}
-    image_paths = []
 
-    with zipfile.ZipFile(io.BytesIO(zip_file)) as archive:
-        # Buscar archivos DICOM (extensiones comunes)
-        dcm_files = [f for f in archive.namelist() if f.lower().endswith((".dcm", ""))]
-        if not dcm_files:
-            raise ValueError("No se encontraron archivos DICOM en el ZIP.")
-
-        for idx, dicom_name in enumerate(dcm_files):
-            try:
-                # Extraer archivo DICOM
-                with archive.open(dicom_name) as file:
-                    dicom_bytes = file.read()
-
-                dicom_output_path = os.path.join(output_dir, os.path.basename(dicom_name))
-                os.makedirs(os.path.dirname(dicom_output_path), exist_ok=True)
-                with open(dicom_output_path, "wb") as f:
-                    f.write(dicom_bytes)
-
-                # Leer DICOM
-                ds = pydicom.dcmread(io.BytesIO(dicom_bytes), force=True)
-                if "PixelData" not in ds:
-                    print(f"⚠️ Archivo sin datos de imagen: {dicom_name}")
-                    continue
-
-                # === 4️⃣ Generar imagen PNG de vista previa ===
-                image = ds.pixel_array.astype(np.float32)
-
-                # Normaliza al rango [0, 1]
-                if np.max(image) > 1:
-                    image = (image - np.min(image)) / (np.max(image) - np.min(image) + 1e-6)
-
-                # Aplica CLAHE (ecualización adaptativa)
-                try:
-                    image = exposure.equalize_adapthist(image)
-                except Exception:
-                    # Si falla, recorta valores
-                    image = np.clip(image, 0, 1)
-
-                # Convierte a 8 bits (0-255)
-                image = (image * 255).astype("uint8")
-                im = Image.fromarray(image).convert("L")
-
-                # Guardar como PNG
-                png_filename = f"image_{idx}.png"
-                png_path = os.path.join(output_dir, png_filename)
-                im.save(png_path)
-
-                # === 5️⃣ Registrar archivo en la base de datos ===
-                archivo_id = get_or_create_archivo_dicom(
-                    nombrearchivo=os.path.basename(dicom_name),
-                    rutaarchivo=dicom_output_path,
-                    sistemaid=1,
-                    user_id=user_id,
-                )
-
-                # === 6️⃣ Agregar al mapping ===
-                dicom_mapping[png_filename] = {
-                    "dicom_name": os.path.basename(dicom_name),
-                    "archivodicomid": archivo_id,
-                }
-
-                image_paths.append(f"/static/series/{session_id}/{png_filename}")
-
-            except Exception as e:
-                print(f"⚠️ Error procesando {dicom_name}: {e}")
-                continue
+def _convertir_series(archive, user_id, workers, report, preview, carpetas, t_start) -> dict:
+    """Cuerpo de convert_dicom_zip_to_png_paths: pre-escaneo, una sesión por serie."""
+    # === 0️⃣ Pre-escaneo de cabeceras (sin píxeles) y agrupación por serie ===
+    report(0.0, "scan")
+    grupos = agrupar_por_serie(preescanear_zip(archive))
+    if not grupos:
+        raise ValueError("No se encontraron archivos DICOM en el ZIP.")
+    t_scan = time.perf_counter()
+
+    # === 1️⃣ + 2️⃣ Extraer y renderizar cada serie en su carpeta ===
+    total_frames = sum(c["frames"] for g in grupos for c in g)
+    hechos = 0
+    series = []
+    extract_s = render_s = 0.0
+    n_workers = 1
+    for cabeceras in grupos:
+        session_id = str(uuid.uuid4())
+        output_dir = os.path.join("api", "static", "series", session_id)
+        os.makedirs(output_dir, exist_ok=True)
+        carpetas.append(output_dir)
+
+        n = sum(c["frames"] for c in cabeceras)
+        base = hechos
+
+        def report_serie(fraccion, etapa, base=base, n=n):
+            report(0.05 + 0.85 * (base + fraccion * n) / total_frames, etapa)
+
+        tasks, results, w, t_ext, t_ren = _extraer_y_renderizar(
+            archive, cabeceras, output_dir, workers, report_serie, preview
+        )
+        hechos += n
+        extract_s += t_ext
+        render_s += t_ren
+        n_workers = max(n_workers, w)
+
+        validos = [(t, res) for t, res in zip(tasks, results) if res["ok"]]
+        if not validos:
+            print(f"⚠️ Serie sin cortes válidos descartada: {cabeceras[0]['series_uid'] or '(sin UID)'}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            carpetas.remove(output_dir)
+            continue
+        series.append({
+            "session_id": session_id,
+            "output_dir": output_dir,
+            "series_uid": cabeceras[0]["series_uid"],
+            "modality": cabeceras[0]["modality"],
+            "description": cabeceras[0]["description"],
+            "samples": cabeceras[0]["samples"],
+            "images": sum(len(res["manifest"]) for _, res in validos),
+            "results": results,
+            "validos": validos,
+        })
+    t_render = time.perf_counter()
 
     # Validar resultados
-    if not image_paths:
+    if not series:
         raise ValueError("No se pudieron procesar archivos DICOM válidos.")
 
+    # === 3️⃣ Registrar todas las series en la base de datos (una transacción) ===
+    # Si falla hay rollback en DB y las carpetas se borran en el llamador
+    report(0.9, "register_db")
+    ids = registrar_archivos_dicom_bulk(
+        [(os.path.basename(t[2]), t[3]) for s in series for t, _ in s["validos"]],
+        sistemaid=1,
+        user_id=user_id,
+    )
+    t_register = time.perf_counter()
+
+    # === 4️⃣ Mapping y manifest de cada serie (orden del ZIP; frames de un multi-frame en orden) ===
+    for s in series:
+        s["image_series"] = _escribir_mapping(s["session_id"], s["output_dir"], s["validos"], ids, preview)
+    t_end = time.perf_counter()
+
+    def _ms(seconds: float) -> float:
+        return round(seconds * 1000.0, 2)
+
+    # decode/render/write_png son tiempo acumulado en los workers;
+    # write_png incluye codificar y escribir todas las codificaciones;
+    # render_wall es el tiempo de pared de toda la etapa paralela.
+    results = [res for s in series for res in s["results"]]
+    timings = {
+        "scan": _ms(t_scan - t_start),
+        "extract": _ms(extract_s),
+        "decode": _ms(sum(r["decode_s"] for r in results)),
+        "render": _ms(sum(r["render_s"] for r in results)),
+        "write_png": _ms(sum(r["write_s"] for r in results)),
+        "render_wall": _ms(render_s),
+        "register_db": _ms(t_register - t_render),
+        "mapping": _ms(t_end - t_register),
+        "total": _ms(t_end - t_start),
+    }
+
+    # Retornar resultado: la serie principal + el resumen de todas
+    principal = _serie_principal(series)
+    return {
+        "message": "ZIP procesado correctamente",
+        "session_id": principal["session_id"],
+        "image_series": principal["image_series"],
+        "mapping_url": f"/static/series/{principal['session_id']}/mapping.json",
+        "series": [
+            {
+                "session_id": s["session_id"],
+                "series_uid": s["series_uid"],
+                "modality": s["modality"],
+                "description": s["description"],
+                "images": s["images"],
+                "image_series": s["image_series"],
+                "mapping_url": f"/static/series/{s['session_id']}/mapping.json",
+            }
+            for s in series
+        ],
+        "workers": n_workers,
+        "preview_mode": preview[0],
+        "preview_encodings": list(preview[2]) if preview[0] != "none" else [],
+        "timings_ms": timings,
+    }
+
+
+def _escribir_mapping(session_id: str, output_dir: str, validos: list, ids: dict, preview: tuple) -> List[str]:
+    """Guarda mapping.json y manifest.json de una serie; devuelve sus image_series."""
+    dicom_mapping = {}
+    image_paths = []
+    for (idx, _, dicom_name, dicom_output_path, *_), res in validos:
+        for k, entry in enumerate(res["manifest"]):
+            png_filename = f"image_{idx + k}.png"
+            dicom_mapping[png_filename] = {
+                "dicom_name": os.path.basename(dicom_name),
+                "archivodicomid": ids[dicom_output_path],
+            }
+            if entry["frame"] is not None:
+                dicom_mapping[png_filename]["frame"] = entry["frame"]
+            if preview[0] == "none":
+                dicom_mapping[png_filename]["url"] = url_corte(session_id, idx + k)
+                image_paths.append(dicom_mapping[png_filename]["url"])
+            else:
+                encodings = preview[2]
+                dicom_mapping[png_filename]["encodings"] = list(encodings)
+                preferido = f"image_{idx + k}" + ENCODINGS[encodings[0]][2]
+                image_paths.append(f"/static/series/{session_id}/{preferido}")
+
     # Guardar mapping.json
     mapping_path = os.path.join(output_dir, "mapping.json")
     with open(mapping_path, "w", encoding="utf-8") as f:
         json.dump(dicom_mapping, f, ensure_ascii=False, indent=2)
 
-    # Retornar resultado
-    return {
-        "message": "ZIP procesado correctamente",
-        "session_id": session_id,
-        "image_series": image_paths,
-        "mapping_url": f"/static/series/{session_id}/mapping.json",
-    }
+    # Manifest de cabeceras: los servicios 3D ordenan y calculan spacing sin releer DICOM
+    guardar_manifest(output_dir, [entry for _, res in validos for entry in res["manifest"]])
+    return image_paths
@@ -0,0 +1,173 @@
+# api/services/histogram_service.py
+import os
+from typing import Callable, Optional
+
+import numpy as np
+
+from .blockwise_service import otsu_histograma, percentil_por_orden
+from .volume_cache_service import _volume_cache_dir, volume_lru
+
+# Subir este número invalida los índices guardados en disco
+HISTOGRAM_FORMAT = 1
+# Bins de 1 unidad hasta este rango; por encima (o con valores no enteros) el
+# histograma es de HIST_BINS_APROX bins fijos y sólo sirve para mostrarlo
+HIST_MAX_BINS = 1 << 20
+HIST_BINS_APROX = 4096
+# Voxeles por trozo al recorrer el volumen (memmap: memoria acotada)
+_VOXELES_TROZO = 1 << 24
+
+
+def _trozos(vol: np.ndarray):
+    """Valores finitos del volumen por trozos de cortes completos."""
+    cortes = max(1, _VOXELES_TROZO // max(1, int(np.prod(vol.shape[1:]))))
+    for z in range(0, vol.shape[0], cortes):
+        b = np.asarray(vol[z:z + cortes]).ravel()
+        yield b[np.isfinite(b)]
+
+
+class IndiceHistograma:
+    """
+    Histograma de intensidades de un volumen con su tabla acumulada (cdf).
+    Si todos los valores son enteros (HU en CT, valores almacenados en MR) cada bin
+    es un valor y el índice es exacto: percentiles, Otsu y recuentos por umbral son
+    idénticos a los calculados sobre el volumen, sin recorrerlo.
+      - valores[i]: valor del bin i (inicio del bin si no es exacto)
+      - cuentas[i]: voxeles en el bin i; cdf = cumsum(cuentas)
+    """
+
+    def __init__(self, valores: np.ndarray, cuentas: np.ndarray, exacto: bool, dtype):
+        self.valores = np.asarray(valores, dtype=np.float64)
+        self.cuentas = np.asarray(cuentas, dtype=np.int64)
+        self.cdf = np.cumsum(self.cuentas)
+        self.exacto = bool(exacto)
+        self.dtype = np.dtype(dtype)
+        self.n = int(self.cdf[-1]) if self.cdf.size else 0
+        for a in (self.valores, self.cuentas, self.cdf):
+            a.flags.writeable = False
+
+    @classmethod
+    def desde_volumen(cls, vol: np.ndarray) -> "IndiceHistograma":
+        """Construye el índice en dos pasadas por trozos (rango y enteros; recuento)."""
+        mn, mx, enteros = None, None, True
+        for b in _trozos(vol):
+            if b.size == 0:
+                continue
+            bmn, bmx = b.min(), b.max()
+            mn = bmn if mn is None else min(mn, bmn)
+            mx = bmx if mx is None else max(mx, bmx)
+            enteros = enteros and bool(np.all(b == np.floor(b)))
+        if mn is None:
+            return cls(np.zeros(0), np.zeros(0, dtype=np.int64), True, vol.dtype)
+
+        mn, mx = float(mn), float(mx)
+        if enteros and mx - mn < HIST_MAX_BINS:
+            nbins = int(mx - mn) + 1
+            cuentas = np.zeros(nbins, dtype=np.int64)
+            for b in _trozos(vol):
+                cuentas += np.bincount((b - mn).astype(np.int64), minlength=nbins)
+            return cls(mn + np.arange(nbins, dtype=np.float64), cuentas, True, vol.dtype)
+
+        cuentas = np.zeros(HIST_BINS_APROX, dtype=np.int64)
+        for b in _trozos(vol):
+            h, bordes = np.histogram(b, bins=HIST_BINS_APROX, range=(mn, mx))
+            cuentas += h
+        bordes = np.linspace(mn, mx, HIST_BINS_APROX + 1)
+        return cls(bordes[:-1], cuentas, False, vol.dtype)
+
+    # ---- Estadísticas (mismos tipos que numpy sobre el volumen si es exacto) ----
+
+    def rango(self):
+        presentes = np.flatnonzero(self.cuentas)
+        return self.dtype.type(self.valores[presentes[0]]), self.dtype.type(self.valores[presentes[-1]])
+
+    def _k_esimos(self, ks: set, valores: Optional[np.ndarray] = None) -> dict:
+        valores = self.valores if valores is None else valores
+        return {k: valores[int(np.searchsorted(self.cdf, k, side="right"))] for k in ks}
+
+    def percentil(self, q):
+        """np.percentile(v, q) de los valores finitos del volumen."""
+        return percentil_por_orden(self._k_esimos, q, self.dtype, self.n)
+
+    def contar(self, predicado: Callable[[np.ndarray], np.ndarray]) -> int:
+        """Voxeles cuyo valor cumple predicado (vectorizado sobre valores del tipo del volumen)."""
+        si = predicado(self.valores.astype(self.dtype))
+        return int(self.cuentas[si].sum())
+
+    def otsu(self, transformar: Optional[Callable] = None, positivos: bool = False, nbins: int = 256):
+        """
+        threshold_otsu(t(v)) con t no decreciente (p.ej. normalizar con clip), sólo
+        de los t(v) > 0 si positivos; como skimage, ValueError si no queda ningún valor.
+        """
+        t = self.valores.astype(self.dtype)
+        if transformar is not None:
+            t = transformar(t)
+        cuentas = self.cuentas if not positivos else np.where(t > 0, self.cuentas, 0)
+        return otsu_histograma(cuentas, t, nbins)
+
+    def percentil_transformado(self, transformar: Callable, q):
+        """np.percentile(t(v), q) con t no decreciente: los estadísticos de orden se conservan."""
+        t = transformar(self.valores.astype(self.dtype))
+        return percentil_por_orden(lambda ks: self._k_esimos(ks, t), q, t.dtype, self.n)
+
+    def reagrupar(self, bins: int):
+        """(bordes, cuentas) del histograma en `bins` bins iguales sobre [min, max], para mostrarlo."""
+        if self.n == 0:
+            return np.zeros(bins + 1), np.zeros(bins, dtype=np.int64)
+        mn, mx = (float(v) for v in self.rango())
+        cuentas, bordes = np.histogram(self.valores, bins=bins, range=(mn, mx if mx > mn else mn + 1.0),
+                                       weights=self.cuentas)
+        return bordes, cuentas.astype(np.int64)
+
+
+def _ruta(session_id: str, version: str, variante: str) -> str:
+    return os.path.join(_volume_cache_dir(session_id), f"histogram_{version}_{variante}.npz")
+
+
+def _cargar(session_id: str, version: str, variante: str) -> Optional[IndiceHistograma]:
+    ruta = _ruta(session_id, version, variante)
+    if not os.path.isfile(ruta):
+        return None
+    try:
+        with np.load(ruta) as z:
+            if int(z["formato"]) != HISTOGRAM_FORMAT:
+                return None
+            return IndiceHistograma(z["valores"], z["cuentas"], bool(z["exacto"]), str(z["dtype"]))
+    except Exception as e:
+        print(f"⚠️ Índice de histograma ilegible, se reconstruye: {e}")
+        return None
+
+
+def _guardar(session_id: str, version: str, variante: str, indice: IndiceHistograma) -> None:
+    """Escribe el índice de forma atómica y borra los de otras versiones del volumen."""
+    base = _volume_cache_dir(session_id)
+    os.makedirs(base, exist_ok=True)
+    ruta = _ruta(session_id, version, variante)
+    tmp = ruta + ".tmp.npz"
+    np.savez(tmp, formato=HISTOGRAM_FORMAT, valores=indice.valores, cuentas=indice.cuentas,
+             exacto=indice.exacto, dtype=indice.dtype.str)
+    os.replace(tmp, ruta)
+    for name in os.listdir(base):
+        if name.startswith("histogram_") and version not in name:
+            try:
+                os.remove(os.path.join(base, name))
+            except Exception:
+                pass
+
+
+def indice_histograma(session_id: str, version: str, vol: np.ndarray, variante: str = "raw") -> IndiceHistograma:
+    """
+    Índice de histograma del volumen `version` de la sesión: de la LRU en proceso,
+    del disco (junto al volumen cacheado) o construido desde `vol` y guardado.
+    variante distingue volúmenes derivados (p.ej. "mediana": tras el filtro de mediana).
+    """
+    def _cargar_o_construir():
+        indice = _cargar(session_id, version, variante)
+        if indice is None:
+            indice = IndiceHistograma.desde_volumen(vol)
+            try:
+                _guardar(session_id, version, variante, indice)
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar el índice de histograma de {session_id}: {e}")
+        return indice
+
+    return volume_lru.get_or_load((session_id, version, "histograma", variante), _cargar_o_construir)
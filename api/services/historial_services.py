@@ -4,6 +4,7 @@ import re
 import shutil
 from typing import List, Dict
 from config.db_config import get_connection
+from api.services.volume_cache_service import borrar_cache_volumen
 
 
 def extraer_session_id(ruta: str) -> str:
@@ -120,6 +121,9 @@ def eliminar_serie_por_session_id(session_id: str, user_id: int) -> None:
     if os.path.isdir(ruta_segmentaciones):
         shutil.rmtree(ruta_segmentaciones)
 
+    # 4. Eliminar el volumen cacheado de la serie
+    borrar_cache_volumen(session_id)
+
     cursor.close()
     conn.close()
 
@@ -0,0 +1,225 @@
+# api/services/jobs_service.py
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Optional
+
+from config.settings import JOBS_MAX_PER_USER, JOBS_MAX_QUEUE, JOBS_SHUTDOWN_TIMEOUT_S, JOBS_TTL_S, JOBS_WORKERS
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro del trabajo cuando el usuario pidió cancelarlo."""
+
+
+class ColaLlenaError(Exception):
+    """La cola global de trabajos está llena (backpressure → HTTP 429)."""
+
+
+class Job:
+    """
+    Trabajo en segundo plano. La función recibe el propio Job y puede informar
+    progreso con job.report(fraccion, mensaje); report() también es el punto de
+    cancelación cooperativa (lanza JobCancelled si se pidió cancelar).
+    """
+
+    def __init__(self, kind: str, user_id: int, fn: Callable, cleanup: Optional[Callable] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = int(user_id)
+        self.fn = fn
+        self.cleanup = cleanup
+        self.status = "queued"  # queued | running | done | error | cancelled
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "error", "cancelled")
+
+    def report(self, progress: float, message: Optional[str] = None) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.progress = max(self.progress, min(1.0, float(progress)))
+        if message is not None:
+            self.message = message
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Cola de trabajos en proceso (sin broker externo) con un pool local de hilos.
+    - Cola acotada: submit() lanza ColaLlenaError si hay max_queue trabajos esperando.
+    - Límite por usuario: como mucho max_per_user trabajos en ejecución a la vez por
+      usuario; el resto espera en la cola sin bloquear a los demás usuarios.
+    - Los trabajos terminados se conservan ttl_s segundos para consultar su estado.
+    """
+
+    def __init__(self, workers: int, max_queue: int, max_per_user: int, ttl_s: int):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.max_per_user = max(1, int(max_per_user))
+        self.ttl_s = int(ttl_s)
+        self._jobs = {}
+        self._pending = deque()
+        self._running_by_user = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    # ---------- API pública ----------
+
+    def submit(self, kind: str, user_id: int, fn: Callable, cleanup: Optional[Callable] = None) -> Job:
+        job = Job(kind, user_id, fn, cleanup)
+        with self._cond:
+            self._prune()
+            if len(self._pending) >= self.max_queue:
+                raise ColaLlenaError("La cola de trabajos está llena, intente más tarde.")
+            self._ensure_started()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list_for_user(self, user_id: int) -> list:
+        with self._cond:
+            jobs = [j for j in self._jobs.values() if j.user_id == int(user_id)]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancela un trabajo en cola (inmediato) o en ejecución (cooperativo)."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job._cancel.set()
+            if job.status == "queued":
+                self._pending.remove(job)
+                self._finish(job, "cancelled")
+        return job
+
+    def stats(self, user_id: int) -> dict:
+        """Configuración de la cola y los trabajos del usuario por estado (no los de otros)."""
+        with self._cond:
+            by_status = {}
+            for j in self._jobs.values():
+                if j.user_id == int(user_id):
+                    by_status[j.status] = by_status.get(j.status, 0) + 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "max_per_user": self.max_per_user,
+                "queued": by_status.get("queued", 0),
+                "by_status": by_status,
+            }
+
+    def shutdown(self, timeout_s: float = JOBS_SHUTDOWN_TIMEOUT_S) -> None:
+        """
+        Cancela los trabajos en cola (inmediato) y pide la cancelación de los que se
+        están ejecutando (cooperativa: terminan en su próximo report() y se ejecuta su
+        cleanup); espera a los hilos como mucho timeout_s segundos en total.
+        """
+        with self._cond:
+            self._stopping = True
+            for job in list(self._pending):
+                job._cancel.set()
+                self._finish(job, "cancelled")
+            self._pending.clear()
+            for job in self._jobs.values():
+                if job.status == "running":
+                    job._cancel.set()
+            self._cond.notify_all()
+            threads = list(self._threads)
+        limite = time.monotonic() + timeout_s
+        for t in threads:
+            t.join(max(0.0, limite - time.monotonic()))
+        vivos = sum(t.is_alive() for t in threads)
+        if vivos:
+            print(f"⚠️ {vivos} trabajo(s) no terminaron en {timeout_s}s al apagar")
+
+    # ---------- Internos ----------
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _next_job(self) -> Optional[Job]:
+        for job in self._pending:
+            if self._running_by_user.get(job.user_id, 0) < self.max_per_user:
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+                self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+                job.status = "running"
+                job.started_at = time.time()
+
+            status = "done"
+            try:
+                job.result = job.fn(job)
+                job.progress = 1.0
+            except JobCancelled:
+                status = "cancelled"
+            except Exception as e:
+                print(f"⚠️ Error en trabajo {job.kind} {job.id}: {e}")
+                job.error = str(e)
+                status = "error"
+
+            with self._cond:
+                self._running_by_user[job.user_id] -= 1
+                self._finish(job, status)
+                self._cond.notify_all()
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        if job.cleanup is not None:
+            try:
+                job.cleanup()
+            except Exception:
+                pass
+
+    def _prune(self) -> None:
+        limite = time.time() - self.ttl_s
+        viejos = [k for k, j in self._jobs.items() if j.finished and j.finished_at < limite]
+        for k in viejos:
+            del self._jobs[k]
+
+
+job_manager = JobManager(JOBS_WORKERS, JOBS_MAX_QUEUE, JOBS_MAX_PER_USER, JOBS_TTL_S)
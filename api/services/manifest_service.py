@@ -0,0 +1,228 @@
+# api/services/manifest_service.py
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import pydicom
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 4
+
+
+def _float_or_none(value) -> Optional[float]:
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def sha1_archivo(path: str, chunk: int = 1024 * 1024) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def clave_corte(dicom_name: str, frame: Optional[int] = None) -> str:
+    """Identificador de un corte: el archivo, o archivo#frame en multi-frame."""
+    return dicom_name if frame is None else f"{dicom_name}#{frame}"
+
+
+def _primer_item(seq_parent, keyword: str):
+    seq = getattr(seq_parent, keyword, None) if seq_parent is not None else None
+    return seq[0] if seq else None
+
+
+def _grupo(shared, per_frame, keyword: str):
+    """Item de un functional group: primero el del frame y si no el compartido."""
+    return _primer_item(per_frame, keyword) or _primer_item(shared, keyword)
+
+
+def _orientacion(valores) -> Optional[List[float]]:
+    """ImageOrientationPatient redondeado (agrupa cortes coplanares pese al ruido float)."""
+    try:
+        valores = [round(float(v), 2) + 0.0 for v in valores]
+    except Exception:
+        return None
+    return valores if len(valores) == 6 else None
+
+
+def clave_grupo(entry: dict) -> tuple:
+    """Cortes que pueden formar un mismo volumen: serie, resolución y orientación."""
+    orientation = entry.get("orientation")
+    return (
+        entry.get("series_uid") or "",
+        entry.get("rows"),
+        entry.get("cols"),
+        tuple(orientation) if orientation else None,
+    )
+
+
+def entrada_manifest(ds, dicom_name: str, sha1: Optional[str] = None) -> dict:
+    """
+    Extrae de un dataset (basta con la cabecera) los tags que usan los servicios 3D
+    para ordenar, filtrar y calcular el spacing de cada corte.
+    sha1 es el hash del archivo: identifica el contenido para invalidar cachés.
+    Describe el archivo completo; para multi-frame ver entradas_manifest.
+    """
+    z = None
+    ipp = getattr(ds, "ImagePositionPatient", None)
+    if ipp is not None and len(ipp) == 3:
+        z = _float_or_none(ipp[2])
+
+    inst = getattr(ds, "InstanceNumber", None)
+    try:
+        inst = int(inst) if inst is not None else None
+    except Exception:
+        inst = None
+
+    pixel_spacing = None
+    for tag in ("PixelSpacing", "ImagerPixelSpacing"):
+        if hasattr(ds, tag):
+            try:
+                pixel_spacing = [float(v) for v in getattr(ds, tag)]
+            except Exception:
+                pixel_spacing = None
+            break
+
+    return {
+        "dicom_name": dicom_name,
+        "series_uid": str(getattr(ds, "SeriesInstanceUID", "") or ""),
+        "modality": str(getattr(ds, "Modality", "")).upper(),
+        "z": z,
+        "instance": inst,
+        "rows": int(getattr(ds, "Rows", 0) or 0),
+        "cols": int(getattr(ds, "Columns", 0) or 0),
+        "frames": int(getattr(ds, "NumberOfFrames", 1) or 1),
+        "samples": int(getattr(ds, "SamplesPerPixel", 1) or 1),
+        "pixel_spacing": pixel_spacing,
+        "orientation": _orientacion(getattr(ds, "ImageOrientationPatient", None) or []),
+        "slice_thickness": _float_or_none(getattr(ds, "SliceThickness", None)),
+        "spacing_between_slices": _float_or_none(getattr(ds, "SpacingBetweenSlices", None)),
+        "slope": _float_or_none(getattr(ds, "RescaleSlope", 1.0)),
+        "intercept": _float_or_none(getattr(ds, "RescaleIntercept", 0.0)),
+        "has_pixels": "PixelData" in ds,
+        "sha1": sha1,
+        "frame": None,
+    }
+
+
+def entradas_manifest(ds, dicom_name: str, sha1: Optional[str] = None) -> List[dict]:
+    """
+    Entradas del manifest de un archivo: una por frame.
+    En multi-frame (Enhanced CT/MR, ...) la geometría de cada frame sale de los
+    functional groups (PerFrame, con respaldo en Shared):
+      - z: PlanePositionSequence > ImagePositionPatient
+        (o ImagePositionPatient + GridFrameOffsetVector en multi-frame clásicos)
+      - orientación: PlaneOrientationSequence > ImageOrientationPatient
+      - spacing: PixelMeasuresSequence (PixelSpacing, SliceThickness, SpacingBetweenSlices)
+      - rescale: PixelValueTransformationSequence (RescaleSlope / RescaleIntercept)
+    """
+    base = entrada_manifest(ds, dicom_name, sha1=sha1)
+    n_frames = base["frames"]
+    if n_frames <= 1:
+        return [base]
+
+    shared = _primer_item(ds, "SharedFunctionalGroupsSequence")
+    per_frame = getattr(ds, "PerFrameFunctionalGroupsSequence", None)
+    if per_frame is not None and len(per_frame) != n_frames:
+        per_frame = None
+    offsets = getattr(ds, "GridFrameOffsetVector", None)
+    if offsets is not None and len(offsets) != n_frames:
+        offsets = None
+
+    entradas = []
+    for f in range(n_frames):
+        item = per_frame[f] if per_frame is not None else None
+        e = dict(base, frame=f)
+
+        pos = _grupo(shared, item, "PlanePositionSequence")
+        ipp = getattr(pos, "ImagePositionPatient", None) if pos is not None else None
+        if ipp is not None and len(ipp) == 3:
+            e["z"] = _float_or_none(ipp[2])
+        elif offsets is not None and base["z"] is not None:
+            e["z"] = base["z"] + float(offsets[f])
+        else:
+            e["z"] = None
+
+        plano = _grupo(shared, item, "PlaneOrientationSequence")
+        iop = getattr(plano, "ImageOrientationPatient", None) if plano is not None else None
+        if iop is not None:
+            e["orientation"] = _orientacion(iop) or e["orientation"]
+
+        medidas = _grupo(shared, item, "PixelMeasuresSequence")
+        if medidas is not None:
+            if getattr(medidas, "PixelSpacing", None) is not None:
+                try:
+                    e["pixel_spacing"] = [float(v) for v in medidas.PixelSpacing]
+                except Exception:
+                    pass
+            for tag, key in (("SliceThickness", "slice_thickness"),
+                             ("SpacingBetweenSlices", "spacing_between_slices")):
+                value = _float_or_none(getattr(medidas, tag, None))
+                if value is not None:
+                    e[key] = value
+
+        rescale = _grupo(shared, item, "PixelValueTransformationSequence")
+        if rescale is not None:
+            for tag, key in (("RescaleSlope", "slope"), ("RescaleIntercept", "intercept")):
+                value = _float_or_none(getattr(rescale, tag, None))
+                if value is not None:
+                    e[key] = value
+
+        entradas.append(e)
+    return entradas
+
+
+def guardar_manifest(series_dir: str, slices: List[dict]) -> str:
+    path = os.path.join(series_dir, MANIFEST_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "slices": slices}, f, ensure_ascii=False)
+    return path
+
+
+def cargar_manifest(series_dir: str) -> Optional[List[dict]]:
+    path = os.path.join(series_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        return None
+    return data.get("slices", [])
+
+
+def obtener_manifest(series_dir: str) -> List[dict]:
+    """
+    Devuelve el manifest de la serie. Las series ingeridas antes de existir el
+    manifest se migran aquí: se leen sólo las cabeceras una vez y se guarda.
+    """
+    slices = cargar_manifest(series_dir)
+    if slices is not None:
+        return slices
+
+    mapping_path = os.path.join(series_dir, "mapping.json")
+    if not os.path.isfile(mapping_path):
+        raise FileNotFoundError("mapping.json no encontrado para la serie")
+    with open(mapping_path, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+
+    slices = []
+    vistos = set()
+    for _, meta in mapping.items():
+        dcm_name = meta.get("dicom_name")
+        if not dcm_name or dcm_name in vistos:
+            continue  # multi-frame: varias imágenes del mapping por archivo
+        vistos.add(dcm_name)
+        p = os.path.join(series_dir, dcm_name)
+        if not os.path.isfile(p):
+            continue
+        ds = pydicom.dcmread(p, force=True, stop_before_pixels=True)
+        for entry in entradas_manifest(ds, dcm_name, sha1=sha1_archivo(p)):
+            entry["has_pixels"] = True  # la ingesta sólo mapea cortes con PixelData
+            slices.append(entry)
+
+    guardar_manifest(series_dir, slices)
+    return slices
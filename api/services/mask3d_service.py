@@ -0,0 +1,113 @@
+# api/services/mask3d_service.py
+import numpy as np
+from skimage import measure
+
+MASK_FORMAT = "dicom-mask3d"
+MASK_VERSION = 1
+MASK_EXT = ".npz"
+
+
+def bbox_mascara(mask: np.ndarray):
+    """
+    Bounding box de los voxeles activos: (origin, stop) en índices (Z, Y, X),
+    con stop exclusivo. Para una máscara vacía devuelve una caja de tamaño 0.
+    """
+    if not mask.any():
+        return (0, 0, 0), (0, 0, 0)
+    origin = []
+    stop = []
+    for axis in range(3):
+        others = tuple(a for a in range(3) if a != axis)
+        idx = np.flatnonzero(mask.any(axis=others))
+        origin.append(int(idx[0]))
+        stop.append(int(idx[-1]) + 1)
+    return tuple(origin), tuple(stop)
+
+
+def guardar_mascara_3d(path: str, mask: np.ndarray, spacing, origin=(0, 0, 0), full_shape=None) -> dict:
+    """
+    Guarda una máscara 3D en el contenedor compacto (.npz):
+      - bits: máscara recortada a su bounding box y empaquetada a 1 bit/voxel
+      - crop_shape / origin / full_shape: geometría en voxeles (Z, Y, X)
+      - spacing: (dz, dy, dx) en mm
+    `mask` puede ser la máscara completa o ya un recorte situado en `origin`
+    dentro de un volumen de `full_shape`.
+    Devuelve la geometría guardada.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    full_shape = tuple(int(v) for v in (full_shape or mask.shape))
+    lo, hi = bbox_mascara(mask)
+    crop = mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    abs_origin = tuple(int(o) + int(l) for o, l in zip(origin, lo))
+
+    np.savez_compressed(
+        path,
+        format=np.array(MASK_FORMAT),
+        version=np.array(MASK_VERSION),
+        bits=np.packbits(crop, axis=None),
+        crop_shape=np.array(crop.shape, dtype=np.int64),
+        origin=np.array(abs_origin, dtype=np.int64),
+        full_shape=np.array(full_shape, dtype=np.int64),
+        spacing=np.array(spacing, dtype=np.float64),
+    )
+    return {"origin": abs_origin, "crop_shape": tuple(crop.shape), "full_shape": full_shape}
+
+
+def cargar_mascara_3d(path: str) -> dict:
+    """
+    Carga una máscara 3D. Devuelve un dict con:
+      - crop: máscara booleana recortada a su bounding box
+      - origin, full_shape: posición del recorte dentro del volumen (Z, Y, X)
+      - spacing: (dz, dy, dx) en mm, o None en máscaras .npy antiguas (sin geometría)
+    """
+    if not path.endswith(MASK_EXT):
+        # Formato antiguo: uint8 completo sin geometría
+        mask = np.load(path) > 0
+        return {"crop": mask, "origin": (0, 0, 0), "full_shape": tuple(mask.shape), "spacing": None}
+
+    with np.load(path) as data:
+        if str(data["format"]) != MASK_FORMAT:
+            raise ValueError(f"Formato de máscara 3D desconocido: {path}")
+        crop_shape = tuple(int(v) for v in data["crop_shape"])
+        n = int(np.prod(crop_shape))
+        crop = np.unpackbits(data["bits"], count=n).astype(bool).reshape(crop_shape)
+        return {
+            "crop": crop,
+            "origin": tuple(int(v) for v in data["origin"]),
+            "full_shape": tuple(int(v) for v in data["full_shape"]),
+            "spacing": tuple(float(v) for v in data["spacing"]),
+        }
+
+
+def expandir_mascara(info: dict) -> np.ndarray:
+    """Reconstruye la máscara a tamaño completo a partir de cargar_mascara_3d."""
+    full = np.zeros(info["full_shape"], dtype=bool)
+    z, y, x = info["origin"]
+    dz, dy, dx = info["crop"].shape
+    full[z:z + dz, y:y + dy, x:x + dx] = info["crop"]
+    return full
+
+
+def marching_cubes_recortado(crop: np.ndarray, origin, full_shape, spacing_mc):
+    """
+    marching_cubes sobre el recorte, con el mismo resultado que sobre la máscara
+    completa: se añade 1 voxel de fondo sólo en los lados que no tocan el borde
+    del volumen y los vértices se trasladan a coordenadas del volumen.
+    spacing_mc es el spacing que se pasa a marching_cubes por eje del array.
+    """
+    pad = []
+    for axis in range(3):
+        before = min(1, origin[axis])
+        after = min(1, full_shape[axis] - (origin[axis] + crop.shape[axis]))
+        pad.append((before, after))
+    padded = np.pad(crop.astype(np.uint8), pad)
+    if min(padded.shape) < 2:
+        # Recorte degenerado (p.ej. 1 voxel pegado al borde): usar el volumen completo
+        padded = expandir_mascara({"crop": crop, "origin": origin, "full_shape": full_shape}).astype(np.uint8)
+        pad = [(origin[a], 0) for a in range(3)]
+
+    verts, faces, normals, values = measure.marching_cubes(padded, level=0.5, spacing=tuple(spacing_mc))
+    shift = np.array(
+        [(origin[a] - pad[a][0]) * spacing_mc[a] for a in range(3)], dtype=verts.dtype
+    )
+    return verts + shift, faces, normals, values
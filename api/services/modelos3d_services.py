@@ -3,12 +3,13 @@ import os
 import time
 import struct
 import numpy as np
-from skimage import measure
+from typing import Callable, Optional
 
 from config.db_config import get_connection
 
-# Reutilizamos el spacing desde la carga del volumen
-from api.services.segmentation3d_service import _load_stack, _seg3d_dir
+# Reutilizamos el spacing desde el manifest de la serie
+from api.services.segmentation3d_service import _spacing_serie, _seg3d_dir
+from api.services.mask3d_service import cargar_mascara_3d, marching_cubes_recortado
 
 
 def _models_dir(session_id: str) -> str:
@@ -61,8 +62,8 @@ def _write_binary_stl(
 
 def _resolve_mask_npy_abs(session_id: str, mask_npy_path_public: str) -> str:
     """
-    Convierte una ruta pública (p.ej., /static/segmentations3d/<session_id>/mask.npy)
-    a una ruta absoluta en disco: api/static/segmentations3d/<session_id>/mask.npy
+    Convierte una ruta pública (p.ej., /static/segmentations3d/<session_id>/mask.npz)
+    a una ruta absoluta en disco: api/static/segmentations3d/<session_id>/mask.npz
     """
     # Si ya viene absoluta, devolverla
     if os.path.isabs(mask_npy_path_public) and os.path.isfile(mask_npy_path_public):
@@ -72,7 +73,7 @@ def _resolve_mask_npy_abs(session_id: str, mask_npy_path_public: str) -> str:
     if mask_npy_path_public.startswith("/static/"):
         rel = mask_npy_path_public[
             len("/static/") :
-        ]  # segmentations3d/<session_id>/mask.npy
+        ]  # segmentations3d/<session_id>/mask.npz
         abs_path = os.path.abspath(os.path.join("api", "static", rel))
         return abs_path
 
@@ -83,16 +84,22 @@ def _resolve_mask_npy_abs(session_id: str, mask_npy_path_public: str) -> str:
 
 
 def exportar_stl_desde_seg3d(
-    session_id: str, user_id: int, seg3d_id: int | None = None
+    session_id: str,
+    user_id: int,
+    seg3d_id: int | None = None,
+    progress: Optional[Callable[[float, str], None]] = None,
 ) -> dict:
     """
     - Busca la segmentación 3D más reciente (o la dada por seg3d_id) para session_id/user_id
-    - Carga mask.npy
-    - Obtiene spacing (mm) desde _load_stack(session_id)
-    - Aplica marching_cubes con spacing en mm
+    - Carga la máscara (contenedor .npz recortado con su spacing; las .npy antiguas
+      toman el spacing del manifest de la serie). Nunca decodifica los DICOM.
+    - Aplica marching_cubes con spacing en mm sobre el bounding box
     - Escribe STL en api/static/models/<session_id>/<timestamp>_seg3d_<id>.stl
     - Inserta registro en modelo3d y devuelve metadatos
+    - progress: callback opcional progress(fraccion, etapa) para trabajos en segundo plano
     """
+    report = progress or (lambda fraccion, etapa: None)
+    report(0.0, "lookup")
     conn = get_connection()
     cur = conn.cursor()
 
@@ -130,26 +137,31 @@ def exportar_stl_desde_seg3d(
     conn.close()
 
     # 2) Cargar máscara y spacing
+    report(0.1, "load")
     mask_path_abs = _resolve_mask_npy_abs(session_id, mask_npy_public)
     if not os.path.isfile(mask_path_abs):
-        raise FileNotFoundError(f"No se encontró mask.npy en {mask_path_abs}")
+        raise FileNotFoundError(f"No se encontró la máscara 3D en {mask_path_abs}")
 
-    mask = np.load(mask_path_abs)
-    # Garantizar boolean/uint8
-    mask = mask > 0
+    info = cargar_mascara_3d(mask_path_abs)
+    if not info["crop"].any():
+        raise ValueError("La segmentación 3D está vacía, no se puede generar STL.")
 
-    # Obtener spacing en mm desde la serie
-    _, spacing, _ = _load_stack(session_id)  # spacing = (dz, dy, dx) en mm
+    spacing = info["spacing"]
+    if spacing is None:
+        # Máscara antigua sin geometría: spacing en mm desde el manifest de la serie
+        spacing = _spacing_serie(session_id)  # spacing = (dz, dy, dx) en mm
 
     # 3) Marching Cubes
-    verts, faces, _, _ = measure.marching_cubes(
-        mask.astype(np.uint8), level=0.5, spacing=spacing[::-1]  # (dx, dy, dz)
+    report(0.5, "marching_cubes")
+    verts, faces, _, _ = marching_cubes_recortado(
+        info["crop"], info["origin"], info["full_shape"], spacing[::-1]  # (dx, dy, dz)
     )
 
     num_vertices = int(verts.shape[0])
     num_caras = int(faces.shape[0])
 
     # 4) Escribir STL
+    report(0.8, "write_stl")
     out_dir_abs = _models_dir(session_id)
     ts = int(time.time())
     stl_filename = f"{ts}_seg3d_{seg3d_id}.stl"
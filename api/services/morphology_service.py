@@ -0,0 +1,87 @@
+# api/services/morphology_service.py
+import math
+from typing import Sequence, Tuple, Union
+
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+from .mask3d_service import bbox_mascara
+
+# Radio en mm: uno para los 3 ejes o (rz, ry, rx)
+Radio = Union[float, Sequence[float]]
+
+# Tolerancia relativa al comparar distancias con el radio (voxeles justo en la superficie)
+_EPS = 1e-9
+
+
+def _escala(radio_mm: Radio, spacing) -> Tuple[np.ndarray, np.ndarray]:
+    """(radios por eje, sampling normalizado): con sampling = spacing / radio el elipsoide es la esfera unidad."""
+    radios = np.broadcast_to(np.asarray(radio_mm, dtype=np.float64), (3,))
+    if np.any(radios <= 0):
+        raise ValueError(f"Radio inválido: {radio_mm}")
+    return radios, np.asarray(spacing, dtype=np.float64) / radios
+
+
+def _recorte(mask: np.ndarray, margen) -> Tuple[slice, ...]:
+    """Bounding box de los voxeles activos ampliada `margen` voxeles por eje (recortada al volumen)."""
+    origin, stop = bbox_mascara(mask)
+    return tuple(slice(max(0, o - m), min(n, s + m)) for o, s, m, n in zip(origin, stop, margen, mask.shape))
+
+
+def dilatar_edt(mask: np.ndarray, radio_mm: Radio, spacing) -> np.ndarray:
+    """
+    Dilatación por un elipsoide de semiejes radio_mm (mm) con la EDT anisótropa:
+    un voxel entra si el voxel activo más cercano está a distancia <= radio.
+    Coste O(N) independiente del radio (una EDT sobre la bounding box ampliada),
+    en vez de O(N·r³) del footprint.
+    Fuera del volumen se considera fondo (como binary_dilation).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return mask.copy()
+    radios, sampling = _escala(radio_mm, spacing)
+    # Sólo puede activarse lo que está a <= radio de la bounding box de la máscara
+    margen = [math.floor(r / float(d) + _EPS) for r, d in zip(radios, spacing)]
+    caja = _recorte(mask, margen)
+    out = np.zeros_like(mask)
+    out[caja] = distance_transform_edt(~mask[caja], sampling=sampling) <= 1.0 + _EPS
+    return out
+
+
+def erosionar_edt(mask: np.ndarray, radio_mm: Radio, spacing) -> np.ndarray:
+    """
+    Erosión por el mismo elipsoide: un voxel queda si el fondo más cercano está a
+    distancia > radio. Fuera del volumen se considera activo (como binary_erosion
+    de skimage, border_value=True).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any() or mask.all():
+        return mask.copy()
+    _, sampling = _escala(radio_mm, spacing)
+    # Un voxel de margen fuera de la bounding box (fondo salvo en el borde del volumen)
+    # está siempre a menor o igual distancia que cualquier fondo más lejano
+    caja = _recorte(mask, (1, 1, 1))
+    recorte = mask[caja]
+    out = np.zeros_like(mask)
+    if recorte.all():
+        # La caja es el volumen completo y no hay fondo: nada que erosionar
+        out[caja] = True
+    else:
+        out[caja] = distance_transform_edt(recorte, sampling=sampling) > 1.0 + _EPS
+    return out
+
+
+def cierre_edt(mask: np.ndarray, radio_mm: Radio, spacing) -> np.ndarray:
+    """Cierre (dilatación + erosión) con radio en mm por eje, respetando el spacing."""
+    return erosionar_edt(dilatar_edt(mask, radio_mm, spacing), radio_mm, spacing)
+
+
+def apertura_edt(mask: np.ndarray, radio_mm: Radio, spacing) -> np.ndarray:
+    """Apertura (erosión + dilatación) con radio en mm por eje, respetando el spacing."""
+    return dilatar_edt(erosionar_edt(mask, radio_mm, spacing), radio_mm, spacing)
+
+
+def alcance_cortes(radio_mm: Radio, spacing) -> int:
+    """Cortes en Z a los que llega una dilatación o erosión (halo por operación al procesar por bloques)."""
+    radios, _ = _escala(radio_mm, spacing)
+    return max(0, math.floor(radios[0] / float(spacing[0]) + _EPS))
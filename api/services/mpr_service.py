@@ -0,0 +1,121 @@
+# api/services/mpr_service.py
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+MPR_PLANES = ("axial", "sagittal", "coronal", "oblique")
+MPR_MODES = ("avg", "mip", "minip")
+# Lado máximo (px) de un plano reconstruido cuando no se indica el tamaño de píxel
+MPR_MAX_PX = 1024
+
+# Bases (normal, eje de columnas, eje de filas) en coordenadas (z, y, x) del volumen.
+# En sagital y coronal las filas van de Z mayor a menor (superior arriba).
+_BASES = {
+    "axial": ((1.0, 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, 1.0, 0.0)),
+    "coronal": ((0.0, 1.0, 0.0), (0.0, 0.0, 1.0), (-1.0, 0.0, 0.0)),
+    "sagittal": ((0.0, 0.0, 1.0), (0.0, 1.0, 0.0), (-1.0, 0.0, 0.0)),
+}
+
+
+def _unitario(v) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float64)
+    n = np.linalg.norm(v)
+    if not np.isfinite(n) or n < 1e-9:
+        raise ValueError("El vector normal del plano no puede ser nulo")
+    return v / n
+
+
+def base_plano(plane: str, normal_zyx: Optional[Sequence[float]] = None):
+    """
+    (n, u, v) unitarios en mm, orden (z, y, x): normal del plano, eje de columnas
+    y eje de filas de la imagen. Para 'oblique' se usa `normal_zyx` y u es
+    horizontal (perpendicular a Z) salvo que la normal sea paralela a Z.
+    """
+    if plane in _BASES:
+        return tuple(np.array(a) for a in _BASES[plane])
+    if plane != "oblique":
+        raise ValueError(f"Plano no soportado: {plane}")
+    if normal_zyx is None:
+        raise ValueError("El plano oblicuo necesita un vector normal")
+    n = _unitario(normal_zyx)
+    ref = np.array([1.0, 0.0, 0.0]) if abs(n[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+    u = _unitario(np.cross(ref, n))
+    v = np.cross(n, u)
+    if v[0] > 0:  # filas hacia Z decreciente, como sagital/coronal
+        u, v = -u, -v
+    return n, u, v
+
+
+def reslice(
+    vol: np.ndarray,
+    spacing: Sequence[float],
+    plane: str = "sagittal",
+    offset_mm: Optional[float] = None,
+    normal_zyx: Optional[Sequence[float]] = None,
+    center_mm: Optional[Sequence[float]] = None,
+    thickness_mm: float = 0.0,
+    mode: str = "avg",
+    pixel_mm: Optional[float] = None,
+    cval: float = 0.0,
+) -> Tuple[np.ndarray, float]:
+    """
+    Reconstrucción multiplanar de un volumen (Z, Y, X) con spacing (dz, dy, dx) en mm.
+      - El plano pasa por center_mm (por defecto el centro del volumen) desplazado
+        offset_mm a lo largo de su normal.
+      - thickness_mm > 0: slab de planos paralelos separados pixel_mm, reducido con
+        mode ('avg' media, 'mip' máximo, 'minip' mínimo).
+      - pixel_mm: tamaño de píxel de salida (por defecto el menor spacing, limitado
+        a MPR_MAX_PX píxeles por lado).
+    Todas las muestras se interpolan (trilineal) en una sola llamada a map_coordinates.
+    Devuelve (imagen float32 (filas, columnas), pixel_mm).
+    """
+    if mode not in MPR_MODES:
+        raise ValueError(f"Modo de slab no soportado: {mode}")
+    if thickness_mm < 0:
+        raise ValueError("thickness debe ser >= 0")
+    spacing = np.asarray(spacing, dtype=np.float64)
+    shape = np.asarray(vol.shape, dtype=np.float64)
+    n, u, v = base_plano(plane, normal_zyx)
+
+    extent = (shape - 1) * spacing
+    center = extent / 2.0 if center_mm is None else np.asarray(center_mm, dtype=np.float64)
+    if offset_mm is not None:
+        center = center + float(offset_mm) * n
+
+    # Extensión del plano: proyección de las 8 esquinas del volumen sobre u y v
+    corners = np.array(
+        [[z, y, x] for z in (0, extent[0]) for y in (0, extent[1]) for x in (0, extent[2])]
+    ) - center
+    pu, pv = corners @ u, corners @ v
+    if pixel_mm is None:
+        pixel_mm = float(spacing.min())
+        lado = max(pu.max() - pu.min(), pv.max() - pv.min())
+        pixel_mm = max(pixel_mm, lado / (MPR_MAX_PX - 1))
+    if pixel_mm <= 0:
+        raise ValueError("pixel_mm debe ser > 0")
+    cols = np.arange(pu.min(), pu.max() + pixel_mm / 2, pixel_mm)
+    rows = np.arange(pv.min(), pv.max() + pixel_mm / 2, pixel_mm)
+
+    n_slab = max(1, int(round(thickness_mm / pixel_mm)) + 1) if thickness_mm > 0 else 1
+    offs = (np.arange(n_slab) - (n_slab - 1) / 2.0) * (thickness_mm / max(n_slab - 1, 1))
+
+    # Puntos en mm (3, slab, filas, cols) -> índices de voxel
+    pts = (
+        center[:, None, None, None]
+        + n[:, None, None, None] * offs[None, :, None, None]
+        + v[:, None, None, None] * rows[None, None, :, None]
+        + u[:, None, None, None] * cols[None, None, None, :]
+    )
+    coords = pts / spacing[:, None, None, None]
+    samples = map_coordinates(
+        np.asarray(vol, dtype=np.float32), coords, order=1, mode="constant", cval=cval, prefilter=False
+    )
+
+    if mode == "mip":
+        image = samples.max(axis=0)
+    elif mode == "minip":
+        image = samples.min(axis=0)
+    else:
+        image = samples.mean(axis=0)
+    return image.astype(np.float32, copy=False), float(pixel_mm)
@@ -0,0 +1,147 @@
+# api/services/pipeline_cache_service.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from .volume_cache_service import VolumeLRUCache, _volume_cache_dir, intermediate_lru
+
+# Subir este número invalida todos los intermedios cacheados (cambio en alguna etapa)
+PIPELINE_FORMAT = 1
+
+_lock = threading.Lock()
+# session_id -> versión del volumen de la que hay intermedios en la caché
+_versiones: Dict[str, str] = {}
+# etapa -> {"hits": n, "misses": n}
+_por_etapa: Dict[str, dict] = {}
+# Intermedios que no caben en la LRU, escritos a disco / leídos de disco
+_disco = {"spilled": 0, "disk_hits": 0}
+
+
+def _hash(*partes) -> str:
+    h = hashlib.sha1(f"pipeline-v{PIPELINE_FORMAT}".encode())
+    # default=str: escalares numpy (repr exacto) y tuplas de parámetros
+    h.update(json.dumps(partes, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()[:20]
+
+
+def _registrar(etapa: str, acierto: bool) -> None:
+    with _lock:
+        c = _por_etapa.setdefault(etapa, {"hits": 0, "misses": 0})
+        c["hits" if acierto else "misses"] += 1
+
+
+def _dir_desbordados(session_id: str) -> str:
+    # Junto al volumen cacheado: se borra con él (borrar_cache_volumen)
+    return os.path.join(_volume_cache_dir(session_id), "intermediates")
+
+
+def _desbordar(ruta: str, valor: np.ndarray) -> np.ndarray:
+    """Escribe el array como .npy de forma atómica y lo devuelve mapeado en memoria (sólo lectura)."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f"{ruta}.{uuid.uuid4().hex[:8]}.tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=valor.dtype, shape=valor.shape)
+    out[...] = valor
+    out.flush()
+    del out
+    os.replace(tmp, ruta)
+    with _lock:
+        _disco["spilled"] += 1
+    return np.load(ruta, mmap_mode="r")
+
+
+class CacheEtapas:
+    """
+    Nodo de la caché de intermedios de un pipeline, direccionada por contenido:
+    la clave de cada etapa es el hash de la clave de la etapa anterior, su nombre y
+    sus parámetros. La raíz es la versión del volumen (hash de contenido de los DICOM),
+    así que cambiar un parámetro sólo recalcula las etapas aguas abajo y cambiar la
+    serie no reutiliza nada. Los valores viven en intermediate_lru (LRU por bytes); los
+    arrays que no caben en ella (p.ej. el volumen normalizado de un CT grande) se
+    escriben como .npy en la caché en disco de la sesión y se reutilizan mapeados.
+    """
+
+    def __init__(self, session_id: Optional[str], clave: str, lru: Optional[VolumeLRUCache] = None,
+                 etapa: str = "raiz"):
+        self.session_id = session_id
+        self.clave = clave
+        self.lru = lru if lru is not None else intermediate_lru
+        self.etapa = etapa
+
+    @classmethod
+    def desactivada(cls) -> "CacheEtapas":
+        """Nodo sin caché: valor() siempre calcula."""
+        return cls(None, "")
+
+    @classmethod
+    def para_volumen(cls, session_id: str, version: str, *contexto,
+                     lru: Optional[VolumeLRUCache] = None) -> "CacheEtapas":
+        """
+        Raíz para el volumen `version` de la sesión (más un contexto opcional, p.ej. la ROI).
+        Si la sesión tenía intermedios de otra versión del volumen, se descartan.
+        """
+        lru = lru if lru is not None else intermediate_lru
+        if lru.max_bytes <= 0:
+            return cls.desactivada()
+        with _lock:
+            anterior = _versiones.get(session_id)
+            _versiones[session_id] = version
+        if anterior is not None and anterior != version:
+            lru.invalidate_session(session_id)
+            shutil.rmtree(_dir_desbordados(session_id), ignore_errors=True)
+        return cls(session_id, _hash(version, *contexto), lru)
+
+    def hijo(self, etapa: str, params=None) -> "CacheEtapas":
+        if self.session_id is None:
+            return self
+        return CacheEtapas(self.session_id, _hash(self.clave, etapa, params), self.lru, etapa)
+
+    def valor(self, calcular: Callable):
+        """Valor de esta etapa: de la caché o calculado con calcular() (y guardado)."""
+        if self.session_id is None:
+            return calcular()
+        calculado = []
+        ruta = os.path.join(_dir_desbordados(self.session_id), f"{self.clave}.npy")
+
+        def _cargar():
+            if os.path.isfile(ruta):
+                try:
+                    valor = np.load(ruta, mmap_mode="r")
+                    with _lock:
+                        _disco["disk_hits"] += 1
+                    return valor
+                except Exception as e:
+                    print(f"⚠️ Intermedio en disco ilegible, se recalcula: {e}")
+            calculado.append(True)
+            valor = calcular()
+            if isinstance(valor, np.ndarray) and valor.nbytes > self.lru.max_bytes:
+                try:
+                    valor = _desbordar(ruta, valor)
+                except Exception as e:
+                    print(f"⚠️ No se pudo escribir el intermedio {self.etapa} a disco: {e}")
+            return valor
+
+        valor = self.lru.get_or_load((self.session_id, self.clave), _cargar)
+        _registrar(self.etapa, acierto=not calculado)
+        return valor
+
+    def guardar(self, valor) -> None:
+        """Sustituye el valor de esta etapa en la caché (p.ej. un memo que creció)."""
+        if self.session_id is not None:
+            self.lru.put((self.session_id, self.clave), valor)
+
+
+def estadisticas() -> dict:
+    """Métricas de la caché de intermedios: LRU global y aciertos por etapa."""
+    with _lock:
+        etapas = {
+            nombre: {**c, "hit_rate": c["hits"] / (c["hits"] + c["misses"]) if c["hits"] + c["misses"] else 0.0}
+            for nombre, c in _por_etapa.items()
+        }
+        disco = dict(_disco)
+    return {**intermediate_lru.stats(), **disco, "stages": etapas}
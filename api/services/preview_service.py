@@ -0,0 +1,209 @@
+# api/services/preview_service.py
+import io
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from skimage import exposure
+
+from config.settings import PREVIEW_CT_WINDOW, PREVIEW_QUALITY
+
+# Ventanas (nivel, ancho) en HU para CT
+WINDOW_PRESETS = {
+    "ct_bone": (400.0, 1800.0),
+    "ct_brain": (40.0, 80.0),
+    "ct_soft": (40.0, 400.0),
+}
+PREVIEW_MODES = ("lut", "clahe")
+
+# Codificaciones de vista previa: formato PIL, media type y extensión.
+# El orden es la preferencia del servidor en la negociación por Accept.
+PREVIEW_ENCODINGS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+}
+_ALIAS_ENCODING = {"jpg": "jpeg"}
+
+# Rango máximo de valores almacenados para usar LUT (si no, ventana en float)
+_MAX_LUT_SIZE = 1 << 20
+
+
+def ventana_auto(arr: np.ndarray, slope: float = 1.0, intercept: float = 0.0,
+                 p_lo: float = 1.0, p_hi: float = 99.0) -> Tuple[float, float]:
+    """
+    Ventana automática (nivel, ancho) entre los percentiles p_lo/p_hi del corte,
+    ya reescalados. Para enteros usa un histograma (bincount), sin ordenar.
+    """
+    if np.issubdtype(arr.dtype, np.integer) and arr.size:
+        vmin = int(arr.min())
+        vmax = int(arr.max())
+        if vmax - vmin < _MAX_LUT_SIZE:
+            counts = np.bincount(arr.ravel().astype(np.intp) - vmin, minlength=vmax - vmin + 1)
+            cum = np.cumsum(counts)
+            lo = vmin + int(np.searchsorted(cum, cum[-1] * p_lo / 100.0))
+            hi = vmin + int(np.searchsorted(cum, cum[-1] * p_hi / 100.0))
+        else:
+            lo, hi = np.percentile(arr, [p_lo, p_hi])
+    elif arr.size:
+        lo, hi = np.percentile(arr, [p_lo, p_hi])
+    else:
+        lo, hi = 0.0, 1.0
+    lo = float(lo) * slope + intercept
+    hi = float(hi) * slope + intercept
+    if hi <= lo:
+        hi = lo + 1.0
+    return (lo + hi) / 2.0, hi - lo
+
+
+def _ventana_a_uint8(values: np.ndarray, wl: float, ww: float) -> np.ndarray:
+    ww = max(float(ww), 1e-6)
+    out = (values - (wl - ww / 2.0)) * (255.0 / ww)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def aplicar_ventana(arr: np.ndarray, wl: float, ww: float, slope: float = 1.0, intercept: float = 0.0) -> np.ndarray:
+    """
+    Aplica nivel/ancho (en unidades reescaladas) y devuelve uint8.
+    Con datos enteros construye una tabla de búsqueda sobre el rango de valores
+    almacenados del corte y la indexa: una sola pasada vectorizada sobre los píxeles.
+    """
+    if np.issubdtype(arr.dtype, np.integer) and arr.size:
+        vmin = min(int(arr.min()), 0)
+        vmax = int(arr.max())
+        if vmax - vmin < _MAX_LUT_SIZE:
+            stored = np.arange(vmin, vmax + 1, dtype=np.float64)
+            lut = _ventana_a_uint8(stored * slope + intercept, wl, ww)
+            if vmin == 0:
+                return lut[arr]
+            return lut[arr.astype(np.int64) - vmin]
+    values = arr.astype(np.float32) * slope + intercept
+    return _ventana_a_uint8(values, wl, ww)
+
+
+def render_clahe(arr: np.ndarray) -> np.ndarray:
+    """Vista previa de calidad (modo 'clahe'): normalización + CLAHE en float."""
+    image = arr.astype(np.float32)
+
+    # Normaliza al rango [0, 1]
+    if np.max(image) > 1:
+        image = (image - np.min(image)) / (np.max(image) - np.min(image) + 1e-6)
+
+    # Aplica CLAHE (ecualización adaptativa)
+    try:
+        image = exposure.equalize_adapthist(image)
+    except Exception:
+        # Si falla, recorta valores
+        image = np.clip(image, 0, 1)
+
+    # Convierte a 8 bits (0-255)
+    return (image * 255).astype("uint8")
+
+
+def resolver_ventana(arr: np.ndarray, modality: str, slope: float, intercept: float,
+                     window: Optional[str] = None) -> Tuple[float, float]:
+    """
+    Ventana a usar según modalidad: presets de CT (ct_bone/ct_brain/ct_soft) o
+    'auto' (percentiles del corte, p.ej. MR). window=None → preset por defecto de CT.
+    """
+    if window is None:
+        window = PREVIEW_CT_WINDOW if modality == "CT" else "auto"
+    if window in WINDOW_PRESETS and modality == "CT":
+        return WINDOW_PRESETS[window]
+    return ventana_auto(arr, slope, intercept)
+
+
+def render_preview(arr: np.ndarray, modality: str = "", slope: float = 1.0, intercept: float = 0.0,
+                   mode: str = "lut", window: Optional[str] = None) -> np.ndarray:
+    """
+    Genera la vista previa uint8 de un corte.
+      - mode='lut' (rápido): ventana por modalidad aplicada con tabla de búsqueda.
+      - mode='clahe' (calidad): ecualización adaptativa, como antes.
+    """
+    if mode == "clahe":
+        return render_clahe(arr)
+    if mode != "lut":
+        raise ValueError(f"Modo de vista previa no soportado: {mode}")
+    wl, ww = resolver_ventana(arr, modality, slope, intercept, window)
+    return aplicar_ventana(arr, wl, ww, slope, intercept)
+
+
+def normalizar_encoding(fmt: str) -> str:
+    """'jpg' -> 'jpeg', en minúsculas. ValueError si no está soportado."""
+    fmt = _ALIAS_ENCODING.get(fmt.lower(), fmt.lower())
+    if fmt not in PREVIEW_ENCODINGS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    return fmt
+
+
+def lista_encodings(value) -> Tuple[str, ...]:
+    """
+    Encodings a generar en la ingesta, en orden de preferencia, desde una lista o
+    un texto separado por comas ("webp,png"). PNG no se añade: el visor lo sirve
+    bajo demanda (/series/{id}/slices/image_{idx}.png). Vacío = ("png",).
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    out = []
+    for fmt in value or ():
+        if not fmt.strip():
+            continue
+        fmt = normalizar_encoding(fmt.strip())
+        if fmt not in out:
+            out.append(fmt)
+    return tuple(out) or ("png",)
+
+
+def codificar_preview(image: np.ndarray, fmt: str = "png", quality: Optional[int] = None) -> bytes:
+    """
+    Codifica una vista previa uint8 (o una PIL.Image).
+      - png: sin pérdida
+      - webp / jpeg: con pérdida, quality 1-100 (None = config.settings.PREVIEW_QUALITY)
+    """
+    fmt = normalizar_encoding(fmt)
+    im = image if isinstance(image, Image.Image) else Image.fromarray(image)
+    if im.mode not in ("L", "RGB"):
+        im = im.convert("L")
+    pil_format = PREVIEW_ENCODINGS[fmt][0]
+    buf = io.BytesIO()
+    if fmt == "png":
+        im.save(buf, format=pil_format)
+    elif fmt == "webp":
+        # method=2: mismo tamaño que el valor por defecto (4) en ~40% del tiempo
+        im.save(buf, format=pil_format, quality=int(quality or PREVIEW_QUALITY), method=2)
+    else:
+        im.save(buf, format=pil_format, quality=int(quality or PREVIEW_QUALITY))
+    return buf.getvalue()
+
+
+def negociar_encoding(accept: Optional[str], disponibles: Iterable[str] = tuple(PREVIEW_ENCODINGS)) -> str:
+    """
+    Elige la codificación según la cabecera Accept. Sólo los media types pedidos
+    explícitamente (image/webp, image/jpeg) ganan a PNG; los comodines
+    (image/*, */*) y la ausencia de Accept devuelven PNG, que es el respaldo.
+    Empates de q: preferencia del servidor (orden de PREVIEW_ENCODINGS).
+    """
+    disponibles = [f for f in PREVIEW_ENCODINGS if f in set(disponibles)]
+    por_tipo = {PREVIEW_ENCODINGS[f][1]: f for f in disponibles}
+    scores = {}
+    for parte in (accept or "").split(","):
+        campos = [c.strip() for c in parte.split(";")]
+        media = campos[0].lower()
+        q = 1.0
+        for c in campos[1:]:
+            if c.startswith("q="):
+                try:
+                    q = float(c[2:])
+                except ValueError:
+                    q = 0.0
+        if media in por_tipo:
+            fmt = por_tipo[media]
+        elif media in ("image/*", "*/*") and "png" in disponibles:
+            fmt = "png"
+        else:
+            continue
+        scores[fmt] = max(scores.get(fmt, 0.0), q)
+    candidatos = [f for f in disponibles if scores.get(f, 0.0) > 0]
+    if not candidatos:
+        return "png" if "png" in disponibles or not disponibles else disponibles[0]
+    return max(candidatos, key=lambda f: (scores[f], -disponibles.index(f)))
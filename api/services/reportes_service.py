@@ -14,14 +14,23 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Optional
 import os
 from config.db_config import get_connection
 
 
-def generar_reporte_estudio(session_id: str, user_id: int) -> str:
+def generar_reporte_estudio(
+    session_id: str,
+    user_id: int,
+    progress: Optional[Callable[[float, str], None]] = None,
+) -> str:
     """
     Genera un reporte PDF completo del estudio DICOM con todas las segmentaciones
+    - progress: callback opcional progress(fraccion, etapa) para trabajos en segundo plano
+      (en un job es también el punto de cancelación: antes de cada sección)
     """
+    report = progress or (lambda fraccion, etapa: None)
+    report(0.0, "paciente")
 
     # Crear carpeta de reportes
     reportes_dir = Path("api/static/reportes")
@@ -199,6 +208,7 @@ def generar_reporte_estudio(session_id: str, user_id: int) -> str:
                     elements.append(Spacer(1, 0.3 * inch))
 
         # ============ SEGMENTACIONES 2D ============
+        report(0.2, "seg2d")
         cur.execute(
             """
             SELECT pd.altura, pd.longitud, pd.ancho, pd.volumen, pd.unidad, pd.tipoprotesis,
@@ -256,6 +266,7 @@ def generar_reporte_estudio(session_id: str, user_id: int) -> str:
                 elements.append(Spacer(1, 0.2 * inch))
 
         # ============ SEGMENTACIONES 3D ============
+        report(0.4, "seg3d")
         cur.execute(
             """
             SELECT volume_mm3, surface_mm2, bbox_x_mm, bbox_y_mm, bbox_z_mm, n_slices, created_at
@@ -310,6 +321,7 @@ def generar_reporte_estudio(session_id: str, user_id: int) -> str:
                 elements.append(Spacer(1, 0.2 * inch))
 
         # ============ MODELOS STL ============
+        report(0.6, "stl")
         cur.execute(
             """
             SELECT path_stl, file_size_bytes, num_vertices, num_caras, created_at
@@ -356,6 +368,7 @@ def generar_reporte_estudio(session_id: str, user_id: int) -> str:
                 elements.append(Spacer(1, 0.15 * inch))
 
         # ============ INFORMACIÓN TÉCNICA ============
+        report(0.8, "tecnica")
         elements.append(PageBreak())
         elements.append(Paragraph("INFORMACIÓN TÉCNICA", subtitle_style))
 
@@ -398,6 +411,7 @@ def generar_reporte_estudio(session_id: str, user_id: int) -> str:
         conn.close()
 
     # Generar PDF
+    report(0.9, "pdf")
     doc.build(elements)
 
     return f"/static/reportes/{pdf_filename}"
@@ -1,16 +1,38 @@
 # api/services/segmentation3d_service.py
 import os
-import json
+import tempfile
 import time
 import uuid
 import numpy as np
-import pydicom
 from skimage import measure, morphology, io
 from config.db_config import get_connection
 from skimage.filters import threshold_otsu
 from skimage.morphology import binary_closing, ball
-from typing import Optional
-from scipy.ndimage import binary_fill_holes, median_filter
+from skimage.segmentation import flood
+from typing import Callable, List, Optional, Tuple
+from scipy.ndimage import binary_fill_holes, generate_binary_structure, median_filter
+
+from config.settings import CACHE_DIR, SEG_MEMORY_BYTES, SEG_WORKERS
+
+from .blockwise_service import (
+    ComponentesPorBloques,
+    contar as contar_bloques,
+    filtrar_por_bloques,
+    en_paralelo,
+    iterar_bloques,
+    otsu as otsu_bloques,
+    percentil as percentil_bloques,
+    planificar_bloques,
+    rango as rango_bloques,
+    repartir_bloques,
+)
+from .decode_service import decodificar_paralelo
+from .histogram_service import IndiceHistograma, indice_histograma
+from .manifest_service import MANIFEST_NAME, clave_corte, clave_grupo, obtener_manifest
+from .mask3d_service import MASK_EXT, bbox_mascara, guardar_mascara_3d, marching_cubes_recortado
+from .morphology_service import Radio, alcance_cortes, apertura_edt, cierre_edt
+from .pipeline_cache_service import CacheEtapas
+from .volume_cache_service import cargar_volumen, firma_archivos, guardar_volumen, version_volumen, volume_lru
 
 
 def _serie_dir(session_id: str):
@@ -35,21 +57,17 @@ def _save_ascii_stl(verts: np.ndarray, faces: np.ndarray, filepath: str, solid_n
     Guarda un STL ASCII simple a partir de vértices y caras.
     verts: (N, 3), faces: (M, 3) índices a verts.
     """
+    tris = verts[faces]  # (M, 3 vértices, 3)
+    v1, v2, v3 = tris[:, 0], tris[:, 1], tris[:, 2]
+
+    # Normales de todas las caras a la vez (unitarias; 0 en caras degeneradas)
+    normales = np.cross(v2 - v1, v3 - v1)
+    norma = np.linalg.norm(normales, axis=1, keepdims=True)
+    normales = np.divide(normales, norma, out=np.zeros_like(normales), where=norma > 0)
+
     with open(filepath, "w", encoding="utf-8") as f:
         f.write(f"solid {solid_name}\n")
-        for tri in faces:
-            v1 = verts[tri[0]]
-            v2 = verts[tri[1]]
-            v3 = verts[tri[2]]
-
-            # Normal de la cara
-            n = np.cross(v2 - v1, v3 - v1)
-            norm = np.linalg.norm(n)
-            if norm > 0:
-                n = n / norm
-            else:
-                n = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-
+        for n, v1, v2, v3 in zip(normales, v1, v2, v3):
             f.write(f"  facet normal {n[0]} {n[1]} {n[2]}\n")
             f.write("    outer loop\n")
             f.write(f"      vertex {v1[0]} {v1[1]} {v1[2]}\n")
@@ -62,204 +80,1009 @@ def _save_ascii_stl(verts: np.ndarray, faces: np.ndarray, filepath: str, solid_n
 
 # ========= Carga y construcción del volumen 3D =========
 
-def _load_stack(session_id: str):
+def _seleccionar_cortes(session_id: str):
     """
-    Carga la serie DICOM asociada a session_id y devuelve:
-      - vol: volumen 3D (Z, Y, X)
+    Decide, sólo a partir del manifest de la serie (sin tocar los DICOM):
+      - entries: cortes a usar, ordenados por Z / InstanceNumber / nombre
       - spacing: (dz, dy, dx) en mm
-      - modality0: modalidad principal (CT/MR/...)
+      - meta0: entrada del manifest del primer corte (modalidad, rescale, ...)
 
-    Robusto:
-      - Filtra SC, RGB, slices sin pixel_array.
-      - Lee TODOS los slices válidos.
-      - Elige la resolución (shape) más frecuente del ZIP.
-      - Si hay exactamente 2 cortes -> interpola un tercero.
-      - Si hay 1 corte -> lo replica para crear volumen mínimo.
+    Filtra SC, RGB y cortes sin píxeles y agrupa el resto por serie, resolución y
+    orientación (clave_grupo); el volumen es el grupo más numeroso, decidido antes
+    de decodificar un solo píxel. Los multi-frame llegan ya expandidos: una entrada por frame.
     """
     base = _serie_dir(session_id)
-    mapping_path = os.path.join(base, "mapping.json")
-    if not os.path.isfile(mapping_path):
-        raise FileNotFoundError("mapping.json no encontrado para la serie")
+    manifest = obtener_manifest(base)
 
-    with open(mapping_path, "r", encoding="utf-8") as f:
-        mapping = json.load(f)
-
-    entries = []
-    for _, meta in mapping.items():
-        dcm_name = meta.get("dicom_name")
-        if not dcm_name:
+    grupos = {}  # {clave_grupo: [entradas]}
+    for meta in manifest:
+        p = os.path.join(base, meta["dicom_name"])
+        if not meta.get("has_pixels", True) or not os.path.isfile(p):
             continue
-        p = os.path.join(base, dcm_name)
-        if os.path.isfile(p):
-            entries.append(p)
-    if not entries:
+        if meta.get("modality") == "SC":
+            print(f"⚠️ Slice descartado por ser SC: {p}")
+            continue
+        if meta.get("samples", 1) == 3:
+            print(f"⚠️ Slice descartado por ser RGB → {p}")
+            continue
+        grupos.setdefault(clave_grupo(meta), []).append(meta)
+
+    if not grupos:
         raise ValueError("No se encontraron DICOM válidos en la serie")
 
+    # ---- Elegir el grupo principal (serie/resolución/orientación más frecuente) ----
+    entries = max(grupos.values(), key=len)
+    target_shape = (entries[0]["rows"], entries[0]["cols"])
+    print(f"✅ Resolución principal seleccionada: {target_shape} ({len(entries)} cortes)")
+    if len(grupos) > 1:
+        print(f"⚠️ {len(grupos) - 1} grupo(s) de cortes con otra serie/resolución/orientación descartados")
+
     # ---- Ordenar cortes por Z o InstanceNumber ----
-    enriched = []
-    for p in entries:
-        ds = pydicom.dcmread(p, force=True, stop_before_pixels=True)
-        modality = str(getattr(ds, "Modality", "")).upper()
-
-        z = None
-        ipp = getattr(ds, "ImagePositionPatient", None)
-        if isinstance(ipp, (list, tuple)) and len(ipp) == 3:
-            try:
-                z = float(ipp[2])
-            except Exception:
-                z = None
+    def _sort_key(m):
+        frame = m.get("frame") or 0
+        if m.get("z") is not None:
+            return (0, m["z"], frame)
+        if m.get("instance") is not None:
+            return (1, m["instance"], frame)
+        return (2, m["dicom_name"], frame)
 
-        inst = getattr(ds, "InstanceNumber", None)
-        inst = int(inst) if inst is not None else None
-        enriched.append((p, modality, z, inst))
+    entries.sort(key=_sort_key)
 
-    def _sort_key(t):
-        p, modality, z, inst = t
-        if z is not None:
-            return (0, z)
-        if inst is not None:
-            return (1, inst)
-        return (2, os.path.basename(p))
+    # ===== ESPACIADOS =====
+    meta0 = entries[0]
 
-    enriched.sort(key=_sort_key)
+    # Pixel spacing (Y, X)
+    px_y, px_x = 1.0, 1.0
+    if meta0.get("pixel_spacing") and len(meta0["pixel_spacing"]) == 2:
+        px_y, px_x = meta0["pixel_spacing"]
 
-    # ---- 1ª pasada: leer TODOS los slices válidos y contar shapes ----
-    tmp_slices = []          # (arr, ds, z)
-    shape_counts = {}        # {(H, W): count}
-    z_values_all = []        # z de todos los candidatos (para spacing)
+    z_values = [m["z"] for m in entries if m.get("z") is not None]
+    dz = None
+    if len(z_values) >= 2:
+        z_sorted = np.sort(np.array(z_values, dtype=np.float64))
+        diffs = np.diff(z_sorted)
+        diffs = diffs[np.isfinite(diffs) & (np.abs(diffs) > 1e-6)]
+        if diffs.size > 0:
+            dz = float(np.median(np.abs(diffs)))
 
-    for p, modality, z, _ in enriched:
-        ds = pydicom.dcmread(p, force=True)
+    if dz is None:
+        dz = meta0.get("spacing_between_slices")
 
-        # Filtrar SC
-        if str(getattr(ds, "Modality", "")).upper() == "SC":
-            print(f"⚠️ Slice descartado por ser SC: {p}")
-            continue
+    if dz is None:
+        dz = meta0.get("slice_thickness")
 
-        # pixel_array
-        try:
-            arr = ds.pixel_array
-        except Exception:
-            print(f"⚠️ Slice descartado: no tiene pixel_array → {p}")
-            continue
+    if dz is None or dz <= 0:
+        dz = 1.0
 
-        # Manejo RGB / multi-frame
-        if arr.ndim == 3:
-            if arr.shape[-1] == 3:
-                print(f"⚠️ Slice descartado por ser RGB: {arr.shape} → {p}")
-                continue
-            if arr.shape[0] > 1 and arr.shape[1] == arr.shape[2]:
-                arr = arr[0]
-            if arr.ndim == 3:
-                print(f"⚠️ Slice descartado por shape 3D no soportado: {arr.shape} → {p}")
-                continue
+    spacing = (float(dz), float(px_y), float(px_x))
+    return entries, spacing, meta0
 
-        if arr.ndim != 2:
-            print(f"⚠️ Slice descartado por no ser 2D: ndim={arr.ndim}, shape={arr.shape} → {p}")
-            continue
 
-        arr = arr.astype(np.float32)
-        shape = arr.shape
-        shape_counts[shape] = shape_counts.get(shape, 0) + 1
+def _spacing_serie(session_id: str):
+    """Spacing (dz, dy, dx) en mm de la serie, leído sólo del manifest."""
+    _, spacing, _, _ = _cortes_versionados(session_id)
+    return spacing
 
-        tmp_slices.append((arr, ds, z))
-        if z is not None:
-            z_values_all.append(z)
 
-    if not tmp_slices:
-        raise ValueError("No se pudieron leer píxeles DICOM válidos para construir el volumen 3D.")
+def _load_stack(session_id: str):
+    """
+    Carga la serie DICOM asociada a session_id y devuelve:
+      - vol: volumen 3D (Z, Y, X)
+      - spacing: (dz, dy, dx) en mm
+      - modality0: modalidad principal (CT/MR/...)
 
-    # ---- Elegir la resolución principal (shape más frecuente) ----
-    target_shape = max(shape_counts.items(), key=lambda kv: kv[1])[0]
-    print(f"✅ Resolución principal seleccionada: {target_shape} ({shape_counts[target_shape]} cortes)")
+    El volumen reescalado se guarda una vez por sesión en la caché de volúmenes;
+    las cargas siguientes son un np.memmap de sólo lectura (sin decodificar DICOM).
+    Además se mantiene en la LRU en proceso (volume_lru) para llamadas repetidas.
+    Ambas cachés se invalidan por el hash de contenido de los cortes y de los
+    archivos en disco (_cortes_versionados).
+    El volumen devuelto es de sólo lectura.
+    """
+    vol, spacing, modality0, _ = _load_volume(session_id)
+    return vol, spacing, modality0
+
+
+def _load_volume(session_id: str):
+    """
+    Como _load_stack, pero devuelve además `slices`: la clave de cada corte del
+    volumen (clave_corte: dicom_name o dicom_name#frame; None en cortes sintéticos),
+    para ubicar una imagen del mapping en Z.
+    """
+    entries, spacing, meta0, version = _cortes_versionados(session_id)
+    return volume_lru.get_or_load(
+        (session_id, version),
+        lambda: _load_stack_sin_lru(session_id, version, entries, spacing, meta0),
+    )
+
+
+# {session_id: (mtime_ns del manifest, (entries, spacing, meta0, firma, version))}
+_versiones = {}
+
+
+def _mtime_manifest(base: str) -> Optional[int]:
+    try:
+        return os.stat(os.path.join(base, MANIFEST_NAME)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cortes_versionados(session_id: str):
+    """
+    (entries, spacing, meta0, version) de la serie, memoizado por sesión y mtime
+    del manifest: mientras el manifest no cambie no se relee ni se re-hashea, sólo
+    se hace stat de los DICOM (firma_archivos) para detectar archivos reemplazados.
+    """
+    base = _serie_dir(session_id)
+    mtime = _mtime_manifest(base)
+    memo = _versiones.get(session_id)
+    if memo is not None and mtime is not None and memo[0] == mtime:
+        entries, spacing, meta0, firma, version = memo[1]
+        if firma_archivos(base, entries) == firma:
+            return entries, spacing, meta0, version
+
+    entries, spacing, meta0 = _seleccionar_cortes(session_id)
+    firma = firma_archivos(base, entries)
+    version = version_volumen(entries, firma)
+    if mtime is None:
+        mtime = _mtime_manifest(base)  # obtener_manifest pudo migrarlo recién
+    _versiones[session_id] = (mtime, (entries, spacing, meta0, firma, version))
+    return entries, spacing, meta0, version
+
+
+def _version_serie(session_id: str) -> str:
+    """Hash de contenido del volumen de la serie (ver _cortes_versionados)."""
+    return _cortes_versionados(session_id)[3]
+
+
+def _load_stack_sin_lru(session_id: str, version: str, entries: list, spacing: tuple, meta0: dict):
+    cached = cargar_volumen(session_id, version)
+    if cached is not None:
+        vol, spacing, modality0, names = cached
+        if vol.nbytes <= volume_lru.max_bytes:
+            vol = np.array(vol)  # a RAM para la LRU; si no cabe se sirve el memmap
+        return vol, spacing, modality0, names
+
+    vol, modality0, names = _construir_volumen(session_id, entries, meta0)
+    try:
+        guardar_volumen(session_id, version, vol, spacing, modality0, slices=names)
+    except Exception as e:
+        print(f"⚠️ No se pudo cachear el volumen de {session_id}: {e}")
+    # Índice de histograma una vez por versión del volumen (umbrales, Otsu, selector del visor)
+    try:
+        indice_histograma(session_id, version, vol)
+    except Exception as e:
+        print(f"⚠️ No se pudo indexar el histograma de {session_id}: {e}")
+    return vol, spacing, modality0, names
+
+
+def _construir_volumen(session_id: str, entries: list, meta0: dict):
+    """
+    Decodifica los cortes elegidos por _seleccionar_cortes y arma el volumen.
+
+    Robusto:
+      - Orden, filtrado y spacing salen del manifest: cada DICOM se lee una
+        sola vez, para sus píxeles.
+      - Multi-frame: los frames elegidos se decodifican uno a uno (iterar_frames),
+        sin materializar el archivo completo.
+      - Series comprimidas: se decodifican en paralelo (decodificar_paralelo).
+      - Descarta slices sin pixel_array decodificable.
+      - Si hay exactamente 2 cortes -> interpola un tercero.
+      - Si hay 1 corte -> lo replica para crear volumen mínimo.
+    En CT cada corte se reescala con su propio slope/intercept (por frame en
+    Enhanced CT; si falta, el del primer corte).
+    Devuelve (vol, modality0, names) con names[z] = clave_corte (None si es sintético).
+    """
+    base = _serie_dir(session_id)
+    modality0 = meta0.get("modality", "")
+
+    # Frames a decodificar por archivo (un archivo se abre una sola vez)
+    por_archivo = {}
+    for meta in entries:
+        por_archivo.setdefault(meta["dicom_name"], []).append(meta.get("frame"))
+
+    rutas = {os.path.join(base, dicom_name): dicom_name for dicom_name in por_archivo}
+    pedidos = [
+        (p, None if frames == [None] else [f for f in frames if f is not None])
+        for p, frames in zip(rutas, por_archivo.values())
+    ]
+    decodificados = {
+        clave_corte(rutas[p], frame): arr
+        for (p, frame), arr in decodificar_paralelo(pedidos).items()
+    }
 
-    # ---- 2ª pasada: quedarnos sólo con esos cortes ----
     slices = []
-    z_values = []
-    for arr, ds, z in tmp_slices:
-        if arr.shape != target_shape:
-            print(f"⚠️ Slice descartado por otra resolución: {arr.shape} != {target_shape}")
+    names = []
+    for meta in entries:
+        key = clave_corte(meta["dicom_name"], meta.get("frame"))
+        arr = decodificados.pop(key, None)
+        if arr is None:
+            continue
+        if arr.ndim != 2:
+            p = os.path.join(base, meta["dicom_name"])
+            print(f"⚠️ Slice descartado por no ser 2D: ndim={arr.ndim}, shape={arr.shape} → {p}")
             continue
-        slices.append((arr, ds))
-        if z is not None:
-            z_values.append(z)
+
+        arr = arr.astype(np.float32)
+        if modality0 == "CT":
+            # Normalización HU
+            slope = meta.get("slope") if meta.get("slope") is not None else meta0.get("slope")
+            intercept = meta.get("intercept") if meta.get("intercept") is not None else meta0.get("intercept")
+            slope = 1.0 if slope is None else slope
+            intercept = 0.0 if intercept is None else intercept
+            arr = arr * slope + intercept
+        slices.append(arr)
+        names.append(key)
 
     if not slices:
-        raise ValueError("No se encontraron slices con resolución consistente para el volumen 3D.")
+        raise ValueError("No se pudieron leer píxeles DICOM válidos para construir el volumen 3D.")
 
     # ---- Casos especiales de pocos cortes ----
     if len(slices) == 1:
         # Volumen sintético por replicación de la única lámina
         print("⚠️ Solo 1 corte válido → replicando para crear volumen sintético (no anatómico).")
-        arr, ds0 = slices[0]
-        slices = [(arr, ds0), (arr.copy(), ds0), (arr.copy(), ds0)]
+        arr = slices[0]
+        slices = [arr, arr.copy(), arr.copy()]
+        names = [names[0], None, None]
     elif len(slices) == 2:
         print("⚠️ Solo 2 cortes válidos → generando corte interpolado.")
-        arr1, ds1 = slices[0]
-        arr2, ds2 = slices[1]
-        arr_mid = _interpolar_slice(arr1, arr2)
-        slices = [(arr1, ds1), (arr_mid, ds1), (arr2, ds2)]
+        arr1, arr2 = slices
+        slices = [arr1, _interpolar_slice(arr1, arr2), arr2]
+        names = [names[0], None, names[1]]
 
-    # A partir de aquí siempre hay al menos 3 cortes sintéticos o reales
-    # ===== ESPACIADOS =====
-    ds0 = slices[0][1]
+    # ===== Volumen 3D =====
+    vol = np.stack(slices, axis=0)
+    if modality0 == "CT":
+        vol = np.clip(vol, -1024, 4000)
 
-    # Pixel spacing (Y, X)
-    px_y, px_x = 1.0, 1.0
-    try:
-        if hasattr(ds0, "PixelSpacing"):
-            px_y, px_x = [float(v) for v in ds0.PixelSpacing]
-        elif hasattr(ds0, "ImagerPixelSpacing"):
-            px_y, px_x = [float(v) for v in ds0.ImagerPixelSpacing]
-    except Exception:
-        pass
+    return vol.astype(np.float32, copy=False), modality0, names
 
-    # Slice thickness
-    slice_thk = None
-    try:
-        slice_thk = float(getattr(ds0, "SliceThickness", None))
-    except Exception:
-        slice_thk = None
 
-    dz = None
-    if len(z_values) >= 2:
-        z_sorted = np.sort(np.array(z_values, dtype=np.float64))
-        diffs = np.diff(z_sorted)
-        diffs = diffs[np.isfinite(diffs) & (np.abs(diffs) > 1e-6)]
-        if diffs.size > 0:
-            dz = float(np.median(np.abs(diffs)))
+# ========= Segmentación 3D + STL =========
 
-    if dz is None:
-        sbs = getattr(ds0, "SpacingBetweenSlices", None)
-        if sbs is not None:
+# Umbrales (HU) de los presets CT
+PRESETS_CT = {
+    "ct_bone": (250.0, 4000.0),
+    "ct_head": (-300.0, 3000.0),
+    "ct_soft": (-150.0, 300.0),
+    "ct_lung": (-1000.0, -300.0),
+}
+# Memoria de trabajo estimada por voxel: en memoria (volumen, mediana, vnorm float64,
+# máscaras y etiquetas int64 a la vez) y por bloques (por voxel del bloque con halo)
+BYTES_VOXEL_MEMORIA = 40
+BYTES_VOXEL_BLOQUE = 32
+# Implementaciones del cierre morfológico (ver _cierre)
+CLOSING_METHODS = ("ball", "edt")
+# Margen (mm) alrededor de la componente hallada en la pasada gruesa (modo coarse-to-fine)
+MARGEN_ROI_MM = 10.0
+# Etiquetas por ejecución del modo multi-etiqueta (bits de la LUT de rangos)
+MAX_ETIQUETAS = 16
+
+
+def _normalizar_clip(vol: np.ndarray, lo, hi) -> np.ndarray:
+    vclip = np.clip(vol, lo, hi)
+    return (vclip - lo) / (hi - lo + 1e-6)
+
+
+def _normalizado(vol: np.ndarray, regla: tuple) -> np.ndarray:
+    """Volumen normalizado a [0, 1] de las reglas "norm" y "otsu" (ver _aplicar_umbral)."""
+    tipo, lo, hi = regla[:3]
+    if tipo == "norm":
+        vnorm = (vol - lo) / (hi - lo + 1e-6)
+        return np.clip(vnorm, 0, 1)
+    return _normalizar_clip(vol, lo, hi)
+
+
+def _aplicar_umbral(vol: np.ndarray, regla: tuple, normalizado: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Máscara booleana de `vol` (volumen completo o un bloque) según la regla de _regla_umbral.
+    normalizado: _normalizado(vol, regla) ya calculado (caché de intermedios).
+    """
+    tipo = regla[0]
+    if tipo == "vacia":
+        return np.zeros(vol.shape, dtype=bool)
+    if tipo == "rango":
+        _, tmin, tmax = regla
+        return (vol >= tmin) & (vol <= tmax)
+    if normalizado is None:
+        normalizado = _normalizado(vol, regla)
+    return normalizado > regla[3]
+
+
+def etiquetas_multi(texto: str) -> List[Tuple[str, float, float]]:
+    """
+    Etiquetas del modo multi-etiqueta: "ct_bone,ct_soft,grasa:-190:-30" ->
+    [(nombre, tmin, tmax), ...] con presets de PRESETS_CT o rangos nombre:min:max.
+    """
+    etiquetas = []
+    for parte in (p.strip() for p in (texto or "").split(",")):
+        if not parte:
+            continue
+        if parte in PRESETS_CT:
+            etiquetas.append((parte,) + PRESETS_CT[parte])
+            continue
+        campos = parte.split(":")
+        if len(campos) != 3 or not campos[0]:
+            raise ValueError(f"Etiqueta inválida: {parte} (preset o nombre:min:max)")
+        try:
+            tmin, tmax = float(campos[1]), float(campos[2])
+        except ValueError:
+            raise ValueError(f"Rango inválido en la etiqueta {parte}")
+        if not (np.isfinite(tmin) and np.isfinite(tmax)) or tmin > tmax:
+            raise ValueError(f"Rango inválido en la etiqueta {parte}")
+        etiquetas.append((campos[0], tmin, tmax))
+    if not etiquetas:
+        raise ValueError("Indica al menos una etiqueta")
+    if len(etiquetas) > MAX_ETIQUETAS:
+        raise ValueError(f"Como máximo {MAX_ETIQUETAS} etiquetas")
+    nombres = [e[0] for e in etiquetas]
+    if len(set(nombres)) != len(nombres):
+        raise ValueError("Etiquetas repetidas")
+    return etiquetas
+
+
+def _tabla_rangos(rangos: List[Tuple[float, float]], dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (puntos, lut) para binarizar con varios rangos [tmin, tmax] a la vez: los extremos
+    ordenados parten la recta en celdas (cada punto y cada intervalo abierto entre
+    puntos) y lut[celda] es la máscara de bits de los rangos que la contienen.
+    Los extremos se redondean al tipo del volumen, como al comparar vol >= tmin.
+    """
+    rangos = np.asarray(rangos, dtype=dtype).astype(np.float64)
+    puntos = np.unique(rangos.ravel())
+    medios = np.concatenate([[puntos[0] - 1.0], (puntos[:-1] + puntos[1:]) / 2.0, [puntos[-1] + 1.0]])
+    # Celda 2i: intervalo abierto antes de puntos[i]; celda 2i+1: el punto puntos[i]
+    representantes = np.empty(2 * puntos.size + 1)
+    representantes[0::2] = medios
+    representantes[1::2] = puntos
+    lut = np.zeros(representantes.size, dtype=np.min_scalar_type((1 << len(rangos)) - 1))
+    for k, (tmin, tmax) in enumerate(rangos):
+        lut[(representantes >= tmin) & (representantes <= tmax)] |= 1 << k
+    return puntos.astype(dtype), lut
+
+
+def _aplicar_rangos(vol: np.ndarray, puntos: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """Bits de los rangos de _tabla_rangos que contienen cada voxel (NaN: ninguno)."""
+    antes = np.searchsorted(puntos, vol, side="left")
+    hasta = np.searchsorted(puntos, vol, side="right")
+    bits = lut[antes + hasta]
+    bits[np.isnan(vol)] = 0
+    return bits
+
+
+class _EstadisticasMemoria:
+    """Estadísticas del volumen completo (np.percentile / threshold_otsu)."""
+
+    def __init__(self, vol: np.ndarray):
+        self.vol = vol
+        self.v = vol[np.isfinite(vol)]
+        self.n = int(self.v.size)
+
+    def rango(self):
+        return self.v.min(), self.v.max()
+
+    def percentil(self, q):
+        return np.percentile(self.v, q)
+
+    def otsu_normalizado(self, lo, hi) -> float:
+        vclip = _normalizar_clip(self.vol, lo, hi)
+        try:
+            return float(threshold_otsu(vclip[vclip > 0]))
+        except Exception:
+            return float(np.percentile(vclip, 95))
+
+    def contar_umbral(self, regla: tuple) -> int:
+        return int(np.count_nonzero(_aplicar_umbral(self.vol, regla)))
+
+
+class _EstadisticasBloques:
+    """Las mismas estadísticas, exactas, recorriendo el volumen por bloques (blockwise_service)."""
+
+    def __init__(self, vol: np.ndarray, bloques: list):
+        self.vol = vol
+        self.bloques = bloques
+        self._finitos = lambda: (b[np.isfinite(b)] for b in iterar_bloques(vol, bloques))
+        self.n = contar_bloques(self._finitos)
+
+    def rango(self):
+        return rango_bloques(self._finitos)
+
+    def percentil(self, q):
+        return percentil_bloques(self._finitos, q, self.vol.dtype, n=self.n)
+
+    def otsu_normalizado(self, lo, hi) -> float:
+        normalizados = lambda: (_normalizar_clip(b, lo, hi) for b in iterar_bloques(self.vol, self.bloques))
+        try:
+            return float(otsu_bloques(lambda: (v[v > 0] for v in normalizados())))
+        except Exception:
+            return float(percentil_bloques(lambda: (v.ravel() for v in normalizados()), 95, np.float64))
+
+    def contar_umbral(self, regla: tuple) -> int:
+        return contar_bloques(lambda: (np.flatnonzero(_aplicar_umbral(b, regla)) for b in iterar_bloques(self.vol, self.bloques)))
+
+
+class _EstadisticasHistograma:
+    """
+    Las mismas estadísticas respondidas desde el índice de histograma exacto de la
+    serie (histogram_service): sin recorrer el volumen.
+    """
+
+    def __init__(self, indice: IndiceHistograma):
+        self.indice = indice
+        self.n = indice.n
+
+    def rango(self):
+        return self.indice.rango()
+
+    def percentil(self, q):
+        return self.indice.percentil(q)
+
+    def otsu_normalizado(self, lo, hi) -> float:
+        normalizar = lambda v: _normalizar_clip(v, lo, hi)
+        try:
+            return float(self.indice.otsu(normalizar, positivos=True))
+        except Exception:
+            return float(self.indice.percentil_transformado(normalizar, 95))
+
+    def contar_umbral(self, regla: tuple) -> int:
+        return self.indice.contar(lambda v: _aplicar_umbral(v, regla))
+
+
+def _estadisticas(vol: np.ndarray, indice: Optional[Callable], variante: str, crear: Callable):
+    """Estadísticas del índice de histograma de `vol` si es exacto; si no, las de crear()."""
+    if indice is not None:
+        ind = indice(vol, variante)
+        if ind is not None and ind.exacto:
+            return _EstadisticasHistograma(ind)
+    return crear()
+
+
+class _EstadisticasCacheadas:
+    """
+    Las estadísticas de `crear()` memorizadas en un nodo de la caché de intermedios:
+    una ejecución con otros umbrales sobre el mismo volumen no vuelve a recorrerlo
+    (crear() sólo se llama si falta algún valor).
+    """
+
+    def __init__(self, crear: Callable, nodo: CacheEtapas):
+        self._crear = crear
+        self._base = None
+        self._nodo = nodo
+        # En la caché, el memo es una tupla inmutable de (clave, valor); cada valor
+        # nuevo se guarda como un memo nuevo (con su tamaño real en la LRU)
+        self._memo = dict(nodo.valor(tuple))
+        self.n = self._valor(("n",), lambda b: b.n)
+
+    def _valor(self, clave: tuple, fn: Callable):
+        if clave not in self._memo:
+            if self._base is None:
+                self._base = self._crear()
+            self._memo[clave] = fn(self._base)
+            self._nodo.guardar(tuple(self._memo.items()))
+        return self._memo[clave]
+
+    def rango(self):
+        return self._valor(("rango",), lambda b: b.rango())
+
+    def percentil(self, q):
+        return self._valor(("percentil", repr(q)), lambda b: b.percentil(q))
+
+    def otsu_normalizado(self, lo, hi) -> float:
+        return self._valor(("otsu", repr(lo), repr(hi)), lambda b: b.otsu_normalizado(lo, hi))
+
+    def contar_umbral(self, regla: tuple) -> int:
+        return self._valor(("contar", repr(regla)), lambda b: b.contar_umbral(regla))
+
+
+def _regla_umbral(modality: str, preset: Optional[str], thr_min: Optional[float],
+                  thr_max: Optional[float], stats) -> tuple:
+    """
+    Decide la binarización a partir de las estadísticas del volumen, sin aplicarla:
+      ("vacia",) | ("rango", tmin, tmax) | ("norm", lo, hi, corte) | ("otsu", lo, hi, thr)
+    stats es _EstadisticasMemoria, _EstadisticasBloques o _EstadisticasHistograma:
+    dan los mismos valores, así que todos los modos de segmentación binarizan igual.
+    """
+    if stats.n == 0:
+        return ("vacia",)
+
+    if modality == "CT":
+        if preset in PRESETS_CT:
+            return ("rango",) + PRESETS_CT[preset]
+        if thr_min is not None or thr_max is not None:
+            lo = stats.percentil(40)
+            hi = stats.percentil(99)
+            return ("rango", thr_min if thr_min is not None else lo, thr_max if thr_max is not None else hi)
+        # Adaptativo: HU normales vs CT raro
+        vmin, vmax = stats.rango()
+        if float(vmax - vmin) > 200:
+            return ("rango", 150.0, 4000.0)
+        lo, hi = stats.percentil([40, 99])
+        return ("norm", lo, hi, 0.6)
+
+    # MR u otra modalidad: Otsu global tras normalización
+    lo, hi = stats.percentil([2, 98])
+    if hi <= lo:
+        hi = lo + 1.0
+    return ("otsu", lo, hi, stats.otsu_normalizado(lo, hi))
+
+
+def _regla_fallback_ct(stats) -> tuple:
+    print("⚠️ Máscara CT muy pequeña, aplicando umbral adaptativo.")
+    lo, hi = stats.percentil([40, 99])
+    return ("norm", lo, hi, 0.5)
+
+
+def _regla_final(modality: str, preset: Optional[str], thr_min: Optional[float],
+                 thr_max: Optional[float], stats) -> tuple:
+    """_regla_umbral con el fallback CT (< 200 voxeles) decidido con stats.contar_umbral."""
+    regla = _regla_umbral(modality, preset, thr_min, thr_max, stats)
+    if modality == "CT" and regla[0] != "vacia" and stats.contar_umbral(regla) < 200:
+        regla = _regla_fallback_ct(stats)
+    return regla
+
+
+def _radios_mm(radio: Radio) -> np.ndarray:
+    """Radio en mm (uno o (rz, ry, rx)) como array (rz, ry, rx)."""
+    return np.broadcast_to(np.asarray(radio, dtype=np.float64), (3,))
+
+
+def _radio_cierre(close_radius_mm: Radio, spacing) -> int:
+    r = float(np.mean(_radios_mm(close_radius_mm)))
+    return max(1, int(round(r / max(float(np.mean(spacing)), 1e-6))))
+
+
+def _apertura(open_radius_mm: Radio, spacing) -> Optional[Tuple[Callable, int]]:
+    """Apertura EDT (mm, uno o (rz, ry, rx); al menos un voxel por eje) y su alcance; None si el radio es 0."""
+    radios = _radios_mm(open_radius_mm)
+    if not np.any(radios > 0):
+        return None
+    radio = np.maximum(radios, np.asarray(spacing, dtype=np.float64))
+    return (lambda b: apertura_edt(b, radio, spacing)), 2 * alcance_cortes(radio, spacing)
+
+
+def _cierre(close_radius_mm: Radio, spacing, closing_method: str = "ball",
+            open_radius_mm: Radio = 0.0) -> Tuple[Callable, int]:
+    """
+    Cierre morfológico de una máscara (o bloque), con una apertura previa opcional, y
+    su alcance en cortes en Z:
+      - "ball": footprint ball(r_vox), con r_vox según el spacing medio (isótropo en
+        voxeles; coste proporcional a r³). Sólo con un radio escalar.
+      - "edt": elipsoide de radios close_radius_mm en mm (uno o (rz, ry, rx)) respetando
+        el spacing de cada eje, con transformadas de distancia (morphology_service; coste
+        independiente del radio). Como en "ball", cada eje llega al menos a un voxel.
+      - open_radius_mm > 0: apertura EDT (_apertura) antes del cierre, que quita ruido y
+        puentes más finos que el radio.
+    """
+    radios = _radios_mm(close_radius_mm)
+    if closing_method == "edt":
+        radio = np.maximum(radios, np.asarray(spacing, dtype=np.float64))
+        cerrar, halo = (lambda b: cierre_edt(b, radio, spacing)), 2 * alcance_cortes(radio, spacing)
+    elif closing_method == "ball":
+        if np.ptp(radios) > 0:
+            raise ValueError("Un radio de cierre por eje (rz, ry, rx) requiere closing_method=edt")
+        r_vox = _radio_cierre(radios[0], spacing)
+        footprint = ball(r_vox)
+        cerrar, halo = (lambda b: binary_closing(b, footprint=footprint)), 2 * r_vox
+    else:
+        raise ValueError(f"closing_method inválido: {closing_method} ({' | '.join(CLOSING_METHODS)})")
+
+    apertura = _apertura(open_radius_mm, spacing)
+    if apertura is None:
+        return cerrar, halo
+    abrir, halo_apertura = apertura
+    return (lambda b: cerrar(abrir(b))), halo + halo_apertura
+
+
+def _reescribir_bloques(mask: np.ndarray, bloques: list, fn: Callable, workers: int = 1) -> None:
+    """mask[bloque i] = fn(i, bloque) en todos los bloques (cada hilo escribe sólo el suyo)."""
+    def _bloque(i):
+        z0, z1 = bloques[i]
+        mask[z0:z1] = fn(i, np.asarray(mask[z0:z1]))
+    en_paralelo(_bloque, range(len(bloques)), workers)
+
+
+def _rellenar_por_bloques(mask: np.ndarray, bloques: list, workers: int = 1) -> None:
+    """binary_fill_holes in-place: fondo (6-conexo) que no toca el borde del volumen."""
+    fondo = ComponentesPorBloques(lambda z0, z1: ~np.asarray(mask[z0:z1]), bloques, mask.shape[0],
+                                  generate_binary_structure(3, 1), workers)
+
+    def _rellenar(i, b):
+        comp = fondo.etiquetas(i, ~b)
+        return b | ((comp != fondo.fondo) & ~fondo.borde[comp])
+    _reescribir_bloques(mask, bloques, _rellenar, workers)
+
+
+def _quitar_pequenos_por_bloques(mask: np.ndarray, bloques: list, min_size_voxels: int, workers: int = 1) -> None:
+    """remove_small_objects in-place: componentes 6-conexas con menos de min_size_voxels."""
+    objetos = ComponentesPorBloques(lambda z0, z1: np.asarray(mask[z0:z1]), bloques, mask.shape[0],
+                                    generate_binary_structure(3, 1), workers)
+    pequenas = objetos.tamanos < int(min_size_voxels)
+    _reescribir_bloques(mask, bloques, lambda i, b: b & ~pequenas[objetos.etiquetas(i, b)], workers)
+    # (en memoria, el reintento con una máscara vacía también termina vacío)
+
+
+def _principal_por_bloques(mask: np.ndarray, bloques: list, workers: int = 1) -> None:
+    """Deja sólo la componente principal (26-conexa) in-place."""
+    componentes = ComponentesPorBloques(lambda z0, z1: np.asarray(mask[z0:z1]), bloques, mask.shape[0],
+                                        np.ones((3, 3, 3), dtype=bool), workers)
+    mayor = componentes.mayor()
+    _reescribir_bloques(
+        mask, bloques,
+        lambda i, b: np.zeros_like(b) if mayor is None else componentes.etiquetas(i, b) == mayor, workers,
+    )
+
+
+def _morfologia_por_bloques(umbral: np.ndarray, mask: np.ndarray, bloques: list, cierre: tuple,
+                            min_size_voxels: int, report, workers: int = 1) -> None:
+    """
+    Cierre (ver _cierre), relleno de huecos, objetos pequeños y componente principal
+    de `umbral`, escritos en `mask` (ndarray o np.memmap), bloque a bloque y con
+    `workers` hilos. Mismo resultado que sobre el volumen completo:
+      - cierre: por bloque con halo de su alcance en cortes
+      - el resto: componentes conexas por bloque unidas a través de las fronteras
+        (ComponentesPorBloques)
+    """
+    cerrar, halo = cierre
+    filtrar_por_bloques(umbral, mask, bloques, halo, cerrar, workers)
+    _rellenar_por_bloques(mask, bloques, workers)
+    _quitar_pequenos_por_bloques(mask, bloques, min_size_voxels, workers)
+    report(0.6, "components")
+    _principal_por_bloques(mask, bloques, workers)
+
+
+def _mediana_en_memoria(vol: np.ndarray, nodo: CacheEtapas, bloques: Optional[list],
+                        workers: int) -> Tuple[CacheEtapas, np.ndarray]:
+    """Filtro de mediana 3x3x3 (por bloques en hilos si `bloques`), cacheado en el nodo "mediana"."""
+    def _mediana():
+        try:
+            if bloques:
+                filtrado = np.empty_like(vol)
+                filtrar_por_bloques(vol, filtrado, bloques, 1, lambda b: median_filter(b, size=3), workers)
+                return filtrado
+            return median_filter(vol, size=3)
+        except Exception:
+            return vol
+    nodo = nodo.hijo("mediana")
+    return nodo, nodo.valor(_mediana)
+
+
+def _morfologia_en_memoria(mask: np.ndarray, nodo: CacheEtapas, spacing, min_size_voxels,
+                           close_radius_mm, report, bloques: Optional[list], workers: int,
+                           closing_method: str, open_radius_mm: Radio = 0.0) -> np.ndarray:
+    """
+    Apertura opcional y cierre, relleno de huecos, objetos pequeños y componente
+    principal de la máscara binarizada, cada etapa cacheada como hija de `nodo` (el de
+    la binarización).
+    """
+    r_vox = _radio_cierre(close_radius_mm, spacing)
+    cerrar, halo = _cierre(close_radius_mm, spacing, closing_method, open_radius_mm)
+
+    if bloques:
+        def _in_place(fn, *args):
+            # Copia escribible (la entrada puede ser un intermedio cacheado) y etapa in-place por bloques
+            def _etapa(mask):
+                out = np.array(mask)
+                fn(out, bloques, *args, workers)
+                return out
+            return _etapa
+
+        def _cerrar(mask):
+            out = np.empty_like(mask)
+            filtrar_por_bloques(mask, out, bloques, halo, cerrar, workers)
+            return out
+        _rellenar = _in_place(_rellenar_por_bloques)
+        _quitar_pequenos = _in_place(_quitar_pequenos_por_bloques, int(min_size_voxels))
+        _principal = _in_place(_principal_por_bloques)
+    else:
+        _cerrar = cerrar
+
+        def _rellenar(mask):
             try:
-                dz = float(sbs)
+                return binary_fill_holes(mask)
             except Exception:
-                dz = None
+                return mask
+
+        def _quitar_pequenos(mask):
+            mask = morphology.remove_small_objects(mask, min_size=int(min_size_voxels))
+
+            # Fallback extra: si se quedó sin voxeles, intentar con min_size más pequeño
+            if mask.sum() == 0:
+                print("⚠️ Máscara vacía tras remove_small_objects, reintentando con tamaño mínimo pequeño.")
+                mask_tmp = binary_closing(mask, footprint=ball(r_vox))
+                try:
+                    mask_tmp = binary_fill_holes(mask_tmp)
+                except Exception:
+                    pass
+                mask_tmp = morphology.remove_small_objects(mask_tmp, min_size=100)
+                if mask_tmp.sum() > 0:
+                    mask = mask_tmp
+            return mask
+
+        def _principal(mask):
+            labels = measure.label(mask, connectivity=3)
+            if labels.max() > 0:
+                counts = np.bincount(labels.ravel())
+                largest = int(np.argmax(counts[1:]) + 1)
+                return labels == largest
+            return np.zeros_like(mask, dtype=bool)
+
+    nodo = nodo.hijo("cierre", (closing_method, close_radius_mm, open_radius_mm, spacing))
+    mask = nodo.valor(lambda: _cerrar(mask))
+    nodo = nodo.hijo("relleno")
+    mask = nodo.valor(lambda: _rellenar(mask))
+    nodo = nodo.hijo("pequenos", int(min_size_voxels))
+    mask = nodo.valor(lambda: _quitar_pequenos(mask))
+    report(0.6, "components")
+    nodo = nodo.hijo("principal")
+    return nodo.valor(lambda: _principal(mask))
+
+
+def _segmentar_en_memoria(vol, spacing, modality, preset, thr_min, thr_max,
+                          min_size_voxels, close_radius_mm, report, workers: int = 1,
+                          closing_method: str = "ball", regla: Optional[tuple] = None,
+                          mediana: Optional[bool] = None, cache: Optional[CacheEtapas] = None,
+                          indice: Optional[Callable] = None, open_radius_mm: Radio = 0.0) -> np.ndarray:
+    """
+    Máscara 3D (componente principal) con el volumen completo en memoria.
+    workers > 1: mediana y morfología repartidas en bloques de cortes en Z, uno por
+    hilo (los kernels de scipy/skimage liberan el GIL); resultado idéntico a workers=1.
+    regla / mediana: binarización ya decidida y si filtrar (None = según el volumen),
+    para procesar una parte del volumen (ROI de _localizar_roi) como el volumen completo.
+    cache: nodo raíz de la caché de intermedios (pipeline_cache_service) para este
+    volumen; cada etapa se reutiliza si no cambió nada de lo que tiene aguas arriba.
+    Los intermedios cacheados son de sólo lectura: ninguna etapa modifica su entrada.
+    indice(vol, variante): índice de histograma de la serie ("raw" o "mediana"); si es
+    exacto, percentiles y Otsu salen de él en vez de recorrer el volumen.
+    """
+    bloques = repartir_bloques(vol.shape[0], workers) if workers > 1 else None
+    nodo = cache or CacheEtapas.desactivada()
 
-    if dz is None and slice_thk is not None:
-        dz = slice_thk
+    # ===== 1) Pre-procesado suave (reduce ruido) =====
+    if mediana is None:
+        mediana = vol.size > 2_000_000
+    if mediana:
+        nodo, vol = _mediana_en_memoria(vol, nodo, bloques, workers)
 
-    if dz is None or dz <= 0:
-        dz = 1.0
+    # ===== 2) Binarización según modalidad/preset =====
+    report(0.3, "threshold")
+
+    def _umbral(regla):
+        nodo_umbral = nodo.hijo("umbral", regla)
+        if regla[0] in ("norm", "otsu"):
+            normalizado = nodo.hijo("normalizado", regla[:3]).valor(lambda: _normalizado(vol, regla))
+            return nodo_umbral, nodo_umbral.valor(lambda: _aplicar_umbral(vol, regla, normalizado))
+        return nodo_umbral, nodo_umbral.valor(lambda: _aplicar_umbral(vol, regla))
+
+    if regla is None:
+        variante = "mediana" if mediana else "raw"
+        stats = _EstadisticasCacheadas(
+            lambda: _estadisticas(vol, indice, variante, lambda: _EstadisticasMemoria(vol)),
+            nodo.hijo("estadisticas"),
+        )
+        regla = _regla_umbral(modality, preset, thr_min, thr_max, stats)
+        nodo, mask = _umbral(regla)
+        # Fallback si casi no hay voxeles
+        if modality == "CT" and regla[0] != "vacia" and mask.sum() < 200:
+            nodo, mask = _umbral(_regla_fallback_ct(stats))
+    else:
+        nodo, mask = _umbral(regla)
 
-    spacing = (dz, float(px_y), float(px_x))
+    # Seguridad: asegurar que mask sea 3D
+    if mask is None or mask.ndim != 3:
+        raise ValueError(f"La máscara 3D no es válida. ndim={getattr(mask, 'ndim', None)}")
 
-    # ===== Volumen 3D =====
-    vol = np.stack([s[0] for s in slices], axis=0)
-    modality0 = str(getattr(ds0, "Modality", "")).upper()
+    # ===== 3) Morfología 3D =====
+    report(0.4, "morphology")
+    return _morfologia_en_memoria(mask, nodo, spacing, min_size_voxels, close_radius_mm, report,
+                                  bloques, workers, closing_method, open_radius_mm)
 
-    # Normalización HU si es CT
-    if modality0 == "CT":
-        slope = float(getattr(ds0, "RescaleSlope", 1.0))
-        intercept = float(getattr(ds0, "RescaleIntercept", 0.0))
-        vol = vol * slope + intercept
-        vol = np.clip(vol, -1024, 4000)
 
-    return vol, spacing, modality0
+def _preparar_bloques(vol, spacing, close_radius_mm, closing_method: str, tmp_dir: str,
+                      presupuesto_bytes: int, workers: int, mediana: bool, open_radius_mm: Radio = 0.0):
+    """
+    Plan de bloques y pre-procesado del modo por bloques: (vol, bloques, cierre, memmap)
+    con vol filtrado con la mediana (np.memmap en tmp_dir) si `mediana` y
+    memmap(nombre, dtype) para crear volúmenes intermedios en tmp_dir.
+    """
+    nz, ny, nx = vol.shape
+    cierre = _cierre(close_radius_mm, spacing, closing_method, open_radius_mm)
+    halo = max(1, cierre[1])
+    bloques = planificar_bloques(nz, ny * nx, halo, presupuesto_bytes // max(1, workers), BYTES_VOXEL_BLOQUE)
+    print(f"🧱 Segmentación por bloques: {len(bloques)} bloques de hasta {bloques[0][1] - bloques[0][0]} cortes "
+          f"(halo {halo}, {workers} hilo(s))")
 
+    def _memmap(nombre: str, dtype) -> np.ndarray:
+        return np.memmap(os.path.join(tmp_dir, nombre), dtype=dtype, mode="w+", shape=vol.shape)
+
+    # ===== 1) Pre-procesado suave (reduce ruido) =====
+    if mediana:
+        try:
+            filtrado = _memmap("mediana.f32", vol.dtype)
+            filtrar_por_bloques(vol, filtrado, bloques, 1, lambda b: median_filter(b, size=3), workers)
+            vol = filtrado
+        except Exception:
+            pass
+    return vol, bloques, cierre, _memmap
+
+
+def _segmentar_por_bloques(vol, spacing, modality, preset, thr_min, thr_max,
+                           min_size_voxels, close_radius_mm, report,
+                           tmp_dir: str, presupuesto_bytes: int, workers: int = 1,
+                           closing_method: str = "ball", regla: Optional[tuple] = None,
+                           mediana: Optional[bool] = None, indice: Optional[Callable] = None,
+                           open_radius_mm: Radio = 0.0) -> np.ndarray:
+    """
+    Igual que _segmentar_en_memoria, pero por bloques de cortes en Z con halo:
+    la memoria de trabajo queda acotada por presupuesto_bytes (repartido entre los
+    `workers` hilos) y los volúmenes intermedios (mediana, máscaras) son np.memmap
+    en tmp_dir. El resultado es el mismo:
+      - mediana, apertura y cierre: por bloque con halo (1 corte y su alcance), exactos
+      - percentiles y Otsu: exactos por bloques (blockwise_service)
+      - relleno de huecos, objetos pequeños y componente principal: componentes
+        conexas por bloque unidas a través de las fronteras (ComponentesPorBloques)
+    regla / mediana / indice: como en _segmentar_en_memoria.
+    Devuelve la máscara como np.memmap booleano (válido mientras exista tmp_dir).
+    """
+    if mediana is None:
+        mediana = vol.size > 2_000_000
+    vol, bloques, cierre, _memmap = _preparar_bloques(vol, spacing, close_radius_mm, closing_method, tmp_dir,
+                                                      presupuesto_bytes, workers, mediana, open_radius_mm)
+
+    # ===== 2) Binarización según modalidad/preset =====
+    report(0.3, "threshold")
+    if regla is None:
+        stats = _estadisticas(vol, indice, "mediana" if mediana else "raw", lambda: _EstadisticasBloques(vol, bloques))
+        regla = _regla_final(modality, preset, thr_min, thr_max, stats)
+    umbral = _memmap("umbral.b1", bool)
+    filtrar_por_bloques(vol, umbral, bloques, 0, lambda b: _aplicar_umbral(b, regla), workers)
+
+    # ===== 3) Morfología 3D =====
+    report(0.4, "morphology")
+    mask = _memmap("mascara.b1", bool)
+    _morfologia_por_bloques(umbral, mask, bloques, cierre, min_size_voxels, report, workers)
+    mask.flush()
+    return mask
+
+
+def _multi_en_memoria(vol, spacing, etiquetas, min_size_voxels, close_radius_mm, report,
+                      workers: int = 1, closing_method: str = "ball", mediana: bool = False,
+                      cache: Optional[CacheEtapas] = None, open_radius_mm: Radio = 0.0):
+    """
+    Modo multi-etiqueta en memoria: una sola mediana y una sola pasada de binarización
+    para todas las etiquetas (bits de _tabla_rangos), y morfología por etiqueta.
+    Genera (k, máscara) por etiqueta; cada máscara es la que daría _segmentar_en_memoria
+    con regla ("rango", tmin, tmax) y comparte con ella los intermedios cacheados.
+    """
+    bloques = repartir_bloques(vol.shape[0], workers) if workers > 1 else None
+    nodo = cache or CacheEtapas.desactivada()
+    if mediana:
+        nodo, vol = _mediana_en_memoria(vol, nodo, bloques, workers)
+
+    report(0.3, "threshold")
+    bits = []
+
+    def _bits() -> np.ndarray:
+        # Sólo si alguna etiqueta no tiene su binarización en la caché
+        if not bits:
+            puntos, lut = _tabla_rangos([e[1:] for e in etiquetas], vol.dtype)
+            if bloques:
+                out = np.empty(vol.shape, dtype=lut.dtype)
+                filtrar_por_bloques(vol, out, bloques, 0, lambda b: _aplicar_rangos(b, puntos, lut), workers)
+            else:
+                out = _aplicar_rangos(vol, puntos, lut)
+            bits.append(out)
+        return bits[0]
+
+    for k, (nombre, tmin, tmax) in enumerate(etiquetas):
+        nodo_umbral = nodo.hijo("umbral", ("rango", tmin, tmax))
+        mask = nodo_umbral.valor(lambda k=k: (_bits() & (1 << k)) != 0)
+        yield k, _morfologia_en_memoria(mask, nodo_umbral, spacing, min_size_voxels, close_radius_mm,
+                                        _reporte_etiqueta(report, k, len(etiquetas), nombre),
+                                        bloques, workers, closing_method, open_radius_mm)
+
+
+def _multi_por_bloques(vol, spacing, etiquetas, min_size_voxels, close_radius_mm, report,
+                       tmp_dir: str, presupuesto_bytes: int, workers: int = 1,
+                       closing_method: str = "ball", mediana: bool = False, open_radius_mm: Radio = 0.0):
+    """Como _multi_en_memoria, con memoria acotada (ver _segmentar_por_bloques)."""
+    vol, bloques, cierre, _memmap = _preparar_bloques(vol, spacing, close_radius_mm, closing_method, tmp_dir,
+                                                      presupuesto_bytes, workers, mediana, open_radius_mm)
+    report(0.3, "threshold")
+    puntos, lut = _tabla_rangos([e[1:] for e in etiquetas], vol.dtype)
+    bits = _memmap("etiquetas.bits", lut.dtype)
+    filtrar_por_bloques(vol, bits, bloques, 0, lambda b: _aplicar_rangos(b, puntos, lut), workers)
+
+    for k, (nombre, _, _) in enumerate(etiquetas):
+        umbral = _memmap(f"umbral_{k}.b1", bool)
+        filtrar_por_bloques(bits, umbral, bloques, 0, lambda b, k=k: (b & (1 << k)) != 0, workers)
+        mask = _memmap(f"mascara_{k}.b1", bool)
+        _morfologia_por_bloques(umbral, mask, bloques, cierre, min_size_voxels,
+                                _reporte_etiqueta(report, k, len(etiquetas), nombre), workers)
+        mask.flush()
+        yield k, mask
+
+
+def _reporte_etiqueta(report: Callable[[float, str], None], k: int, total: int, nombre: str):
+    """Progreso de la etiqueta k: su tramo 0.4..1 se reparte con las demás en 0.4..1."""
+    def _report(fraccion, etapa):
+        report(0.4 + 0.6 * (k + max(0.0, fraccion - 0.4) / 0.6) / total, f"{nombre}: {etapa}")
+    return _report
+
+
+def _factores_gruesos(spacing, factor: int) -> Tuple[int, int, int]:
+    """Submuestreo (fz, fy, fx) de la pasada gruesa: `factor` en el plano y en Z lo
+    que deje el voxel grueso aproximadamente isótropo (1 con cortes gruesos)."""
+    dz, dy, dx = (float(v) for v in spacing)
+    fz = max(1, int(round(factor * min(dy, dx) / max(dz, 1e-6))))
+    return fz, factor, factor
+
+
+def _submuestrear(vol: np.ndarray, factores) -> np.ndarray:
+    """Media por bloques de `factores` voxeles; los bloques incompletos del borde
+    se completan repitiendo el último corte/fila/columna (no con ceros)."""
+    relleno = [(0, (-n) % f) for n, f in zip(vol.shape, factores)]
+    if any(r for _, r in relleno):
+        vol = np.pad(vol, relleno, mode="edge")
+    (nz, ny, nx), (fz, fy, fx) = vol.shape, factores
+    bloques = vol.reshape(nz // fz, fz, ny // fy, fy, nx // fx, fx)
+    return bloques.mean(axis=(1, 3, 5), dtype=np.float64).astype(np.float32)
+
+
+def _localizar_roi(vol, spacing, modality, preset, thr_min, thr_max, min_size_voxels,
+                   close_radius_mm, report, factor: int, workers: int = 1,
+                   closing_method: str = "ball", cache: Optional[CacheEtapas] = None,
+                   indice: Optional[Callable] = None,
+                   open_radius_mm: Radio = 0.0) -> Tuple[Optional[tuple], Optional[tuple], dict]:
+    """
+    Pasada gruesa del modo coarse-to-fine: decide la binarización con las estadísticas
+    del volumen completo, segmenta el volumen submuestreado (media por bloques de
+    _factores_gruesos) y devuelve (roi, regla, info):
+      - roi: slices (Z, Y, X) de la componente principal gruesa más MARGEN_ROI_MM,
+        el alcance de apertura y cierre y un voxel grueso por lado (None = sin componente)
+      - regla: binarización a aplicar en la ROI (la misma que en el volumen completo)
+    cache: nodo raíz de la caché de intermedios del volumen (estadísticas y pasada gruesa).
+    indice: índice de histograma del volumen completo (ver _segmentar_en_memoria).
+    """
+    factores = _factores_gruesos(spacing, factor)
+    nodo = cache or CacheEtapas.desactivada()
+    def _recorrer():
+        if not usa_bloques(vol.shape):
+            return _EstadisticasMemoria(vol)
+        nz, ny, nx = vol.shape
+        return _EstadisticasBloques(vol, planificar_bloques(nz, ny * nx, 0, SEG_MEMORY_BYTES, BYTES_VOXEL_BLOQUE))
+
+    stats = _EstadisticasCacheadas(lambda: _estadisticas(vol, indice, "raw", _recorrer), nodo.hijo("estadisticas"))
+    regla = _regla_final(modality, preset, thr_min, thr_max, stats)
+
+    nodo = nodo.hijo("grueso", factores)
+    grueso = nodo.valor(lambda: _submuestrear(vol, factores))
+    spacing_grueso = tuple(float(d) * f for d, f in zip(spacing, factores))
+    mask = _segmentar_en_memoria(
+        grueso, spacing_grueso, modality, preset, thr_min, thr_max,
+        max(1, int(min_size_voxels) // int(np.prod(factores))), close_radius_mm,
+        lambda fraccion, etapa: None, workers, closing_method, regla=regla, mediana=False, cache=nodo,
+        open_radius_mm=open_radius_mm,
+    )
+    info = {"factors": list(factores), "roi": None, "roi_fraction": None}
+    if not mask.any():
+        return None, regla, info
+
+    origin, stop = bbox_mascara(mask)
+    roi = []
+    alcance_mm = _radios_mm(close_radius_mm) + _radios_mm(open_radius_mm)
+    for o, e, f, d, n, r in zip(origin, stop, factores, spacing, vol.shape, alcance_mm):
+        margen = f + int(np.ceil((MARGEN_ROI_MM + 2 * max(float(r), 0.0)) / max(float(d), 1e-6)))
+        roi.append(slice(max(0, o * f - margen), min(n, e * f + margen)))
+    roi = tuple(roi)
+    info["roi"] = [[r.start, r.stop] for r in roi]
+    info["roi_fraction"] = round(float(np.prod([r.stop - r.start for r in roi])) / vol.size, 4)
+    return roi, regla, info
+
+
+def usa_bloques(shape, presupuesto_bytes: Optional[int] = None) -> bool:
+    """Si la segmentación en memoria de un volumen de `shape` excede el presupuesto."""
+    presupuesto_bytes = SEG_MEMORY_BYTES if presupuesto_bytes is None else presupuesto_bytes
+    return int(np.prod(shape)) * BYTES_VOXEL_MEMORIA > presupuesto_bytes
 
-# ========= Segmentación 3D + STL =========
 
 def segmentar_serie_3d(
     session_id: str,
@@ -268,121 +1091,267 @@ def segmentar_serie_3d(
     thr_min: Optional[float] = None,
     thr_max: Optional[float] = None,
     min_size_voxels: int = 2000,
-    close_radius_mm: float = 1.5,
+    close_radius_mm: Radio = 1.5,
+    progress: Optional[Callable[[float, str], None]] = None,
+    blockwise: Optional[bool] = None,
+    workers: Optional[int] = None,
+    closing_method: str = "ball",
+    coarse_factor: int = 1,
+    open_radius_mm: Radio = 0.0,
 ) -> dict:
     """
     Segmentación 3D robusta con presets por modalidad.
     - Maneja series con 1 o 2 cortes (volumen sintético / interpolado).
     - Intenta varios thresholds y fallbacks.
     - Genera STL a partir de la máscara 3D.
+    - progress: callback opcional progress(fraccion, etapa) para trabajos en segundo plano.
+    - blockwise: procesar por bloques en Z (memoria acotada por SEG_MEMORY_BYTES);
+      None = sólo si el volumen no cabe en el presupuesto. Mismo resultado en ambos modos.
+    - workers: hilos para filtros y morfología por bloques en Z (None = SEG_WORKERS,
+      1 = secuencial). El resultado no depende del número de hilos.
+    - close_radius_mm: radio del cierre en mm, uno o (rz, ry, rx) (por eje sólo con "edt").
+    - closing_method: "ball" (footprint en voxeles) o "edt" (elipsoide en mm según el
+      spacing de cada eje, coste independiente del radio).
+    - open_radius_mm > 0: apertura EDT (mm, uno o (rz, ry, rx)) antes del cierre.
+    - coarse_factor > 1: modo coarse-to-fine. Una pasada sobre el volumen submuestreado
+      (factor en el plano) localiza la componente principal y la segmentación a resolución
+      completa se hace sólo en esa ROI con margen (_localizar_roi). Los umbrales son los
+      del volumen completo; las diferencias vienen de la mediana previa a las estadísticas
+      (volúmenes > 2M voxeles) y de partes finas que la pasada gruesa no une a la
+      componente principal: en los fantomas de test, volumen dentro del 1%.
+    Los intermedios en memoria (mediana, estadísticas, normalizado, máscaras de cada
+    etapa) se reutilizan entre ejecuciones sobre la misma serie (pipeline_cache_service):
+    al cambiar umbrales o parámetros sólo se recalculan las etapas afectadas.
     """
+    if closing_method not in CLOSING_METHODS:
+        raise ValueError(f"closing_method inválido: {closing_method} ({' | '.join(CLOSING_METHODS)})")
+    report = progress or (lambda fraccion, etapa: None)
+    report(0.0, "load")
     vol, spacing, modality = _load_stack(session_id)  # (Z,Y,X)
     os.makedirs(_seg3d_dir(session_id), exist_ok=True)
-
-    # ===== 1) Pre-procesado suave (reduce ruido) =====
-    if vol.size > 2_000_000:
-        try:
-            vol = median_filter(vol, size=3)
-        except Exception:
-            pass
-
-    # ===== 2) Binarización según modalidad/preset =====
-    mask = None
-
-    if modality == "CT":
-        v = vol[np.isfinite(vol)]
-        if v.size == 0:
-            mask = np.zeros_like(vol, dtype=bool)
+    params = (preset, thr_min, thr_max, min_size_voxels, close_radius_mm, report)
+    workers = max(1, SEG_WORKERS if workers is None else int(workers))
+
+    version = _version_serie(session_id)
+    cache = CacheEtapas.para_volumen(session_id, version)
+    # Percentiles/Otsu del volumen completo desde su índice de histograma (histogram_service)
+    indice = lambda v, variante: indice_histograma(session_id, version, v, variante)
+
+    # Coarse-to-fine: la pasada completa sólo en la ROI de la pasada gruesa
+    roi, regla, grueso = None, None, None
+    if coarse_factor and int(coarse_factor) > 1:
+        report(0.1, "coarse")
+        roi, regla, grueso = _localizar_roi(vol, spacing, modality, *params, int(coarse_factor),
+                                            workers, closing_method, cache=cache, indice=indice,
+                                            open_radius_mm=open_radius_mm)
+    fino = vol if roi is None else vol[roi]
+    if roi is not None:
+        cache = cache.hijo("roi", [[r.start, r.stop] for r in roi])
+    opciones = dict(regla=regla, mediana=vol.size > 2_000_000, indice=indice if roi is None else None,
+                    open_radius_mm=open_radius_mm)
+
+    por_bloques = usa_bloques(fino.shape) if blockwise is None else bool(blockwise)
+    tmp_root = os.path.join(CACHE_DIR, "tmp")
+    os.makedirs(tmp_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=tmp_root, prefix="seg3d_") as tmp_dir:
+        if not por_bloques:
+            mask = _segmentar_en_memoria(fino, spacing, modality, *params, workers, closing_method, **opciones,
+                                         cache=cache)
         else:
-            presets = {
-                "ct_bone": (250.0, 4000.0),
-                "ct_head": (-300.0, 3000.0),
-                "ct_soft": (-150.0, 300.0),
-                "ct_lung": (-1000.0, -300.0),
-            }
+            mask = _segmentar_por_bloques(fino, spacing, modality, *params, tmp_dir, SEG_MEMORY_BYTES, workers,
+                                          closing_method, **opciones)
+        if roi is not None:
+            completa = np.zeros(vol.shape, dtype=bool) if not por_bloques else np.memmap(
+                os.path.join(tmp_dir, "completa.b1"), dtype=bool, mode="w+", shape=vol.shape)
+            completa[roi] = mask
+            mask = completa
+        resultado = _guardar_resultado(session_id, user_id, mask, spacing, modality, report)
+        del mask
+    resultado["blockwise"] = por_bloques
+    resultado["workers"] = workers
+    resultado["closing_method"] = closing_method
+    resultado["open_radius_mm"] = open_radius_mm
+    resultado["coarse_to_fine"] = grueso
+    return resultado
+
+
+def segmentar_serie_3d_multi(
+    session_id: str,
+    user_id: int,
+    etiquetas,
+    min_size_voxels: int = 2000,
+    close_radius_mm: Radio = 1.5,
+    progress: Optional[Callable[[float, str], None]] = None,
+    blockwise: Optional[bool] = None,
+    workers: Optional[int] = None,
+    closing_method: str = "ball",
+    open_radius_mm: Radio = 0.0,
+) -> dict:
+    """
+    Varias segmentaciones 3D por rangos de intensidad en una ejecución:
+      - etiquetas: "ct_bone,ct_soft,grasa:-190:-30" (ver etiquetas_multi) o la lista ya parseada
+    La carga, la mediana y la binarización (una pasada con una LUT de rangos) se
+    comparten; apertura, cierre, relleno, objetos pequeños y componente principal se
+    hacen por etiqueta (radios como en segmentar_serie_3d). Cada etiqueta da la misma máscara que segmentar_serie_3d con ese preset o
+    rango (sin el fallback adaptativo CT) y su propia fila en segmentacion3d.
+    """
+    if closing_method not in CLOSING_METHODS:
+        raise ValueError(f"closing_method inválido: {closing_method} ({' | '.join(CLOSING_METHODS)})")
+    if isinstance(etiquetas, str):
+        etiquetas = etiquetas_multi(etiquetas)
+    report = progress or (lambda fraccion, etapa: None)
+    report(0.0, "load")
+    vol, spacing, modality = _load_stack(session_id)  # (Z,Y,X)
+    if modality != "CT" and any(nombre in PRESETS_CT for nombre, _, _ in etiquetas):
+        raise ValueError(f"Los presets CT (HU) no aplican a una serie {modality}: usa rangos nombre:min:max")
+    os.makedirs(_seg3d_dir(session_id), exist_ok=True)
+    workers = max(1, SEG_WORKERS if workers is None else int(workers))
+    cache = CacheEtapas.para_volumen(session_id, _version_serie(session_id))
+    params = (spacing, etiquetas, min_size_voxels, close_radius_mm, report)
+    mediana = vol.size > 2_000_000
+
+    por_bloques = usa_bloques(vol.shape) if blockwise is None else bool(blockwise)
+    resultados = []
+    tmp_root = os.path.join(CACHE_DIR, "tmp")
+    os.makedirs(tmp_root, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=tmp_root, prefix="seg3d_") as tmp_dir:
+        if not por_bloques:
+            mascaras = _multi_en_memoria(vol, *params, workers, closing_method, mediana=mediana, cache=cache,
+                                         open_radius_mm=open_radius_mm)
+        else:
+            mascaras = _multi_por_bloques(vol, *params, tmp_dir, SEG_MEMORY_BYTES, workers, closing_method,
+                                          mediana=mediana, open_radius_mm=open_radius_mm)
+        for k, mask in mascaras:
+            nombre, tmin, tmax = etiquetas[k]
+            resultado = _guardar_resultado(session_id, user_id, mask, spacing, modality,
+                                           _reporte_etiqueta(report, k, len(etiquetas), nombre))
+            resultados.append({"label": nombre, "thr_min": tmin, "thr_max": tmax, **resultado})
+            del mask
+    return {
+        "message": f"{len(resultados)} segmentaciones 3D creadas",
+        "labels": resultados,
+        "modality": modality,
+        "blockwise": por_bloques,
+        "workers": workers,
+        "closing_method": closing_method,
+        "open_radius_mm": open_radius_mm,
+    }
 
-            if preset in presets:
-                tmin, tmax = presets[preset]
-            elif thr_min is not None or thr_max is not None:
-                lo = np.percentile(v, 40)
-                hi = np.percentile(v, 99)
-                tmin = thr_min if thr_min is not None else lo
-                tmax = thr_max if thr_max is not None else hi
-            else:
-                # Adaptativo: HU normales vs CT raro
-                hu_range = float(v.max() - v.min())
-                if hu_range > 200:
-                    tmin, tmax = 150.0, 4000.0
-                else:
-                    lo, hi = np.percentile(v, [40, 99])
-                    vnorm = (vol - lo) / (hi - lo + 1e-6)
-                    vnorm = np.clip(vnorm, 0, 1)
-                    mask = vnorm > 0.6
-
-            if mask is None:
-                mask = (vol >= tmin) & (vol <= tmax)
-
-            # Fallback si casi no hay voxeles
-            if mask.sum() < 200:
-                print("⚠️ Máscara CT muy pequeña, aplicando umbral adaptativo.")
-                lo, hi = np.percentile(v, [40, 99])
-                vnorm = (vol - lo) / (hi - lo + 1e-6)
-                vnorm = np.clip(vnorm, 0, 1)
-                mask = vnorm > 0.5
 
-    else:
-        # MR u otra modalidad: Otsu global tras normalización
-        v = vol[np.isfinite(vol)]
-        if v.size == 0:
-            mask = np.zeros_like(vol, dtype=bool)
-        else:
-            lo, hi = np.percentile(v, [2, 98])
-            if hi <= lo:
-                hi = lo + 1.0
-            vclip = np.clip(vol, lo, hi)
-            vclip = (vclip - lo) / (hi - lo + 1e-6)
-            try:
-                thr = float(threshold_otsu(vclip[vclip > 0]))
-                mask = vclip > thr
-            except Exception:
-                thr = float(np.percentile(vclip, 95))
-                mask = vclip > thr
+def _rango_region(valor_semilla: float, tolerance: Optional[float], thr_min: Optional[float],
+                  thr_max: Optional[float]) -> Tuple[float, float]:
+    """Rango [tmin, tmax] del crecimiento: semilla ± tolerance o thr_min/thr_max (un extremo puede faltar)."""
+    if tolerance is not None:
+        if thr_min is not None or thr_max is not None:
+            raise ValueError("Indica tolerance o thr_min/thr_max, no ambos")
+        if tolerance < 0:
+            raise ValueError("tolerance debe ser >= 0")
+        return valor_semilla - float(tolerance), valor_semilla + float(tolerance)
+    if thr_min is None and thr_max is None:
+        raise ValueError("Indica tolerance o thr_min/thr_max")
+    tmin = float(thr_min) if thr_min is not None else -np.inf
+    tmax = float(thr_max) if thr_max is not None else np.inf
+    if tmin > tmax:
+        raise ValueError("thr_min debe ser <= thr_max")
+    return tmin, tmax
+
+
+def _roi_semilla(semilla: Tuple[int, int, int], roi_mm, spacing, shape) -> Tuple[slice, ...]:
+    """Slices (Z, Y, X) de la caja de semiejes roi_mm (mm; uno o (x, y, z)) centrada en la semilla."""
+    if roi_mm is None:
+        return tuple(slice(0, n) for n in shape)
+    semiejes = np.broadcast_to(np.asarray(roi_mm, dtype=np.float64), (3,))[::-1]  # (z, y, x)
+    if np.any(semiejes <= 0):
+        raise ValueError(f"roi_mm inválido: {roi_mm}")
+    return tuple(
+        slice(max(0, c - r), min(n, c + r + 1))
+        for c, r, n in zip(semilla, (int(np.ceil(e / max(float(d), 1e-6))) for e, d in zip(semiejes, spacing)), shape)
+    )
 
-    # Seguridad: asegurar que mask sea 3D
-    if mask is None or mask.ndim != 3:
-        raise ValueError(f"La máscara 3D no es válida. ndim={getattr(mask, 'ndim', None)}")
 
-    # ===== 3) Morfología 3D =====
-    r_vox = max(1, int(round(close_radius_mm / max(float(np.mean(spacing)), 1e-6))))
-    mask = binary_closing(mask, footprint=ball(r_vox))
+def segmentar_region_3d(
+    session_id: str,
+    user_id: int,
+    seed: Tuple[int, int, int],
+    tolerance: Optional[float] = None,
+    thr_min: Optional[float] = None,
+    thr_max: Optional[float] = None,
+    roi_mm=None,
+    connectivity: int = 1,
+    close_radius_mm: Radio = 0.0,
+    closing_method: str = "ball",
+    progress: Optional[Callable[[float, str], None]] = None,
+    open_radius_mm: Radio = 0.0,
+) -> dict:
+    """
+    Segmentación 3D por crecimiento de región desde una semilla (interactiva):
+      - seed: voxel (x, y, z) en índices del volumen (z: ver /series/{id}/volume)
+      - tolerance: crece por los voxeles con |v - v_semilla| <= tolerance, o
+        thr_min / thr_max: por los voxeles en el rango (HU en CT)
+      - roi_mm: semiejes (mm) de la caja centrada en la semilla a la que se limita el
+        crecimiento (uno o x,y,z); None = volumen completo
+      - connectivity: 1 (caras), 2 (aristas) o 3 (vértices)
+      - open_radius_mm > 0 / close_radius_mm > 0: apertura y cierre (ver _cierre) antes
+        del relleno de huecos
+    Flood fill por cola (skimage.segmentation.flood) sobre el volumen cacheado,
+    recortado a la caja: el coste depende de la ROI, no del volumen. Mismos artefactos
+    y fila en segmentacion3d que segmentar_serie_3d.
+    """
+    if closing_method not in CLOSING_METHODS:
+        raise ValueError(f"closing_method inválido: {closing_method} ({' | '.join(CLOSING_METHODS)})")
+    if connectivity not in (1, 2, 3):
+        raise ValueError("connectivity debe ser 1, 2 o 3")
+    report = progress or (lambda fraccion, etapa: None)
+    report(0.0, "load")
+    vol, spacing, modality = _load_stack(session_id)  # (Z,Y,X)
+    semilla = tuple(int(v) for v in seed[::-1])  # (z, y, x)
+    if len(semilla) != 3 or any(not 0 <= c < n for c, n in zip(semilla, vol.shape)):
+        raise ValueError(f"Semilla fuera del volumen: {tuple(seed)} (shape x,y,z = {vol.shape[::-1]})")
+    valor = float(vol[semilla])
+    if not np.isfinite(valor):
+        raise ValueError("La semilla no tiene un valor válido")
+    tmin, tmax = _rango_region(valor, tolerance, thr_min, thr_max)
+    if not tmin <= valor <= tmax:
+        raise ValueError(f"El valor de la semilla ({valor:g}) está fuera del rango [{tmin:g}, {tmax:g}]")
+    os.makedirs(_seg3d_dir(session_id), exist_ok=True)
+
+    # ===== 1) Crecimiento dentro de la ROI =====
+    report(0.2, "region")
+    roi = _roi_semilla(semilla, roi_mm, spacing, vol.shape)
+    recorte = np.asarray(vol[roi])
+    local = tuple(c - r.start for c, r in zip(semilla, roi))
+    region = flood(_aplicar_umbral(recorte, ("rango", tmin, tmax)), local, connectivity=connectivity)
+
+    # ===== 2) Morfología (sólo en la ROI) =====
+    report(0.4, "morphology")
+    apertura = _apertura(open_radius_mm, spacing)
+    if apertura is not None:
+        region = apertura[0](region)
+    if np.any(_radios_mm(close_radius_mm) > 0):
+        region = _cierre(close_radius_mm, spacing, closing_method)[0](region)
     try:
-        mask = binary_fill_holes(mask)
+        region = binary_fill_holes(region)
     except Exception:
         pass
 
-    mask = morphology.remove_small_objects(mask, min_size=int(min_size_voxels))
+    mask = np.zeros(vol.shape, dtype=bool)
+    mask[roi] = region
+    resultado = _guardar_resultado(session_id, user_id, mask, spacing, modality, report)
+    resultado["seed"] = [int(v) for v in seed]
+    resultado["seed_value"] = valor
+    resultado["range"] = [tmin if np.isfinite(tmin) else None, tmax if np.isfinite(tmax) else None]
+    resultado["roi"] = [[r.start, r.stop] for r in roi]
+    return resultado
 
-    # Fallback extra: si se quedó sin voxeles, intentar con min_size más pequeño
-    if mask.sum() == 0:
-        print("⚠️ Máscara vacía tras remove_small_objects, reintentando con tamaño mínimo pequeño.")
-        mask_tmp = binary_closing(mask, footprint=ball(r_vox))
-        try:
-            mask_tmp = binary_fill_holes(mask_tmp)
-        except Exception:
-            pass
-        mask_tmp = morphology.remove_small_objects(mask_tmp, min_size=100)
-        if mask_tmp.sum() > 0:
-            mask = mask_tmp
-
-    labels = measure.label(mask, connectivity=3)
-    if labels.max() > 0:
-        counts = np.bincount(labels.ravel())
-        largest = int(np.argmax(counts[1:]) + 1)
-        mask = labels == largest
-    else:
-        mask = np.zeros_like(mask, dtype=bool)
 
+def _guardar_resultado(session_id: str, user_id: int, mask: np.ndarray, spacing, modality: str,
+                       report: Callable[[float, str], None]) -> dict:
+    """
+    Métricas, máscara compacta, miniaturas, superficie/STL y fila en segmentacion3d
+    de una máscara 3D ya calculada (en memoria o np.memmap).
+    """
     # ===== 4) Métricas =====
+    report(0.7, "save")
     voxel_mm3 = float(spacing[0] * spacing[1] * spacing[2])
     voxels = int(mask.sum())
     volume_mm3 = float(voxels * voxel_mm3)
@@ -393,7 +1362,7 @@ def segmentar_serie_3d(
     def _pub(name: str) -> str:
         return f"/static/segmentations3d/{session_id}/{name}"
 
-    mask_name = f"{uid}_mask.npy"
+    mask_name = f"{uid}_mask{MASK_EXT}"
     ax_name   = f"{uid}_axial.png"
     sg_name   = f"{uid}_sagittal.png"
     cr_name   = f"{uid}_coronal.png"
@@ -409,7 +1378,8 @@ def segmentar_serie_3d(
     yc = mask.shape[1] // 2
     xc = mask.shape[2] // 2
 
-    np.save(os.path.join(base_out, mask_name), mask.astype(np.uint8))
+    # Máscara compacta: recortada al bounding box, 1 bit/voxel y con su geometría
+    geom = guardar_mascara_3d(os.path.join(base_out, mask_name), mask, spacing)
 
     io.imsave(os.path.join(base_out, ax_name), (mask[zc].astype(np.uint8) * 255))
     io.imsave(os.path.join(base_out, sg_name), (mask[:, :, xc].astype(np.uint8) * 255))
@@ -432,20 +1402,23 @@ def segmentar_serie_3d(
             "stl_url": None,
         }
 
-    coords = np.argwhere(mask)
-    zmin, ymin, xmin = coords.min(axis=0)
-    zmax, ymax, xmax = coords.max(axis=0)
-    bbox_z_mm = float((zmax - zmin + 1) * spacing[0])
-    bbox_y_mm = float((ymax - ymin + 1) * spacing[1])
-    bbox_x_mm = float((xmax - xmin + 1) * spacing[2])
+    crop_z, crop_y, crop_x = geom["crop_shape"]
+    bbox_z_mm = float(crop_z * spacing[0])
+    bbox_y_mm = float(crop_y * spacing[1])
+    bbox_x_mm = float(crop_x * spacing[2])
 
     # ===== 5) Superficie y STL =====
+    report(0.8, "surface")
     surface_mm2 = None
     stl_url = None
     try:
-        # marching_cubes devuelve la superficie de la máscara
-        verts, faces, _, _ = measure.marching_cubes(
-            mask.astype(np.uint8), level=0.5, spacing=tuple(spacing[::-1])
+        # marching_cubes devuelve la superficie de la máscara (sólo sobre el bbox)
+        z0, y0, x0 = geom["origin"]
+        verts, faces, _, _ = marching_cubes_recortado(
+            mask[z0:z0 + crop_z, y0:y0 + crop_y, x0:x0 + crop_x],
+            geom["origin"],
+            mask.shape,
+            tuple(spacing[::-1]),
         )
 
         # Área superficial
@@ -467,6 +1440,7 @@ def segmentar_serie_3d(
         stl_url = None
 
     # ===== 6) Guardar en DB =====
+    report(0.95, "db")
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
@@ -520,6 +1494,8 @@ def segmentar_serie_3d(
     }
 
 
+
+
 def listar_segmentaciones_3d(session_id: str, user_id: int):
     conn = get_connection()
     cur = conn.cursor()
@@ -3,8 +3,10 @@ import datetime
 import os
 import numpy as np
 import pydicom
+from psycopg2.extras import execute_values
 from skimage import measure, morphology, io
 from skimage.measure import regionprops
+from typing import Dict, List, Tuple
 from uuid import uuid4
 
 from config.db_config import get_connection
@@ -165,3 +167,65 @@ def get_or_create_archivo_dicom(
     cursor.close()
     conn.close()
     return archivo_id
+
+
+def registrar_archivos_dicom_bulk(
+    archivos: List[Tuple[str, str]], sistemaid: int = 1, user_id: int = None
+) -> Dict[str, int]:
+    """
+    Registra todos los archivos DICOM de una serie en UNA sola transacción.
+    archivos: lista de (nombrearchivo, rutaarchivo).
+    Reutiliza los que ya existen (mismo nombre, ruta y usuario) e inserta el resto
+    con INSERT ... VALUES por lotes. Si algo falla se hace rollback completo:
+    no queda ninguna serie registrada a medias.
+    Retorna {rutaarchivo: archivodicomid}.
+    """
+    # Una entrada por ruta, conservando el orden de llegada
+    pendientes = dict((ruta, nombre) for nombre, ruta in archivos)
+    if not pendientes:
+        return {}
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT archivodicomid, nombrearchivo, rutaarchivo FROM ArchivoDicom
+            WHERE rutaarchivo = ANY(%s) AND user_id = %s
+        """,
+            (list(pendientes.keys()), user_id),
+        )
+        ids = {}
+        for archivo_id, nombre, ruta in cursor.fetchall():
+            if pendientes.get(ruta) == nombre:
+                ids[ruta] = archivo_id
+
+        hoy = datetime.date.today()
+        nuevos = [
+            (hoy, sistemaid, nombre, ruta, user_id)
+            for ruta, nombre in pendientes.items()
+            if ruta not in ids
+        ]
+        if nuevos:
+            insertados = execute_values(
+                cursor,
+                """
+                INSERT INTO ArchivoDicom (fechacarga, sistemaid, nombrearchivo, rutaarchivo, user_id)
+                VALUES %s
+                RETURNING archivodicomid, rutaarchivo
+            """,
+                nuevos,
+                page_size=500,
+                fetch=True,
+            )
+            for archivo_id, ruta in insertados:
+                ids[ruta] = archivo_id
+
+        conn.commit()
+        return ids
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
@@ -0,0 +1,590 @@
+# api/services/visor_service.py
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+import uuid
+import zlib
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+from config.settings import PREVIEW_QUALITY, RAW_ZLIB_LEVEL
+
+from .preview_service import (
+    PREVIEW_ENCODINGS,
+    WINDOW_PRESETS,
+    aplicar_ventana,
+    codificar_preview,
+    normalizar_encoding,
+    resolver_ventana,
+)
+from .decode_service import iterar_frames
+from .manifest_service import clave_corte, entradas_manifest
+from .mpr_service import MPR_MODES, MPR_PLANES, reslice
+from .histogram_service import indice_histograma
+from .segmentation3d_service import (
+    PRESETS_CT,
+    _EstadisticasHistograma,
+    _cortes_versionados,
+    _load_volume,
+    _regla_final,
+    _serie_dir,
+    _version_serie,
+)
+from .volume_cache_service import _volume_cache_dir, render_lru
+
+# Subir este número cambia todos los ETag (cambio en el render)
+RENDER_VERSION = 1
+RENDER_SIZE_MIN, RENDER_SIZE_MAX = 16, 2048
+CACHE_CONTROL_INMUTABLE = "private, max-age=31536000, immutable"
+# Datos crudos: int16 little-endian; valor real = slope * crudo + intercept
+RAW_DTYPE = "<i2"
+# Bundle de vistas previas: magic + uint32 LE con la longitud del índice JSON + índice + datos
+BUNDLE_MAGIC = b"DPB1"
+
+_NOMBRE_CORTE = re.compile(r"^(?:image_)?(\d+)(?:\.(\w+))?$")
+
+
+def parsear_nombre_corte(nombre: str) -> Tuple[int, Optional[str]]:
+    """'image_12.png' o '12.jpg' -> (12, 'png' / 'jpeg'). ValueError si no es un corte."""
+    m = _NOMBRE_CORTE.match(nombre)
+    if not m:
+        raise ValueError(f"Nombre de corte no válido: {nombre}")
+    return int(m.group(1)), normalizar_encoding(m.group(2)) if m.group(2) else None
+
+
+def url_corte(session_id: str, idx: int, fmt: str = "png") -> str:
+    """URL del corte renderizado bajo demanda (mismo nombre que el PNG del mapping)."""
+    return f"/series/{session_id}/slices/image_{idx}.{fmt}"
+
+
+def _cargar_mapping(session_id: str) -> dict:
+    mapping_path = os.path.join(_serie_dir(session_id), "mapping.json")
+    if not os.path.isfile(mapping_path):
+        raise FileNotFoundError("mapping.json no encontrado para la serie")
+    with open(mapping_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def validar_parametros(wl: Optional[float], ww: Optional[float], window: Optional[str],
+                       size: Optional[int], fmt: str, quality: Optional[int] = None) -> None:
+    """ValueError si los parámetros de render no son válidos."""
+    normalizar_encoding(fmt)
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("quality debe estar entre 1 y 100")
+    if (wl is None) != (ww is None):
+        raise ValueError("wl y ww deben indicarse juntos")
+    if ww is not None and ww <= 0:
+        raise ValueError("ww debe ser mayor que 0")
+    if window is not None and window != "auto" and window not in WINDOW_PRESETS:
+        raise ValueError(f"Ventana no soportada: {window}")
+    if size is not None and not (RENDER_SIZE_MIN <= size <= RENDER_SIZE_MAX):
+        raise ValueError(f"size debe estar entre {RENDER_SIZE_MIN} y {RENDER_SIZE_MAX}")
+
+
+def _calidad(fmt: str, quality: Optional[int]) -> Optional[int]:
+    return None if fmt == "png" else int(quality or PREVIEW_QUALITY)
+
+
+def _preview_de_ingesta(session_id: str, idx: int, wl, ww, window, size, fmt, quality) -> Optional[Tuple[str, str]]:
+    """
+    (ruta, formato) de la vista previa guardada en la ingesta si la petición es la
+    vista por defecto (sin parámetros de render); si no, None. La ingesta guarda
+    una sola codificación: si no es la pedida se devuelve la guardada y
+    _leer_preview la transcodifica bajo demanda (misma ventana que la ingesta).
+    """
+    if any(v is not None for v in (wl, ww, window, size, quality)):
+        return None
+    base = os.path.join(_serie_dir(session_id), f"image_{idx}")
+    for guardado in (fmt,) + tuple(f for f in PREVIEW_ENCODINGS if f != fmt):
+        path = base + PREVIEW_ENCODINGS[guardado][2]
+        if os.path.isfile(path):
+            return path, guardado
+    return None
+
+
+def _leer_preview(ingesta: Tuple[str, str], fmt: str) -> bytes:
+    """Bytes de la vista previa de la ingesta en `fmt`, transcodificando si hace falta."""
+    path, guardado = ingesta
+    if guardado == fmt:
+        with open(path, "rb") as f:
+            return f.read()
+    with Image.open(path) as im:
+        return codificar_preview(im, fmt, _calidad(fmt, None))
+
+
+def etag_corte(session_id: str, idx: int, wl: Optional[float], ww: Optional[float],
+               window: Optional[str], size: Optional[int], fmt: str,
+               quality: Optional[int] = None) -> str:
+    """
+    ETag fuerte: depende de la versión de contenido del volumen (hash de los DICOM)
+    y de todos los parámetros de render. Se calcula sin renderizar para poder
+    responder 304 directamente. Las vistas previas de la ingesta no cambian nunca:
+    su ETag sólo depende de la sesión, el corte y el formato.
+    """
+    validar_parametros(wl, ww, window, size, fmt, quality)
+    fmt = normalizar_encoding(fmt)
+    if _preview_de_ingesta(session_id, idx, wl, ww, window, size, fmt, quality):
+        clave = json.dumps([RENDER_VERSION, session_id, "ingesta", idx, fmt], separators=(",", ":"))
+    else:
+        version = _version_serie(session_id)
+        clave = json.dumps(
+            [RENDER_VERSION, session_id, version, idx, wl, ww, window, size, fmt, _calidad(fmt, quality)],
+            separators=(",", ":"),
+        )
+    return '"' + hashlib.sha1(clave.encode("utf-8")).hexdigest() + '"'
+
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara If-None-Match (lista separada por comas, '*' o W/) con el ETag."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag == etag or (tag.startswith("W/") and tag[2:] == etag):
+            return True
+    return False
+
+
+def _corte_desde_volumen(session_id: str, clave: str):
+    """
+    Corte 2D del volumen cacheado con su rescale, o None si no forma parte de él:
+    (arr, modality, slope, intercept). En CT el volumen ya está en HU; en el resto
+    guarda los valores almacenados y se usa el rescale del corte en el manifest.
+    """
+    vol, _, modality, names = _load_volume(session_id)
+    if clave not in names:
+        return None
+    slope, intercept = 1.0, 0.0
+    if modality != "CT":
+        entries, _, meta0, _ = _cortes_versionados(session_id)
+        meta = next((e for e in entries if clave_corte(e["dicom_name"], e.get("frame")) == clave), meta0)
+        slope = meta.get("slope") if meta.get("slope") is not None else 1.0
+        intercept = meta.get("intercept") if meta.get("intercept") is not None else 0.0
+    return np.asarray(vol[names.index(clave)]), modality, slope, intercept
+
+
+def _corte_desde_dicom(session_id: str, dicom_name: str, frame: Optional[int] = None):
+    """Corte fuera del volumen (otra resolución, SC, ...): se decodifica su DICOM."""
+    p = os.path.join(_serie_dir(session_id), dicom_name)
+    if not os.path.isfile(p):
+        raise FileNotFoundError(f"No se encontró el archivo DICOM: {dicom_name}")
+    ds = pydicom.dcmread(p, force=True, stop_before_pixels=True)
+    entries = entradas_manifest(ds, dicom_name)
+    meta = entries[frame or 0] if (frame or 0) < len(entries) else entries[0]
+    _, arr = next(iterar_frames(p, None if frame is None else [frame], ds=ds))
+    slope = meta["slope"] if meta["slope"] is not None else 1.0
+    intercept = meta["intercept"] if meta["intercept"] is not None else 0.0
+    return arr, meta["modality"], slope, intercept
+
+
+def _render(session_id: str, idx: int, wl: Optional[float], ww: Optional[float],
+            window: Optional[str], size: Optional[int], fmt: str, quality: Optional[int]) -> bytes:
+    mapping = _cargar_mapping(session_id)
+    meta = mapping.get(f"image_{idx}.png")
+    if meta is None:
+        raise FileNotFoundError(f"El corte {idx} no existe en la serie")
+
+    corte = _corte_desde_volumen(session_id, clave_corte(meta["dicom_name"], meta.get("frame")))
+    if corte is not None:
+        arr, modality, slope, intercept = corte
+    else:
+        arr, modality, slope, intercept = _corte_desde_dicom(session_id, meta["dicom_name"], meta.get("frame"))
+
+    return _codificar(arr, modality, slope, intercept, wl, ww, window, size, fmt, quality)
+
+
+def _codificar(arr: np.ndarray, modality: str, slope: float, intercept: float,
+               wl: Optional[float], ww: Optional[float], window: Optional[str],
+               size: Optional[int], fmt: str, quality: Optional[int]) -> bytes:
+    """Ventana/nivel + redimensionado + codificación de una imagen 2D (o RGB)."""
+    if arr.ndim == 3:
+        # RGB: se sirve tal cual (sin ventana)
+        image = Image.fromarray(np.asarray(arr, dtype=np.uint8))
+    elif wl is not None and ww is not None:
+        image = Image.fromarray(aplicar_ventana(arr, wl, ww, slope, intercept))
+    else:
+        wl_, ww_ = resolver_ventana(arr, modality, slope, intercept, window)
+        image = Image.fromarray(aplicar_ventana(arr, wl_, ww_, slope, intercept))
+
+    if size is not None:
+        # size = lado mayor en píxeles, conservando la proporción
+        h, w = image.height, image.width
+        escala = size / float(max(h, w))
+        nuevo = (max(1, round(w * escala)), max(1, round(h * escala)))
+        if nuevo != (w, h):
+            image = image.resize(nuevo, Image.BILINEAR)
+
+    return codificar_preview(image, fmt, _calidad(fmt, quality))
+
+
+def render_corte(session_id: str, idx: int, wl: Optional[float] = None, ww: Optional[float] = None,
+                 window: Optional[str] = None, size: Optional[int] = None, fmt: str = "png",
+                 quality: Optional[int] = None, etag: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Renderiza un corte de la serie desde el volumen cacheado (sin PNG previo en disco).
+      - wl/ww: nivel y ancho de ventana en unidades reescaladas (HU en CT);
+        si faltan se usa `window` (ct_bone/ct_brain/ct_soft/auto) o la ventana
+        por defecto de la modalidad.
+      - size: lado mayor de la imagen de salida en píxeles (None = tamaño original).
+      - fmt: png | webp | jpeg; quality 1-100 para webp/jpeg.
+    Sin parámetros de render se sirve la vista previa de la ingesta (transcodificada
+    si se guardó en otro formato, p.ej. PNG desde el WebP). Lo demás se guarda en render_lru (LRU acotada en bytes) por ETag.
+    Devuelve (contenido, etag).
+    """
+    fmt = normalizar_encoding(fmt)
+    etag = etag or etag_corte(session_id, idx, wl, ww, window, size, fmt, quality)
+    ingesta = _preview_de_ingesta(session_id, idx, wl, ww, window, size, fmt, quality)
+    if ingesta is not None:
+        if ingesta[1] == fmt:
+            return _leer_preview(ingesta, fmt), etag
+        return render_lru.get_or_load((session_id, etag), lambda: _leer_preview(ingesta, fmt)), etag
+    content = render_lru.get_or_load(
+        (session_id, etag),
+        lambda: _render(session_id, idx, wl, ww, window, size, fmt, quality),
+    )
+    return content, etag
+
+
+def media_type(fmt: str) -> str:
+    return PREVIEW_ENCODINGS[normalizar_encoding(fmt)][1]
+
+
+# ========= Datos crudos (int16) para ventana/nivel en el cliente =========
+
+def _escala_int16(vol: np.ndarray, bloque: int = 16) -> Tuple[float, float]:
+    """
+    (offset, factor) para cuantizar el volumen a int16: crudo = (v - offset) / factor.
+    Datos enteros que caben en int16 se envían sin cambios (0, 1); si el rango entero
+    cabe en 16 bits se desplaza (p.ej. uint16 de MR); si no, se escala linealmente.
+    Se recorre por bloques de Z para no duplicar en memoria un volumen memmap.
+    """
+    vmin, vmax, entero = np.inf, -np.inf, True
+    for z0 in range(0, vol.shape[0], bloque):
+        b = np.asarray(vol[z0:z0 + bloque])
+        vmin = min(vmin, float(b.min()))
+        vmax = max(vmax, float(b.max()))
+        entero = entero and bool(np.all(b == np.round(b)))
+    if entero and vmin >= -32768 and vmax <= 32767:
+        return 0.0, 1.0
+    if entero and vmax - vmin <= 65535:
+        return vmin + 32768.0, 1.0
+    factor = max((vmax - vmin) / 65535.0, 1e-12)
+    return vmin + 32768.0 * factor, factor
+
+
+def _cuantizacion(session_id: str, version: str, vol: np.ndarray) -> Tuple[float, float]:
+    # Se calcula una vez por versión del volumen (recorre todo el volumen)
+    return render_lru.get_or_load((session_id, version, "escala_int16"), lambda: _escala_int16(vol))
+
+
+def info_volumen(session_id: str) -> dict:
+    """
+    Geometría del volumen de la serie y cómo interpretar los datos crudos:
+      - shape (Z, Y, X), spacing (dz, dy, dx) en mm, modality
+      - slope / intercept: valor real (HU en CT) = slope * crudo + intercept
+      - slices: imagen del mapping (image_{idx}.png) de cada Z, o None si es sintética
+    """
+    _, _, meta0, version = _cortes_versionados(session_id)
+    vol, spacing, modality, names = _load_volume(session_id)
+
+    offset, factor = _cuantizacion(session_id, version, vol)
+    if modality == "CT":
+        slope, intercept = factor, offset  # el volumen ya está en HU
+    else:
+        # El volumen guarda los valores almacenados: se compone con el rescale DICOM
+        m_slope = meta0.get("slope") if meta0.get("slope") is not None else 1.0
+        m_intercept = meta0.get("intercept") if meta0.get("intercept") is not None else 0.0
+        slope, intercept = m_slope * factor, m_slope * offset + m_intercept
+
+    imagen_por_clave = {
+        clave_corte(meta["dicom_name"], meta.get("frame")): key
+        for key, meta in _cargar_mapping(session_id).items()
+    }
+    return {
+        "session_id": session_id,
+        "version": version,
+        "shape": [int(v) for v in vol.shape],
+        "spacing": [float(v) for v in spacing],
+        "modality": modality,
+        "dtype": RAW_DTYPE,
+        "slope": float(slope),
+        "intercept": float(intercept),
+        "slices": [imagen_por_clave.get(n) if n else None for n in names],
+    }
+
+
+# Percentiles que se devuelven con el histograma (marcas del selector de umbral)
+HISTOGRAM_PERCENTILES = (1, 2, 5, 25, 40, 50, 75, 95, 98, 99)
+HISTOGRAM_BINS_MAX = 4096
+
+
+def histograma_volumen(session_id: str, bins: int = 256) -> dict:
+    """
+    Histograma de intensidades de la serie para el selector de umbral, desde su
+    índice de histograma (histogram_service), en las unidades de los umbrales de
+    segmentar_serie_3d (HU en CT; valores almacenados en MR):
+      - counts en `bins` bins iguales entre min y max (edges: bins + 1 bordes)
+      - percentiles, umbral de Otsu, voxeles de cada preset CT y regla automática
+        (la que aplicaría segmentar_serie_3d sin preset ni umbrales)
+    exact=False: valores no enteros; percentiles aproximados al bin y sin regla automática.
+    """
+    if not 2 <= bins <= HISTOGRAM_BINS_MAX:
+        raise ValueError(f"bins debe estar entre 2 y {HISTOGRAM_BINS_MAX}")
+    version = _version_serie(session_id)
+    vol, _, modality, _ = _load_volume(session_id)
+    indice = indice_histograma(session_id, version, vol)
+    if indice.n == 0:
+        raise ValueError("El volumen no tiene valores finitos")
+
+    edges, counts = indice.reagrupar(bins)
+    vmin, vmax = indice.rango()
+    percentiles = indice.percentil(list(HISTOGRAM_PERCENTILES))
+    try:
+        otsu = float(indice.otsu())
+    except ValueError:
+        otsu = None
+
+    presets = {}
+    if modality == "CT":
+        for nombre, (tmin, tmax) in PRESETS_CT.items():
+            voxeles = indice.contar(lambda v: (v >= tmin) & (v <= tmax))
+            presets[nombre] = {"min": tmin, "max": tmax, "voxels": voxeles, "fraction": voxeles / indice.n}
+
+    auto = None
+    if indice.exacto:
+        regla = _regla_final(modality, None, None, None, _EstadisticasHistograma(indice))
+        auto = {"rule": regla[0], "params": [float(v) for v in regla[1:]]}
+
+    return {
+        "session_id": session_id,
+        "version": version,
+        "modality": modality,
+        "exact": indice.exacto,
+        "n": indice.n,
+        "min": float(vmin),
+        "max": float(vmax),
+        "edges": [float(v) for v in edges],
+        "counts": [int(v) for v in counts],
+        "percentiles": {str(q): float(p) for q, p in zip(HISTOGRAM_PERCENTILES, percentiles)},
+        "otsu": otsu,
+        "presets": presets,
+        "auto": auto,
+    }
+
+
+def z_de_imagen(info: dict, idx: int) -> int:
+    """Índice Z del volumen de la imagen image_{idx}.png del mapping."""
+    try:
+        return info["slices"].index(f"image_{idx}.png")
+    except ValueError:
+        raise FileNotFoundError(f"El corte {idx} no forma parte del volumen 3D")
+
+
+def etag_crudo(info: dict, z0: int, count: int, encoding: str) -> str:
+    clave = json.dumps(
+        [RENDER_VERSION, info["session_id"], info["version"], "raw", z0, count, encoding],
+        separators=(",", ":"),
+    )
+    return '"' + hashlib.sha1(clave.encode("utf-8")).hexdigest() + '"'
+
+
+def datos_crudos(info: dict, z0: int, count: int = 1, deflate: bool = True) -> Tuple[bytes, str]:
+    """
+    Bloque de `count` cortes desde Z=z0 como int16 little-endian (C-order, Z-Y-X),
+    comprimido con zlib (Content-Encoding: deflate) si `deflate`.
+    Se lee del volumen cacheado (memmap/LRU), sin volver a parsear DICOM.
+    Devuelve (contenido, etag); el contenido se guarda en render_lru.
+    """
+    nz = info["shape"][0]
+    if count < 1 or z0 < 0 or z0 + count > nz:
+        raise ValueError(f"Rango de cortes fuera del volumen: z={z0}, count={count} (Z={nz})")
+    encoding = "deflate" if deflate else "identity"
+    etag = etag_crudo(info, z0, count, encoding)
+
+    def _cargar() -> bytes:
+        vol, _, _, _ = _load_volume(info["session_id"])
+        offset, factor = _cuantizacion(info["session_id"], info["version"], vol)
+        bloque = np.asarray(vol[z0:z0 + count], dtype=np.float32)
+        if offset != 0.0 or factor != 1.0:
+            bloque = (bloque - offset) / factor
+        raw = np.clip(np.rint(bloque), -32768, 32767).astype(RAW_DTYPE).tobytes()
+        return zlib.compress(raw, RAW_ZLIB_LEVEL) if deflate else raw
+
+    return render_lru.get_or_load((info["session_id"], etag), _cargar), etag
+
+
+# ========= Reconstrucción multiplanar (MPR) =========
+
+def _vector(value: Optional[Sequence[float]], nombre: str) -> Optional[Tuple[float, float, float]]:
+    if value is None:
+        return None
+    if len(value) != 3:
+        raise ValueError(f"{nombre} debe tener 3 componentes x,y,z")
+    return tuple(float(c) for c in value)
+
+
+def render_mpr(session_id: str, plane: str = "sagittal", offset_mm: Optional[float] = None,
+               normal: Optional[Sequence[float]] = None, center: Optional[Sequence[float]] = None,
+               thickness_mm: float = 0.0, mode: str = "avg", pixel_mm: Optional[float] = None,
+               wl: Optional[float] = None, ww: Optional[float] = None, window: Optional[str] = None,
+               size: Optional[int] = None, fmt: str = "png", quality: Optional[int] = None,
+               if_none_match: Optional[str] = None) -> Tuple[Optional[bytes], str]:
+    """
+    Plano MPR (axial/sagital/coronal/oblicuo) del volumen cacheado, con ventana y
+    codificación como los cortes. normal y center se dan en (x, y, z), en mm
+    desde el primer voxel; offset_mm desplaza el plano a lo largo de su normal.
+    Si if_none_match coincide con el ETag no se renderiza: devuelve (None, etag).
+    Devuelve (contenido, etag); el contenido se guarda en render_lru.
+    """
+    validar_parametros(wl, ww, window, size, fmt, quality)
+    fmt = normalizar_encoding(fmt)
+    if plane not in MPR_PLANES:
+        raise ValueError(f"Plano no soportado: {plane}")
+    if mode not in MPR_MODES:
+        raise ValueError(f"Modo de slab no soportado: {mode}")
+    normal = _vector(normal, "normal")
+    center = _vector(center, "center")
+    if plane == "oblique" and normal is None:
+        raise ValueError("El plano oblicuo necesita normal=x,y,z")
+
+    version = _version_serie(session_id)
+    clave = json.dumps(
+        [RENDER_VERSION, session_id, version, "mpr", plane, offset_mm, normal, center, thickness_mm,
+         mode, pixel_mm, wl, ww, window, size, fmt, _calidad(fmt, quality)],
+        separators=(",", ":"),
+    )
+    etag = '"' + hashlib.sha1(clave.encode("utf-8")).hexdigest() + '"'
+    if etag_coincide(if_none_match, etag):
+        return None, etag
+
+    def _cargar() -> bytes:
+        vol, spacing, modality, _ = _load_volume(session_id)
+        image, _ = reslice(
+            vol,
+            spacing,
+            plane=plane,
+            offset_mm=offset_mm,
+            normal_zyx=normal[::-1] if normal else None,
+            center_mm=center[::-1] if center else None,
+            thickness_mm=thickness_mm,
+            mode=mode,
+            pixel_mm=pixel_mm,
+            cval=-1024.0 if modality == "CT" else 0.0,
+        )
+        return _codificar(image, modality, 1.0, 0.0, wl, ww, window, size, fmt, quality)
+
+    return render_lru.get_or_load((session_id, etag), _cargar), etag
+
+
+# ========= Bundle de vistas previas (una sola petición) =========
+
+def _indices_mapping(mapping: dict) -> list:
+    """Índices idx de las imágenes image_{idx}.png del mapping, ordenados."""
+    out = []
+    for key in mapping:
+        try:
+            out.append(parsear_nombre_corte(key)[0])
+        except ValueError:
+            continue
+    return sorted(out)
+
+
+def _parametros_bundle(session_id: str, start: int, count: Optional[int], fmt: Optional[str],
+                       size: Optional[int], quality: Optional[int]) -> Tuple[list, str, str, str]:
+    """(índices, formato, versión, etag) del bundle pedido, sin construirlo."""
+    mapping = _cargar_mapping(session_id)
+    indices = _indices_mapping(mapping)
+    if start < 0 or start >= len(indices):
+        raise ValueError(f"start fuera de rango (la serie tiene {len(indices)} imágenes)")
+    indices = indices[start:] if count is None else indices[start:start + count]
+    if fmt is None:
+        encodings = mapping[f"image_{indices[0]}.png"].get("encodings") or ["png"]
+        fmt = encodings[0]
+    validar_parametros(None, None, None, size, fmt, quality)
+    fmt = normalizar_encoding(fmt)
+
+    version = _version_serie(session_id)
+    clave = json.dumps(
+        [RENDER_VERSION, session_id, version, "bundle", indices[0], len(indices), fmt, size,
+         _calidad(fmt, quality)],
+        separators=(",", ":"),
+    )
+    return indices, fmt, version, '"' + hashlib.sha1(clave.encode("utf-8")).hexdigest() + '"'
+
+
+def etag_bundle(session_id: str, start: int = 0, count: Optional[int] = None, fmt: Optional[str] = None,
+                size: Optional[int] = None, quality: Optional[int] = None) -> str:
+    """ETag del bundle (ver bundle_serie), sin construirlo: permite responder 304 directamente."""
+    return _parametros_bundle(session_id, start, count, fmt, size, quality)[3]
+
+
+def bundle_serie(session_id: str, start: int = 0, count: Optional[int] = None, fmt: Optional[str] = None,
+                 size: Optional[int] = None, quality: Optional[int] = None) -> Tuple[str, str, str]:
+    """
+    Vistas previas de la serie (o de `count` imágenes desde la posición `start`,
+    en orden de idx) en un único binario:
+
+        b"DPB1" | uint32 LE n | índice JSON (n bytes, UTF-8) | datos
+
+    El índice es {"format", "media_type", "slices": [{"image", "offset", "length"}]}
+    con offset relativo al inicio de los datos (8 + n), de modo que el cliente puede
+    leer la cabecera y pedir cada corte con Range. fmt=None usa la codificación
+    preferida de la ingesta (la primera de "encodings"), sin recodificar.
+    El binario se escribe una vez en la caché de la sesión (junto al volumen) y se
+    sirve desde disco: un Range lee sólo sus bytes.
+    Devuelve (ruta del binario, etag, media type de las imágenes).
+    """
+    indices, fmt, version, etag = _parametros_bundle(session_id, start, count, fmt, size, quality)
+    base = _volume_cache_dir(session_id)
+    path = os.path.join(base, f"bundle_{version}_{etag[1:-1]}.bin")
+
+    def _construir() -> str:
+        if os.path.isfile(path):
+            return path
+        os.makedirs(base, exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        entradas, offset = [], 0
+        with open(tmp + ".datos", "wb") as datos:
+            for idx in indices:
+                # Sin pasar por render_corte: el bundle completo ya se cachea por su ETag
+                ingesta = _preview_de_ingesta(session_id, idx, None, None, None, size, fmt, quality)
+                if ingesta is not None:
+                    content = _leer_preview(ingesta, fmt)
+                else:
+                    content = _render(session_id, idx, None, None, None, size, fmt, quality)
+                entradas.append({"image": f"image_{idx}.png", "offset": offset, "length": len(content)})
+                datos.write(content)
+                offset += len(content)
+        index = json.dumps(
+            {"format": fmt, "media_type": media_type(fmt), "slices": entradas},
+            separators=(",", ":"),
+        ).encode("utf-8")
+        try:
+            with open(tmp, "wb") as out, open(tmp + ".datos", "rb") as datos:
+                out.write(BUNDLE_MAGIC + struct.pack("<I", len(index)) + index)
+                shutil.copyfileobj(datos, out)
+            os.replace(tmp, path)
+        finally:
+            for resto in (tmp, tmp + ".datos"):
+                if os.path.exists(resto):
+                    os.remove(resto)
+        # Bundles de versiones anteriores del volumen
+        for name in os.listdir(base):
+            if name.startswith("bundle_") and version not in name:
+                try:
+                    os.remove(os.path.join(base, name))
+                except Exception:
+                    pass
+        return path
+
+    # La LRU sólo guarda la ruta; su lock por clave evita construir el mismo bundle dos veces
+    path = render_lru.get_or_load((session_id, etag, "bundle"), _construir)
+    if not os.path.isfile(path):  # borrado de la caché en disco después de cachear la ruta
+        path = _construir()
+    return path, etag, media_type(fmt)
@@ -0,0 +1,269 @@
+# api/services/volume_cache_service.py
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import CACHE_DIR, RENDER_CACHE_BYTES, SEG_CACHE_BYTES, VOLUME_LRU_BYTES
+
+# Subir este número invalida todos los volúmenes cacheados (cambio en la carga)
+VOLUME_FORMAT = 3
+
+
+def _volume_cache_dir(session_id: str) -> str:
+    return os.path.join(CACHE_DIR, "volumes", session_id)
+
+
+def version_volumen(entries: List[dict], archivos: Optional[list] = None) -> str:
+    """
+    Hash de contenido del volumen: depende de los cortes elegidos (con el sha1 de
+    cada archivo) y de sus tags. El sha1 es el de la ingesta: `archivos`
+    ([(dicom_name, tamaño, mtime_ns)], ver firma_archivos) ata la versión a los
+    archivos que hay hoy en disco, así un DICOM reemplazado sin reescribir el
+    manifest no sirve un volumen viejo.
+    """
+    h = hashlib.sha1(f"volume-v{VOLUME_FORMAT}".encode())
+    h.update(json.dumps(entries, sort_keys=True).encode("utf-8"))
+    if archivos is not None:
+        h.update(json.dumps(archivos).encode("utf-8"))
+    return h.hexdigest()[:20]
+
+
+def firma_archivos(base: str, entries: List[dict]) -> list:
+    """[(dicom_name, tamaño, mtime_ns)] de los archivos de los cortes (sólo stat, sin leerlos)."""
+    firma = []
+    for name in sorted({e["dicom_name"] for e in entries}):
+        try:
+            st = os.stat(os.path.join(base, name))
+            firma.append((name, st.st_size, st.st_mtime_ns))
+        except OSError:
+            firma.append((name, None, None))
+    return firma
+
+
+def cargar_volumen(session_id: str, version: str) -> Optional[Tuple[np.ndarray, tuple, str, list]]:
+    """
+    Abre el volumen cacheado como np.memmap de sólo lectura (sin copiar a RAM).
+    Devuelve (vol, spacing, modality, slices) o None si no hay caché para esa versión.
+    slices[z] es la clave del corte z (dicom_name o dicom_name#frame; None si es sintético).
+    """
+    base = _volume_cache_dir(session_id)
+    npy_path = os.path.join(base, f"volume_{version}.npy")
+    meta_path = os.path.join(base, f"volume_{version}.json")
+    if not (os.path.isfile(npy_path) and os.path.isfile(meta_path)):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vol = np.load(npy_path, mmap_mode="r")
+    except Exception as e:
+        print(f"⚠️ Caché de volumen ilegible, se reconstruye: {e}")
+        return None
+    if list(vol.shape) != meta.get("shape"):
+        return None
+    slices = meta.get("slices") or [None] * vol.shape[0]
+    return vol, tuple(meta["spacing"]), meta["modality"], slices
+
+
+def guardar_volumen(session_id: str, version: str, vol: np.ndarray, spacing: tuple, modality: str,
+                    slices: Optional[list] = None) -> None:
+    """
+    Escribe el volumen como .npy mapeable en memoria + metadatos, de forma atómica,
+    y borra las versiones anteriores de la misma sesión.
+    """
+    base = _volume_cache_dir(session_id)
+    os.makedirs(base, exist_ok=True)
+    npy_path = os.path.join(base, f"volume_{version}.npy")
+    meta_path = os.path.join(base, f"volume_{version}.json")
+
+    tmp_npy = npy_path + ".tmp"
+    out = np.lib.format.open_memmap(tmp_npy, mode="w+", dtype=np.float32, shape=vol.shape)
+    out[...] = vol
+    out.flush()
+    del out
+    os.replace(tmp_npy, npy_path)
+
+    tmp_meta = meta_path + ".tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": version,
+                "shape": list(vol.shape),
+                "spacing": list(spacing),
+                "modality": modality,
+                "slices": list(slices) if slices is not None else None,
+            },
+            f,
+        )
+    os.replace(tmp_meta, meta_path)
+
+    for name in os.listdir(base):
+        if name.startswith("volume_") and version not in name:
+            try:
+                os.remove(os.path.join(base, name))
+            except Exception:
+                pass
+
+
+def borrar_cache_volumen(session_id: str) -> None:
+    """Elimina todos los volúmenes cacheados de la sesión (al borrar la serie)."""
+    volume_lru.invalidate_session(session_id)
+    render_lru.invalidate_session(session_id)
+    intermediate_lru.invalidate_session(session_id)
+    base = _volume_cache_dir(session_id)
+    if os.path.isdir(base):
+        shutil.rmtree(base, ignore_errors=True)
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, (np.ndarray, np.generic)):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if value is None:
+        return 0
+    if hasattr(value, "__dict__"):
+        # Objetos con arrays (p.ej. IndiceHistograma): lo que ocupan sus atributos
+        return sum(_nbytes(v) for v in vars(value).values())
+    return sys.getsizeof(value)
+
+
+def _solo_lectura(value):
+    # Los valores se comparten entre peticiones: nadie debe modificarlos in-place
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _solo_lectura(v)
+    return value
+
+
+class _Carga:
+    """Carga en curso de una clave: su lock, los hilos que la esperan y el valor cargado."""
+
+    __slots__ = ("lock", "usuarios", "valor", "lista")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usuarios = 0
+        self.valor = None
+        self.lista = False
+
+
+class VolumeLRUCache:
+    """
+    Caché LRU en proceso con presupuesto en bytes (suma de ndarray.nbytes).
+    Claves: tuplas cuyo primer elemento es el session_id, p.ej. (session_id, version).
+    Es segura para el threadpool de FastAPI: un lock protege el índice y una carga
+    por clave (con recuento de hilos, se descarta cuando no queda ninguno) evita que
+    dos peticiones carguen a la vez el mismo volumen. Los hilos que esperaban reciben
+    el valor cargado aunque no quepa en la caché.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self._items = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._cargas = {}  # key -> _Carga
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.too_large = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value) -> None:
+        size = _nbytes(value)
+        _solo_lectura(value)
+        if size > self.max_bytes:
+            # Nunca cabría: no vaciar la caché por un solo volumen (se cuenta en stats)
+            with self._lock:
+                self.too_large += 1
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, freed) = self._items.popitem(last=False)
+                self._bytes -= freed
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            carga = self._cargas.get(key)
+            if carga is None:
+                carga = self._cargas[key] = _Carga()
+            carga.usuarios += 1
+        try:
+            with carga.lock:
+                # Otro hilo pudo haberlo cargado mientras esperábamos (quepa o no en la caché)
+                with self._lock:
+                    if carga.lista:
+                        self.hits += 1
+                        return carga.valor
+                    item = self._items.get(key)
+                    if item is not None:
+                        self._items.move_to_end(key)
+                        self.hits += 1
+                        return item[0]
+                    self.misses += 1
+                value = loader()
+                self.put(key, value)
+                carga.valor, carga.lista = value, True
+                return value
+        finally:
+            with self._lock:
+                carga.usuarios -= 1
+                if carga.usuarios == 0 and self._cargas.get(key) is carga:
+                    del self._cargas[key]
+
+    def invalidate_session(self, session_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._items if k[0] == session_id]:
+                _, size = self._items.pop(key)
+                self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "too_large": self.too_large,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+
+volume_lru = VolumeLRUCache(VOLUME_LRU_BYTES)
+# Cortes ya codificados (bytes) del visor bajo demanda: clave (session_id, etag)
+render_lru = VolumeLRUCache(RENDER_CACHE_BYTES)
+# Intermedios de la segmentación 3D (pipeline_cache_service): clave (session_id, hash de etapa)
+intermediate_lru = VolumeLRUCache(SEG_CACHE_BYTES)
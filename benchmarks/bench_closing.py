@@ -0,0 +1,62 @@
+"""
+Benchmark: cierre 3D con footprint ball(r) vs transformadas de distancia (EDT).
+Para cada radio mide binary_closing(mask, ball(r_vox)) (lo que hace closing_method="ball")
+y cierre_edt(mask, radio_mm, spacing) ("edt"), y cuenta los voxeles en que difieren:
+0 con spacing isótropo; con cortes gruesos el footprint en voxeles se extiende
+r_vox cortes en Z (r_vox·dz mm) mientras que la EDT respeta el radio en mm.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_closing.py [--slices 60] [--size 256] [--spacing 5,0.7,0.7]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from skimage.morphology import ball, binary_closing
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+from api.services.morphology_service import cierre_edt
+
+
+def _mascara(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Máscara ósea sintética: anillo con ruido (huecos y grietas que el cierre debe tapar)."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    anillo = (r >= size * 0.3) & (r < size * 0.38)
+    return anillo[None] & (rng.random((n, size, size)) > 0.15)
+
+
+def _medir(fn) -> tuple:
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=60)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--spacing", default="1,1,1", help="dz,dy,dx en mm")
+    parser.add_argument("--radios", default="1,2,3,4,6", help="radios en mm")
+    args = parser.parse_args()
+
+    spacing = tuple(float(v) for v in args.spacing.split(","))
+    mask = _mascara(args.slices, args.size)
+    print(f"Máscara {mask.shape}, spacing {spacing} mm")
+    print(f"{'radio mm':>9}{'r_vox':>7}{'ball s':>9}{'edt s':>9}{'aceleración':>13}{'voxeles distintos':>19}")
+    for radio in (float(v) for v in args.radios.split(",")):
+        r_vox = max(1, int(round(radio / max(float(np.mean(spacing)), 1e-6))))
+        a, t_ball = _medir(lambda: binary_closing(mask, footprint=ball(r_vox)))
+        b, t_edt = _medir(lambda: cierre_edt(mask, radio, spacing))
+        print(f"{radio:>9.1f}{r_vox:>7}{t_ball:>9.2f}{t_edt:>9.2f}{f'x{t_ball / t_edt:.1f}':>13}"
+              f"{int(np.count_nonzero(a != b)):>19}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: segmentación 3D completa vs coarse-to-fine (coarse_factor).
+Un cráneo sintético (esfera ósea hueca) ocupa una parte del campo de visión; mide
+tiempo y pico de memoria (tracemalloc) de segmentar_serie_3d con y sin la pasada
+gruesa, y la diferencia de volumen y de superficie (marching cubes) entre ambas.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_coarse_to_fine.py [--slices 160] [--size 512] [--factor 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+from skimage import measure
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+import api.services.segmentation3d_service as s3
+
+
+def _craneo(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """CT float32 (HU): aire, cabeza (tejido blando) con bóveda ósea hueca descentrada y ruido."""
+    rng = np.random.default_rng(seed)
+    zz, yy, xx = np.ogrid[:n, :size, :size]
+    r = np.sqrt(((zz - n * 0.5) / (n * 0.4)) ** 2 + ((yy - size * 0.4) / (size * 0.3)) ** 2
+                + ((xx - size * 0.45) / (size * 0.3)) ** 2)
+    vol = np.full((n, size, size), -1000.0, dtype=np.float32)
+    vol[r < 1.0] = 40.0
+    vol[(r >= 0.85) & (r < 1.0)] = 1200.0
+    vol += rng.normal(0, 30, vol.shape).astype(np.float32)
+    return vol
+
+
+def _segmentar(vol, spacing, **kw):
+    capturada = {}
+
+    def _guardar(session_id, user_id, mask, spacing, modality, report):
+        capturada["mask"] = np.array(mask)
+        return {}
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            mock.patch.object(s3, "_load_stack", lambda sid: (vol, spacing, "CT")), \
+            mock.patch.object(s3, "_seg3d_dir", lambda sid: tmp), \
+            mock.patch.object(s3, "_guardar_resultado", _guardar), \
+            mock.patch.object(s3, "CACHE_DIR", tmp):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        resultado = s3.segmentar_serie_3d("bench", user_id=0, **kw)
+        s = time.perf_counter() - t0
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return capturada["mask"], resultado, s, pico
+
+
+def _superficie(mask, spacing) -> float:
+    verts, faces, _, _ = measure.marching_cubes(mask.astype(np.uint8), level=0.5, spacing=spacing)
+    return float(measure.mesh_surface_area(verts, faces))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=160)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--factor", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    spacing = (1.0, 0.5, 0.5)
+    vol = _craneo(args.slices, args.size)
+    print(f"Volumen {vol.shape} float32 ({vol.nbytes / 1e6:.0f} MB), spacing {spacing} mm")
+    print(f"{'modo':<22}{'s':>8}{'pico MB':>10}{'voxeles':>12}{'superficie mm²':>17}")
+    base = None
+    for nombre, kw in [("completa", {}), (f"coarse_factor={args.factor}", {"coarse_factor": args.factor})]:
+        mask, resultado, s, pico = _segmentar(vol, spacing, workers=args.workers, blockwise=False, **kw)
+        area = _superficie(mask, spacing)
+        print(f"{nombre:<22}{s:>8.2f}{pico / 1e6:>10.0f}{int(mask.sum()):>12}{area:>17.0f}")
+        if base is None:
+            base = (mask, area, s)
+        else:
+            dv = abs(int(mask.sum()) - int(base[0].sum())) / max(1, int(base[0].sum()))
+            print(f"\nROI {resultado['coarse_to_fine']['roi']} ({resultado['coarse_to_fine']['roi_fraction']:.0%} del volumen)")
+            print(f"Aceleración x{base[2] / s:.2f}; diferencia de volumen {dv:.3%}, "
+                  f"de superficie {abs(area - base[1]) / base[1]:.3%}")
+
+
+if __name__ == "__main__":
+    main()
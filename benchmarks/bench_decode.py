@@ -0,0 +1,212 @@
+"""
+Benchmark: throughput de decodificación por sintaxis de transferencia.
+Genera una serie CT sintética (12 bits) comprimida en cada sintaxis para la que
+hay codificador y mide:
+  - cada plugin de pydicom instalado que la soporta (* = el que elige decode_service),
+  - decodificar_paralelo con 1 proceso y con --workers procesos.
+
+Codificadores: RLE (pydicom), JPEG Lossless SV1 (incluido aquí), JPEG 2000 (pylibjpeg
+o imagecodecs) y JPEG-LS (pyjpegls o imagecodecs); las sintaxis sin codificador se omiten.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_decode.py [--slices 40] [--size 512] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.pixels import get_decoder, get_encoder, pixel_array
+from pydicom.uid import (
+    CTImageStorage,
+    ExplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGLosslessSV1,
+    JPEGLSLossless,
+    RLELossless,
+    generate_uid,
+)
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+from api.services.decode_service import decodificar_paralelo, plugin_decodificador
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+BITS = 12
+
+
+def _ct_sintetico(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Cortes CT uint16 (12 bits): aire, tejido blando y un anillo óseo con ruido."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    base = np.full((size, size), 24.0)
+    base[r < size * 0.4] = 1064.0
+    base[(r >= size * 0.3) & (r < size * 0.38)] = 2224.0
+    out = base[None] + rng.normal(0, 20, (n, size, size))
+    return np.clip(out, 0, 2 ** BITS - 1).astype(np.uint16)
+
+
+# ---- JPEG Lossless, predictor 1 (SV1): ningún plugin de pydicom lo codifica ----
+# Tabla Huffman DC de luminancia estándar ampliada a las categorías 12..16
+_HUFF_BITS = [0, 1, 5, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0]
+_HUFF_VALS = list(range(17))
+
+
+def _huffman_codigos():
+    codigos, largos, code, k = {}, {}, 0, 0
+    for largo, cuenta in enumerate(_HUFF_BITS, start=1):
+        for _ in range(cuenta):
+            codigos[_HUFF_VALS[k]], largos[_HUFF_VALS[k]] = code, largo
+            code, k = code + 1, k + 1
+        code <<= 1
+    return (np.array([codigos[s] for s in _HUFF_VALS], np.int64),
+            np.array([largos[s] for s in _HUFF_VALS], np.int64))
+
+
+def _ljpeg_sv1(arr: np.ndarray, bits: int = BITS) -> bytes:
+    """Codifica un corte 2D uint16 en JPEG Lossless (proceso 14, predictor 1)."""
+    rows, cols = arr.shape
+    x = arr.astype(np.int64)
+    pred = np.empty_like(x)
+    pred[:, 1:] = x[:, :-1]          # Ra (izquierda)
+    pred[1:, 0] = x[:-1, 0]          # primera columna: Rb (arriba)
+    pred[0, 0] = 1 << (bits - 1)
+    diff = (x - pred).ravel()
+    ssss = np.zeros_like(diff)
+    nz = diff != 0
+    ssss[nz] = np.floor(np.log2(np.abs(diff[nz]))).astype(np.int64) + 1
+    extra = np.where(diff < 0, diff - 1, diff) & ((1 << ssss) - 1)
+
+    codigos, largos = _huffman_codigos()
+    valor = (codigos[ssss] << ssss) | extra
+    largo = largos[ssss] + ssss
+    fin = np.cumsum(largo)
+    inicio = fin - largo
+    total = int(fin[-1])
+    bitstream = np.ones(-(-total // 8) * 8, np.uint8)   # relleno final con unos
+    for j in range(int(largo.max())):
+        m = largo > j
+        bitstream[inicio[m] + j] = (valor[m] >> (largo[m] - 1 - j)) & 1
+    datos = np.packbits(bitstream).tobytes().replace(b"\xff", b"\xff\x00")
+
+    def _seg(marker: bytes, payload: bytes) -> bytes:
+        return marker + (len(payload) + 2).to_bytes(2, "big") + payload
+
+    sof3 = bytes([bits]) + rows.to_bytes(2, "big") + cols.to_bytes(2, "big") + bytes([1, 1, 0x11, 0])
+    dht = bytes([0x00]) + bytes(_HUFF_BITS) + bytes(_HUFF_VALS)
+    sos = bytes([1, 1, 0x00, 1, 0, 0])
+    return (b"\xff\xd8" + _seg(b"\xff\xc3", sof3) + _seg(b"\xff\xc4", dht)
+            + _seg(b"\xff\xda", sos) + datos + b"\xff\xd9")
+
+
+def _encapsulado(fn):
+    def _codificar(ds, arr):
+        ds.PixelData = encapsulate([fn(arr)])
+        ds["PixelData"].VR = "OB"
+    return _codificar
+
+
+def _pydicom(ts):
+    def _codificar(ds, arr):
+        ds.compress(ts, arr)
+    return _codificar
+
+
+def _codificadores() -> dict:
+    """{sintaxis: función (ds, arr) que deja PixelData comprimido} según lo instalado."""
+    disponibles = {ExplicitVRLittleEndian: None, RLELossless: _pydicom(RLELossless),
+                   JPEGLosslessSV1: _encapsulado(_ljpeg_sv1)}
+    for ts, fallback in (
+        (JPEG2000Lossless, "jpeg2k_encode"),
+        (JPEGLSLossless, "jpegls_encode"),
+    ):
+        if get_encoder(ts).is_available:
+            disponibles[ts] = _pydicom(ts)
+        elif imagecodecs is not None:
+            if ts == JPEG2000Lossless:
+                disponibles[ts] = _encapsulado(
+                    lambda a: imagecodecs.jpeg2k_encode(a, level=0, codecformat="J2K", reversible=True))
+            else:
+                disponibles[ts] = _encapsulado(imagecodecs.jpegls_encode)
+    return disponibles
+
+
+def _escribir_serie(carpeta: str, vol: np.ndarray, ts, codificar) -> list:
+    suid = generate_uid()
+    rutas = []
+    for i, arr in enumerate(vol):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = CTImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = Dataset()
+        ds.file_meta = meta
+        ds.SOPClassUID, ds.SOPInstanceUID = CTImageStorage, meta.MediaStorageSOPInstanceUID
+        ds.SeriesInstanceUID, ds.Modality, ds.InstanceNumber = suid, "CT", i + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(i)]
+        ds.Rows, ds.Columns = arr.shape
+        ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, BITS, BITS - 1, 0
+        ds.PixelData = arr.tobytes()
+        if codificar is not None:
+            codificar(ds, arr)
+            ds.file_meta.TransferSyntaxUID = ts
+        ruta = os.path.join(carpeta, f"IM{i:04d}.dcm")
+        ds.save_as(ruta, enforce_file_format=True)
+        rutas.append(ruta)
+    return rutas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=40)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    vol = _ct_sintetico(args.slices, args.size)
+    mb = vol.nbytes / 1e6
+    print(f"{args.slices} cortes CT {args.size}x{args.size} ({mb:.1f} MB decodificados), "
+          f"{os.cpu_count()} CPU, --workers {args.workers}")
+    print(f"{'sintaxis':<44}{'ratio':>7}  {'plugin':<12}{'MB/s':>8}{'cortes/s':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for ts, codificar in _codificadores().items():
+            carpeta = os.path.join(tmp, ts)
+            os.makedirs(carpeta)
+            rutas = _escribir_serie(carpeta, vol, ts, codificar)
+            ratio = vol.nbytes / sum(os.path.getsize(r) for r in rutas)
+            elegido = plugin_decodificador(ts)
+
+            plugins = list(get_decoder(ts).available_plugins) or [""]
+            for plugin in plugins:
+                t0 = time.perf_counter()
+                ok = all(np.array_equal(pixel_array(r, decoding_plugin=plugin), v) for r, v in zip(rutas, vol))
+                s = time.perf_counter() - t0
+                marca = "*" if plugin == elegido else " "
+                nombre = (plugin or "nativo") + marca
+                print(f"{ts.name[:43]:<44}{ratio:>7.2f}  {nombre:<12}{mb / s:>8.1f}{len(rutas) / s:>10.1f}"
+                      + ("" if ok else "  ¡DIFIERE!"))
+
+            for workers in sorted({1, args.workers}):
+                t0 = time.perf_counter()
+                out = decodificar_paralelo([(r, None) for r in rutas], workers=workers)
+                s = time.perf_counter() - t0
+                ok = all(np.array_equal(out[(r, None)], v) for r, v in zip(rutas, vol))
+                print(f"{'':<44}{'':>7}  {f'paralelo x{workers}':<12}{mb / s:>8.1f}{len(rutas) / s:>10.1f}"
+                      + ("" if ok else "  ¡DIFIERE!"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: tamaño y latencia por corte de cada codificación de la vista previa
+(png / webp / jpeg a distintas calidades).
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_preview_encodings.py [--slices 40] [--size 512] [--quality 85]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+from api.services.preview_service import codificar_preview, render_preview
+
+
+def _ct_sintetico(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Cortes CT uint16 (RescaleIntercept=-1024): aire, tejido blando y un anillo óseo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    base = np.full((size, size), 24.0)
+    base[r < size * 0.4] = 1064.0
+    base[(r >= size * 0.3) & (r < size * 0.38)] = 2224.0
+    out = base[None] + rng.normal(0, 20, (n, size, size))
+    return np.clip(out, 0, 4095).astype(np.uint16)
+
+
+def _medir(previews, fmt: str, quality):
+    tamanos, t_enc, t_dec = [], [], []
+    for p in previews:
+        t0 = time.perf_counter()
+        data = codificar_preview(p, fmt, quality)
+        t1 = time.perf_counter()
+        Image.open(io.BytesIO(data)).load()
+        t2 = time.perf_counter()
+        tamanos.append(len(data))
+        t_enc.append((t1 - t0) * 1000.0)
+        t_dec.append((t2 - t1) * 1000.0)
+    return np.array(tamanos), np.array(t_enc), np.array(t_dec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=40)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--quality", type=int, default=85)
+    args = parser.parse_args()
+
+    slices = _ct_sintetico(args.slices, args.size)
+    previews = [
+        render_preview(s, modality="CT", slope=1.0, intercept=-1024.0, window="ct_soft") for s in slices
+    ]
+
+    print(f"{args.slices} vistas previas CT {args.size}x{args.size} (lut ct_soft)")
+    print(f"{'codificación':<16}{'KB/corte':>10}{'MB serie 400':>14}{'enc ms':>9}{'dec ms':>9}")
+    casos = [("png", None), ("webp", args.quality), ("webp", 70), ("jpeg", args.quality), ("jpeg", 70)]
+    base_kb = None
+    for fmt, quality in casos:
+        tamanos, t_enc, t_dec = _medir(previews, fmt, quality)
+        kb = tamanos.mean() / 1024.0
+        base_kb = base_kb or kb
+        nombre = fmt if quality is None else f"{fmt} q{quality}"
+        print(f"{nombre:<16}{kb:>10.1f}{kb * 400 / 1024.0:>14.1f}{t_enc.mean():>9.2f}{t_dec.mean():>9.2f}"
+              f"   (x{base_kb / kb:.1f} vs png)")
+
+
+if __name__ == "__main__":
+    main()
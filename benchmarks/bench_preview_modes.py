@@ -0,0 +1,68 @@
+"""
+Benchmark: latencia por corte de la vista previa en modo 'lut' vs 'clahe'.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_preview_modes.py [--slices 40] [--size 512]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+from api.services.preview_service import render_preview
+
+
+def _ct_sintetico(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Cortes CT uint16 (RescaleIntercept=-1024): aire, tejido blando y un anillo óseo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    base = np.full((size, size), 24.0)
+    base[r < size * 0.4] = 1064.0
+    base[(r >= size * 0.3) & (r < size * 0.38)] = 2224.0
+    out = base[None] + rng.normal(0, 20, (n, size, size))
+    return np.clip(out, 0, 4095).astype(np.uint16)
+
+
+def _medir(slices: np.ndarray, **kwargs) -> np.ndarray:
+    tiempos = []
+    for s in slices:
+        t0 = time.perf_counter()
+        render_preview(s, modality="CT", slope=1.0, intercept=-1024.0, **kwargs)
+        tiempos.append((time.perf_counter() - t0) * 1000.0)
+    return np.array(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=40)
+    parser.add_argument("--size", type=int, default=512)
+    args = parser.parse_args()
+
+    slices = _ct_sintetico(args.slices, args.size)
+    render_preview(slices[0], modality="CT", intercept=-1024.0)  # calentamiento
+
+    print(f"{args.slices} cortes CT {args.size}x{args.size} uint16")
+    print(f"{'modo':<22}{'media ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    resultados = {}
+    for nombre, kwargs in [
+        ("clahe", {"mode": "clahe"}),
+        ("lut ct_bone", {"mode": "lut", "window": "ct_bone"}),
+        ("lut ct_brain", {"mode": "lut", "window": "ct_brain"}),
+        ("lut auto (MR)", {"mode": "lut", "window": "auto"}),
+    ]:
+        t = _medir(slices, **kwargs)
+        resultados[nombre] = t.mean()
+        print(f"{nombre:<22}{t.mean():>10.2f}{np.percentile(t, 50):>10.2f}{np.percentile(t, 95):>10.2f}")
+
+    print(f"\nAceleración lut ct_bone vs clahe: x{resultados['clahe'] / resultados['lut ct_bone']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark: segmentación 3D secuencial vs bloques de cortes en paralelo (hilos).
+Mide _segmentar_en_memoria con 1, 2, 4... hilos hasta --workers (y, con
+--bloques, la ruta por bloques con memoria acotada) y comprueba que la máscara
+sea idéntica a la secuencial. La aceleración depende de los núcleos disponibles.
+
+Uso (desde la raíz del repo):
+    python benchmarks/bench_seg_parallel.py [--slices 120] [--size 256] [--workers 8] [--bloques]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Añade el directorio raíz al path (sea cual sea el lugar de ejecución)
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, root_dir)
+
+from api.services.segmentation3d_service import _segmentar_en_memoria, _segmentar_por_bloques
+
+
+def _ct_sintetico(n: int, size: int, seed: int = 0) -> np.ndarray:
+    """Volumen CT float32 (HU): aire, tejido blando y un cilindro óseo hueco con ruido."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    base = np.full((size, size), -1000.0)
+    base[r < size * 0.4] = 40.0
+    base[(r >= size * 0.3) & (r < size * 0.38)] = 1200.0
+    return (base[None] + rng.normal(0, 30, (n, size, size))).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=120)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bloques", action="store_true", help="medir también la ruta por bloques (memmap)")
+    parser.add_argument("--budget-mb", type=int, default=64, help="presupuesto de la ruta por bloques")
+    args = parser.parse_args()
+
+    vol = _ct_sintetico(args.slices, args.size)
+    params = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=2000,
+                  close_radius_mm=1.5, report=lambda fraccion, etapa: None)
+    spacing = (1.0, 1.0, 1.0)
+    hilos = sorted({1, args.workers} | {2 ** i for i in range(1, 8) if 2 ** i < args.workers})
+
+    print(f"Volumen {vol.shape} float32 ({vol.nbytes / 1e6:.0f} MB), {os.cpu_count()} CPU")
+    print(f"{'ruta':<12}{'hilos':>6}{'s':>9}{'aceleración':>13}")
+    referencia = None
+    for ruta in ["memoria"] + (["bloques"] if args.bloques else []):
+        base = None
+        for workers in hilos:
+            with tempfile.TemporaryDirectory() as tmp:
+                t0 = time.perf_counter()
+                if ruta == "memoria":
+                    mask = _segmentar_en_memoria(vol, spacing, "CT", **params, workers=workers)
+                else:
+                    mask = np.array(_segmentar_por_bloques(vol, spacing, "CT", **params, tmp_dir=tmp,
+                                                           presupuesto_bytes=args.budget_mb * 1024 * 1024,
+                                                           workers=workers))
+                s = time.perf_counter() - t0
+            if referencia is None:
+                referencia = mask
+            base = base or s
+            ok = np.array_equal(mask, referencia)
+            print(f"{ruta:<12}{workers:>6}{s:>9.2f}{f'x{base / s:.2f}':>13}" + ("" if ok else "  ¡DIFIERE!"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#config/settings.py
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# ============ Ingesta de series DICOM ============
+# Número de procesos para decodificar/renderizar cortes (1 = modo secuencial)
+INGEST_WORKERS = _env_int("DICOM_INGEST_WORKERS", os.cpu_count() or 1)
+
+# Tamaño de bloque para volcar uploads y extraer miembros del ZIP a disco
+UPLOAD_CHUNK_BYTES = _env_int("DICOM_UPLOAD_CHUNK_BYTES", 1024 * 1024)
+# Vista previa de cada corte: "lut" (ventana/nivel, rápido) o "clahe" (calidad)
+PREVIEW_MODE = os.getenv("DICOM_PREVIEW_MODE", "lut")
+# Ventana por defecto para CT en modo lut: ct_bone | ct_brain | ct_soft | auto
+PREVIEW_CT_WINDOW = os.getenv("DICOM_PREVIEW_CT_WINDOW", "ct_bone")
+# Codificaciones de la vista previa guardadas en la ingesta (orden = preferencia):
+# png | webp | jpeg. Las que no se guardan se sirven bajo demanda por
+# /series/{id}/slices/image_{idx}.{png,webp,jpg}
+PREVIEW_ENCODINGS = os.getenv("DICOM_PREVIEW_ENCODINGS", "webp")
+# Calidad (1-100) de las codificaciones con pérdida (webp / jpeg)
+PREVIEW_QUALITY = _env_int("DICOM_PREVIEW_QUALITY", 85)
+
+# ============ Decodificación de píxeles ============
+# Procesos para decodificar cortes en paralelo al armar volúmenes (1 = secuencial)
+DECODE_WORKERS = _env_int("DICOM_DECODE_WORKERS", os.cpu_count() or 1)
+# Plugins de pydicom en orden de preferencia (se usa el primero instalado que
+# soporte la sintaxis de transferencia): pylibjpeg | gdcm | pyjpegls | pillow | pydicom
+DECODE_PLUGINS = os.getenv("DICOM_DECODE_PLUGINS", "pylibjpeg,gdcm,pyjpegls,pillow,pydicom")
+
+# ============ Trabajos en segundo plano ============
+# Hilos del pool local que ejecutan ingestas, segmentaciones, STL y reportes
+JOBS_WORKERS = _env_int("DICOM_JOBS_WORKERS", 2)
+# Trabajos en espera antes de responder 429
+JOBS_MAX_QUEUE = _env_int("DICOM_JOBS_MAX_QUEUE", 32)
+# Trabajos en ejecución simultánea por usuario
+JOBS_MAX_PER_USER = _env_int("DICOM_JOBS_MAX_PER_USER", 2)
+# Segundos que se conserva el estado de un trabajo terminado
+JOBS_TTL_S = _env_int("DICOM_JOBS_TTL_S", 3600)
+# Segundos que el apagado espera a que los trabajos en ejecución se cancelen
+JOBS_SHUTDOWN_TIMEOUT_S = _env_int("DICOM_JOBS_SHUTDOWN_TIMEOUT_S", 30)
+
+# ============ Cachés ============
+# Carpeta (no pública) para volúmenes cacheados y otros artefactos derivados
+CACHE_DIR = os.path.abspath(os.getenv("DICOM_CACHE_DIR", os.path.join("api", "cache")))
+# Presupuesto en bytes de la caché LRU en proceso de volúmenes cargados
+VOLUME_LRU_BYTES = _env_int("DICOM_VOLUME_LRU_BYTES", 1024 * 1024 * 1024)
+# Presupuesto en bytes de la caché LRU de cortes renderizados bajo demanda
+RENDER_CACHE_BYTES = _env_int("DICOM_RENDER_CACHE_BYTES", 128 * 1024 * 1024)
+# Nivel zlib (1-9) de los cortes int16 servidos en crudo (1 ≈ mismo tamaño que 6, ~4x más rápido)
+RAW_ZLIB_LEVEL = _env_int("DICOM_RAW_ZLIB_LEVEL", 1)
+
+# ============ Segmentación 3D ============
+# Memoria de trabajo en bytes de la segmentación 3D: por encima se procesa por bloques de cortes
+SEG_MEMORY_BYTES = _env_int("DICOM_SEG_MEMORY_BYTES", 1024 * 1024 * 1024)
+# Hilos para filtros y morfología de la segmentación 3D (bloques de cortes en paralelo)
+SEG_WORKERS = _env_int("DICOM_SEG_WORKERS", os.cpu_count() or 1)
+# Presupuesto en bytes de la caché LRU de intermedios de la segmentación 3D (0 = sin caché)
+SEG_CACHE_BYTES = _env_int("DICOM_SEG_CACHE_BYTES", 512 * 1024 * 1024)
@@ -0,0 +1,54 @@
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, RLELossless, generate_uid
+
+from api.services.decode_service import DecodeStats, decodificar_paralelo, plugin_decodificador
+
+
+def _guardar(path, arr, comprimir=True):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = CTImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID, ds.SOPInstanceUID = CTImageStorage, meta.MediaStorageSOPInstanceUID
+    ds.Modality = "CT"
+    ds.Rows, ds.Columns = arr.shape
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.PixelData = arr.tobytes()
+    if comprimir:
+        ds.compress(RLELossless, arr)
+    ds.save_as(str(path), enforce_file_format=True)
+    return str(path)
+
+
+def test_plugin_segun_sintaxis():
+    assert plugin_decodificador(str(ExplicitVRLittleEndian)) == ""
+    assert plugin_decodificador("") == ""
+    assert plugin_decodificador(str(RLELossless)) == "pydicom"
+
+
+def test_decodificar_paralelo_igual_que_secuencial(tmp_path):
+    vol = np.random.default_rng(0).integers(0, 4096, (4, 16, 16)).astype(np.uint16)
+    rutas = [_guardar(tmp_path / f"im{i}.dcm", a) for i, a in enumerate(vol)]
+    pedidos = [(r, None) for r in rutas] + [(str(tmp_path / "falta.dcm"), None)]
+
+    serie = decodificar_paralelo(pedidos, workers=1)
+    paralelo = decodificar_paralelo(pedidos, workers=2)
+
+    assert set(serie) == set(paralelo) == {(r, None) for r in rutas}
+    for r, a in zip(rutas, vol):
+        assert np.array_equal(serie[(r, None)], a)
+        assert np.array_equal(paralelo[(r, None)], a)
+
+
+def test_decode_stats_por_sintaxis():
+    stats = DecodeStats()
+    stats.registrar(str(RLELossless), "pydicom", 2, 2_000_000, 0.5)
+    stats.fusionar({str(RLELossless): {"plugin": "pydicom", "frames": 2, "bytes": 2_000_000, "seconds": 0.5}})
+
+    s = stats.stats()[str(RLELossless)]
+    assert s["name"] == "RLE Lossless" and s["frames"] == 4
+    assert s["mb_s"] == 4.0 and s["frames_s"] == 4.0
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import api.services.histogram_service as hs
+import api.services.volume_cache_service as vcs
+from api.services.histogram_service import IndiceHistograma, indice_histograma
+from api.services.segmentation3d_service import (
+    _EstadisticasHistograma,
+    _EstadisticasMemoria,
+    _segmentar_en_memoria,
+    _segmentar_por_bloques,
+)
+
+
+def _volumen(modality, seed=0):
+    """Volumen de valores enteros: HU en CT, valores almacenados positivos en MR."""
+    rng = np.random.default_rng(seed)
+    vol = np.full((20, 40, 40), -1000.0 if modality == "CT" else 20.0)
+    vol[4:16, 8:32, 8:32] = 40.0 if modality == "CT" else 300.0
+    vol[6:14, 12:26, 12:26] = 700.0 if modality == "CT" else 900.0
+    return np.round(vol + rng.normal(0, 25, vol.shape)).astype(np.float32)
+
+
+@pytest.mark.parametrize("modality", ["CT", "MR"])
+def test_estadisticas_del_indice_exactas(modality):
+    vol = _volumen(modality)
+    memoria = _EstadisticasMemoria(vol)
+    indice = _EstadisticasHistograma(IndiceHistograma.desde_volumen(vol))
+    assert indice.indice.exacto and indice.n == memoria.n
+    assert indice.rango() == memoria.rango()
+    for q in (0, 2, 40, 98, 99, 100, [40, 99], [2, 98]):
+        assert np.array_equal(indice.percentil(q), memoria.percentil(q))
+        assert np.asarray(indice.percentil(q)).dtype == np.asarray(memoria.percentil(q)).dtype
+    lo, hi = memoria.percentil([2, 98])
+    assert indice.otsu_normalizado(lo, hi) == memoria.otsu_normalizado(lo, hi)
+    for regla in (("rango", 150.0, 4000.0), ("norm", lo, hi, 0.6), ("otsu", lo, hi, 0.4)):
+        assert indice.contar_umbral(regla) == memoria.contar_umbral(regla)
+
+
+@pytest.mark.parametrize("modality", ["CT", "MR"])
+def test_segmentacion_con_indice_igual(tmp_path, modality):
+    vol = _volumen(modality, seed=1)
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200,
+                close_radius_mm=1.5, report=lambda f, e: None)
+    spacing = (1.0, 1.0, 1.0)
+    llamadas = []
+
+    def _indice(v, variante):
+        llamadas.append(variante)
+        return IndiceHistograma.desde_volumen(v)
+
+    memoria = _segmentar_en_memoria(vol, spacing, modality, **args)
+    assert memoria.any()
+    assert np.array_equal(_segmentar_en_memoria(vol, spacing, modality, **args, indice=_indice), memoria)
+    bloques = _segmentar_por_bloques(vol, spacing, modality, **args, tmp_dir=str(tmp_path),
+                                     presupuesto_bytes=1, indice=_indice)
+    assert np.array_equal(np.array(bloques), memoria)
+    assert llamadas == ["raw", "raw"]
+
+
+def test_indice_aproximado_y_persistente(monkeypatch, tmp_path):
+    monkeypatch.setattr(vcs, "CACHE_DIR", str(tmp_path))
+    vol = np.random.default_rng(2).normal(0, 1, (8, 16, 16)).astype(np.float32)
+    assert not IndiceHistograma.desde_volumen(vol).exacto
+
+    vol = _volumen("CT")
+    indice = indice_histograma("s1", "v1", vol)
+    assert (tmp_path / "volumes" / "s1" / "histogram_v1_raw.npz").is_file()
+    vcs.volume_lru.invalidate_session("s1")
+    monkeypatch.setattr(hs.IndiceHistograma, "desde_volumen", classmethod(lambda cls, v: pytest.fail("recalculado")))
+    leido = indice_histograma("s1", "v1", vol)
+    assert leido.exacto and np.array_equal(leido.cuentas, indice.cuentas)
+    assert leido.percentil(40) == indice.percentil(40)
+    vcs.volume_lru.invalidate_session("s1")
+
+
+def test_reagrupar_conserva_voxeles():
+    vol = _volumen("CT")
+    bordes, cuentas = IndiceHistograma.desde_volumen(vol).reagrupar(64)
+    assert bordes.size == 65 and cuentas.size == 64
+    assert np.array_equal(cuentas, np.histogram(vol, bins=64, range=(vol.min(), vol.max()))[0])
@@ -0,0 +1,163 @@
+import inspect
+import threading
+import time
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api.routers.dicom_router as dicom_router
+import api.routers.reportes_router as reportes_router
+import api.services.reportes_service as reportes_service
+from api.routers.jobs_router import router as jobs_router
+
+
+def _esperar(client, url, user_id):
+    for _ in range(200):
+        estado = client.get(url, headers={"X-User-Id": user_id}).json()
+        if estado["status"] in ("done", "error", "cancelled"):
+            return estado
+        time.sleep(0.02)
+    return estado
+
+
+def test_upload_async_termina(monkeypatch):
+    real = dicom_router.convert_dicom_zip_to_png_paths
+    llamadas = []
+
+    def _convertir(*args, **kwargs):
+        # Mismos parámetros que la función real (sin BD ni disco)
+        inspect.signature(real).bind(*args, **kwargs)
+        llamadas.append(kwargs)
+        kwargs["progress"](0.5, "render")
+        return {"session_id": "s1", "image_series": [], "timings_ms": {}}
+
+    monkeypatch.setattr(dicom_router, "convert_dicom_zip_to_png_paths", _convertir)
+    app = FastAPI()
+    app.include_router(dicom_router.router)
+    app.include_router(jobs_router)
+    client = TestClient(app)
+
+    r = client.post(
+        "/upload-dicom-series/?async=true",
+        files={"file": ("serie.zip", b"PK\x05\x06" + b"\x00" * 18, "application/zip")},
+        headers={"X-User-Id": "7"},
+    )
+    assert r.status_code == 202
+    estado = _esperar(client, r.json()["status_url"], "7")
+    assert estado["status"] == "done", estado
+    assert estado["result"]["image_series"]["session_id"] == "s1"
+    assert llamadas and llamadas[0]["user_id"] == 7
+
+
+def test_reporte_async_se_cancela_en_curso(monkeypatch):
+    en_consulta, seguir = threading.Event(), threading.Event()
+
+    class _Cursor:
+        def execute(self, *args):
+            # La primera consulta queda en curso hasta que se cancela el job
+            en_consulta.set()
+            seguir.wait(5)
+
+        def fetchone(self):
+            return None
+
+        def fetchall(self):
+            return []
+
+        def close(self):
+            pass
+
+    class _Conexion:
+        def cursor(self):
+            return _Cursor()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(reportes_service, "get_connection", _Conexion)
+    app = FastAPI()
+    app.include_router(reportes_router.router)
+    app.include_router(jobs_router)
+    client = TestClient(app)
+
+    r = client.post("/reportes/generar/s-cancel?async=true", headers={"X-User-Id": "7"})
+    assert r.status_code == 202
+    url = r.json()["status_url"]
+    assert en_consulta.wait(5)
+    client.delete(url, headers={"X-User-Id": "7"})
+    seguir.set()
+
+    estado = _esperar(client, url, "7")
+    assert estado["status"] == "cancelled", estado
+    assert not list(Path("api/static/reportes").glob("reporte_s-cancel_*.pdf"))
+
+
+def test_segmentacion_async_reenvia_parametros(monkeypatch):
+    real = dicom_router.segmentar_serie_3d
+    llamadas = []
+
+    def _segmentar(*args, **kwargs):
+        inspect.signature(real).bind(*args, **kwargs)
+        llamadas.append(kwargs)
+        return {"ok": True}
+
+    monkeypatch.setattr(dicom_router, "segmentar_serie_3d", _segmentar)
+    app = FastAPI()
+    app.include_router(dicom_router.router)
+    app.include_router(jobs_router)
+    client = TestClient(app)
+
+    r = client.post(
+        "/segmentar-serie-3d/?async=true",
+        data={"session_id": "s1", "closing_method": "edt", "coarse_factor": "3",
+              "close_radius_mm": "3,1,1", "open_radius_mm": "0.5"},
+        headers={"X-User-Id": "7"},
+    )
+    assert r.status_code == 202, r.text
+    estado = _esperar(client, r.json()["status_url"], "7")
+    assert estado["status"] == "done", estado
+    assert llamadas[0]["closing_method"] == "edt" and llamadas[0]["coarse_factor"] == 3
+    assert llamadas[0]["close_radius_mm"] == (3.0, 1.0, 1.0) and llamadas[0]["open_radius_mm"] == 0.5
+
+
+def test_shutdown_cancela_trabajos_en_ejecucion():
+    from api.services.jobs_service import JobManager
+
+    manager = JobManager(workers=1, max_queue=4, max_per_user=1, ttl_s=60)
+    en_marcha, limpiados = threading.Event(), []
+
+    def _largo(job):
+        en_marcha.set()
+        while True:
+            job.report(0.5, "trabajando")
+            time.sleep(0.01)
+
+    corriendo = manager.submit("ingest", 1, _largo, cleanup=lambda: limpiados.append("corriendo"))
+    en_cola = manager.submit("ingest", 1, _largo, cleanup=lambda: limpiados.append("en_cola"))
+    assert en_marcha.wait(5)
+    manager.shutdown(timeout_s=5)
+
+    assert corriendo.status == en_cola.status == "cancelled"
+    assert sorted(limpiados) == ["corriendo", "en_cola"]
+    assert not any(t.is_alive() for t in manager._threads)
+
+
+def test_stats_requiere_usuario_y_no_muestra_otros():
+    from api.services.jobs_service import job_manager
+
+    app = FastAPI()
+    app.include_router(jobs_router)
+    client = TestClient(app)
+    assert client.get("/jobs/stats").status_code == 422
+
+    seguir = threading.Event()
+    job = job_manager.submit("reporte", 99, lambda job: seguir.wait(5))
+    try:
+        propias = client.get("/jobs/stats", headers={"X-User-Id": "99"}).json()
+        ajenas = client.get("/jobs/stats", headers={"X-User-Id": "98"}).json()
+        assert sum(propias["by_status"].values()) >= 1
+        assert ajenas["by_status"] == {} and ajenas["queued"] == 0
+    finally:
+        seguir.set()
+        job_manager.cancel(job.id)
@@ -0,0 +1,97 @@
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from api.services.manifest_service import clave_corte, clave_grupo, entradas_manifest
+
+
+def _item(**secuencias):
+    item = Dataset()
+    for nombre, attrs in secuencias.items():
+        sub = Dataset()
+        for k, v in attrs.items():
+            setattr(sub, k, v)
+        setattr(item, nombre, Sequence([sub]))
+    return item
+
+
+def _enhanced_ct(n=3):
+    ds = Dataset()
+    ds.Modality = "CT"
+    ds.Rows, ds.Columns = 4, 4
+    ds.NumberOfFrames = n
+    ds.SharedFunctionalGroupsSequence = Sequence([
+        _item(
+            PixelMeasuresSequence={"PixelSpacing": [0.7, 0.7], "SliceThickness": 1.25},
+            PixelValueTransformationSequence={"RescaleSlope": 1, "RescaleIntercept": -1024},
+        )
+    ])
+    ds.PerFrameFunctionalGroupsSequence = Sequence([
+        _item(PlanePositionSequence={"ImagePositionPatient": [0.0, 0.0, 10.0 - 2.5 * f]})
+        for f in range(n)
+    ])
+    return ds
+
+
+def test_entradas_multiframe_por_frame():
+    entradas = entradas_manifest(_enhanced_ct(), "enh.dcm")
+
+    assert [e["frame"] for e in entradas] == [0, 1, 2]
+    assert [e["z"] for e in entradas] == [10.0, 7.5, 5.0]
+    assert all(e["pixel_spacing"] == [0.7, 0.7] for e in entradas)
+    assert all(e["slice_thickness"] == 1.25 for e in entradas)
+    assert all(e["intercept"] == -1024.0 for e in entradas)
+
+
+def test_entrada_un_frame_y_clave():
+    ds = Dataset()
+    ds.Modality = "MR"
+    ds.Rows, ds.Columns = 4, 4
+    ds.ImagePositionPatient = [0.0, 0.0, 3.0]
+
+    (entrada,) = entradas_manifest(ds, "mr.dcm")
+    assert entrada["frame"] is None and entrada["z"] == 3.0
+    assert clave_corte("mr.dcm") == "mr.dcm"
+    assert clave_corte("enh.dcm", 4) == "enh.dcm#4"
+
+
+def test_clave_grupo_serie_resolucion_orientacion():
+    ds = Dataset()
+    ds.SeriesInstanceUID = "1.2.3"
+    ds.Rows, ds.Columns = 4, 4
+    ds.ImageOrientationPatient = [1.0, 1e-6, 0.0, 0.0, 0.999999, -0.0]
+
+    (entrada,) = entradas_manifest(ds, "a.dcm")
+    assert entrada["orientation"] == [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    assert clave_grupo(entrada) == ("1.2.3", 4, 4, (1.0, 0.0, 0.0, 0.0, 1.0, 0.0))
+    assert clave_grupo(dict(entrada, rows=8)) != clave_grupo(entrada)
+
+
+def test_version_serie_memo_y_archivos_en_disco(monkeypatch, tmp_path):
+    import os
+    import api.services.segmentation3d_service as s3
+
+    entries = [{"dicom_name": "IM0", "frame": None, "sha1": "a"}]
+    (tmp_path / "IM0").write_bytes(b"0" * 10)
+    (tmp_path / "manifest.json").write_text("[]")
+    lecturas = []
+
+    def seleccionar(sid):
+        lecturas.append(sid)
+        return entries, (1.0, 1.0, 1.0), entries[0]
+
+    monkeypatch.setattr(s3, "_serie_dir", lambda sid: str(tmp_path))
+    monkeypatch.setattr(s3, "_seleccionar_cortes", seleccionar)
+    monkeypatch.setattr(s3, "_versiones", {})
+
+    v1 = s3._version_serie("s")
+    assert s3._version_serie("s") == v1
+    assert len(lecturas) == 1  # memoizado mientras no cambie el manifest
+
+    # DICOM reemplazado sin reescribir el manifest: cambia la versión
+    (tmp_path / "IM0").write_bytes(b"1" * 12)
+    v2 = s3._version_serie("s")
+    assert v2 != v1
+
+    st = os.stat(tmp_path / "manifest.json")
+    os.utime(tmp_path / "manifest.json", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert s3._version_serie("s") == v2
+    assert len(lecturas) == 3
@@ -0,0 +1,45 @@
+import numpy as np
+from skimage import measure
+from api.services.mask3d_service import (
+    cargar_mascara_3d,
+    expandir_mascara,
+    guardar_mascara_3d,
+    marching_cubes_recortado,
+)
+
+
+def _mascara_prueba():
+    mask = np.zeros((12, 20, 24), dtype=bool)
+    mask[3:9, 5:15, 0:10] = True  # toca el borde en X
+    mask[5, 8, 4] = False
+    return mask
+
+
+def test_mascara_roundtrip(tmp_path):
+    mask = _mascara_prueba()
+    path = str(tmp_path / "m.npz")
+
+    geom = guardar_mascara_3d(path, mask, (2.0, 0.5, 0.5))
+    info = cargar_mascara_3d(path)
+
+    assert geom["origin"] == (3, 5, 0)
+    assert info["crop"].shape == (6, 10, 10)
+    assert info["spacing"] == (2.0, 0.5, 0.5)
+    assert np.array_equal(expandir_mascara(info), mask)
+
+
+def test_marching_cubes_recortado_igual_al_completo(tmp_path):
+    mask = _mascara_prueba()
+    path = str(tmp_path / "m.npz")
+    guardar_mascara_3d(path, mask, (2.0, 0.5, 0.5))
+    info = cargar_mascara_3d(path)
+    spacing = (0.5, 0.5, 2.0)
+
+    v1, f1, _, _ = measure.marching_cubes(mask.astype(np.uint8), level=0.5, spacing=spacing)
+    v2, f2, _, _ = marching_cubes_recortado(
+        info["crop"], info["origin"], info["full_shape"], spacing
+    )
+
+    tri1 = np.sort(np.round(v1[f1], 5).reshape(len(f1), -1), axis=0)
+    tri2 = np.sort(np.round(v2[f2], 5).reshape(len(f2), -1), axis=0)
+    assert np.allclose(tri1, tri2)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from skimage.morphology import ball, binary_closing, binary_opening, disk
+
+from api.services.morphology_service import alcance_cortes, apertura_edt, cierre_edt
+
+
+def _aleatoria(shape=(16, 24, 24), seed=0):
+    return np.random.default_rng(seed).random(shape) > 0.8
+
+
+@pytest.mark.parametrize("r", [1, 2, 3])
+def test_isotropo_igual_que_ball(r):
+    m = _aleatoria()
+    assert np.array_equal(cierre_edt(m, r, (1.0, 1.0, 1.0)), binary_closing(m, footprint=ball(r)))
+    assert np.array_equal(apertura_edt(m, r, (1.0, 1.0, 1.0)), binary_opening(m, footprint=ball(r)))
+
+
+def test_anisotropo_respeta_spacing():
+    # Cortes de 5 mm y radio 3 mm: el cierre no cruza cortes (disco en cada plano)
+    m = _aleatoria(seed=1)
+    assert alcance_cortes(3.0, (5.0, 1.0, 1.0)) == 0
+    assert np.array_equal(cierre_edt(m, 3.0, (5.0, 1.0, 1.0)), binary_closing(m, footprint=disk(3)[None]))
+    # Radio por eje en mm (rz, ry, rx): en mm de cada eje equivale al elipsoide en voxeles
+    assert np.array_equal(cierre_edt(m, (2.0, 6.0, 6.0), (1.0, 3.0, 3.0)), cierre_edt(m, 2.0, (1.0, 1.0, 1.0)))
+
+
+def test_casos_limite():
+    vacia = np.zeros((4, 5, 5), dtype=bool)
+    llena = np.ones((4, 5, 5), dtype=bool)
+    assert not cierre_edt(vacia, 2.0, (1.0, 1.0, 1.0)).any()
+    assert cierre_edt(llena, 2.0, (1.0, 1.0, 1.0)).all()
+    with pytest.raises(ValueError):
+        cierre_edt(llena, 0.0, (1.0, 1.0, 1.0))
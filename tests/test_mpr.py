@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from api.services.mpr_service import reslice
+
+
+def _volumen():
+    return np.random.default_rng(0).normal(size=(20, 30, 40)).astype(np.float32)
+
+
+def test_planos_ortogonales_sobre_la_rejilla():
+    vol = _volumen()
+    spacing = (2.0, 1.0, 1.0)
+
+    axial, px = reslice(vol, spacing, "axial", offset_mm=-19.0 + 10.0, pixel_mm=1.0)
+    assert px == 1.0
+    assert np.allclose(axial, vol[5], atol=1e-5)
+
+    # Sagital: filas de Z mayor a menor, interpoladas a 1 mm (dz = 2 mm)
+    sagital, _ = reslice(vol, spacing, "sagittal", offset_mm=-19.5 + 7.0, pixel_mm=1.0)
+    assert sagital.shape == (39, 30)
+    assert np.allclose(sagital[::2], vol[::-1, :, 7], atol=1e-5)
+    assert np.allclose(sagital[1], (vol[-1, :, 7] + vol[-2, :, 7]) / 2, atol=1e-5)
+
+
+def test_slab_mip_y_oblicuo():
+    vol = _volumen()
+    spacing = (2.0, 1.0, 1.0)
+
+    mip, _ = reslice(vol, spacing, "coronal", offset_mm=-14.5 + 3.0, thickness_mm=2.0,
+                     mode="mip", pixel_mm=1.0)
+    assert np.allclose(mip[::2], vol[::-1, 2:5, :].max(axis=1), atol=1e-5)
+
+    oblicuo, _ = reslice(vol, spacing, "oblique", normal_zyx=(0, 0, 1), pixel_mm=1.0)
+    sagital, _ = reslice(vol, spacing, "sagittal", pixel_mm=1.0)
+    assert np.allclose(oblicuo, sagital, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        reslice(vol, spacing, "oblique", normal_zyx=(0, 0, 0))
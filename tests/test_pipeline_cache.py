@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+import api.services.pipeline_cache_service as pcs
+from api.services.pipeline_cache_service import CacheEtapas, estadisticas
+from api.services.segmentation3d_service import _segmentar_en_memoria
+from api.services.volume_cache_service import VolumeLRUCache
+
+
+@pytest.fixture(autouse=True)
+def _desbordados_en_tmp(monkeypatch, tmp_path):
+    monkeypatch.setattr(pcs, "_dir_desbordados", lambda sid: str(tmp_path / sid / "intermediates"))
+
+
+def _volumen(seed=0):
+    rng = np.random.default_rng(seed)
+    vol = np.full((20, 32, 32), -1000.0, dtype=np.float32)
+    vol[3:17, 6:26, 6:26] = 40.0
+    vol[5:15, 10:22, 10:22] = 800.0
+    vol[6:14, 14:18, 14:18] = 40.0
+    return vol + rng.normal(0, 20, vol.shape).astype(np.float32)
+
+
+def _segmentar(vol, cache, **kw):
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200,
+                close_radius_mm=1.5, report=lambda f, e: None, mediana=True)
+    args.update(kw)
+    return _segmentar_en_memoria(vol, (1.0, 1.0, 1.0), "CT", **args, cache=cache)
+
+
+def _contadores():
+    return {k: (v["hits"], v["misses"]) for k, v in estadisticas()["stages"].items()}
+
+
+def test_solo_recalcula_aguas_abajo():
+    vol = _volumen()
+    lru = VolumeLRUCache(64 * 1024 * 1024)
+    raiz = CacheEtapas.para_volumen("s1", "v1", lru=lru)
+    primera = _segmentar(vol, raiz)
+    assert np.array_equal(primera, _segmentar(vol, None))
+
+    antes = _contadores()
+    segunda = _segmentar(vol, raiz, min_size_voxels=50)
+    despues = _contadores()
+    delta = {k: (despues[k][0] - antes.get(k, (0, 0))[0], despues[k][1] - antes.get(k, (0, 0))[1]) for k in despues}
+    for etapa in ("mediana", "estadisticas", "umbral", "cierre", "relleno"):
+        assert delta[etapa] == (1, 0), etapa
+    for etapa in ("pequenos", "principal"):
+        assert delta[etapa] == (0, 1), etapa
+    assert np.array_equal(segunda, _segmentar(vol, None, min_size_voxels=50))
+
+    # Mismos parámetros: todo de la caché, mismo resultado
+    assert np.array_equal(_segmentar(vol, raiz), primera)
+    assert lru.stats()["hits"] > 0
+
+
+def test_invalidacion_y_desalojo():
+    lru = VolumeLRUCache(64 * 1024 * 1024)
+    vol = _volumen(1)
+    _segmentar(vol, CacheEtapas.para_volumen("s2", "v1", lru=lru))
+    assert lru.stats()["entries"] > 0
+    # La serie cambió: los intermedios de la versión anterior se descartan
+    CacheEtapas.para_volumen("s2", "v2", lru=lru)
+    assert lru.stats()["entries"] == 0
+
+    pequena = VolumeLRUCache(3 * vol.size)
+    _segmentar(vol, CacheEtapas.para_volumen("s3", "v1", lru=pequena))
+    assert pequena.stats()["evictions"] > 0
+    assert pequena.stats()["bytes"] <= pequena.max_bytes
+
+
+def test_intermedios_grandes_a_disco(tmp_path):
+    vol = _volumen(2)
+    lru = VolumeLRUCache(2 * vol.size)  # cabe una máscara, no el volumen filtrado (float32)
+    raiz = CacheEtapas.para_volumen("s4", "v1", lru=lru)
+    antes = estadisticas()
+    primera = _segmentar(vol, raiz)
+    medio = estadisticas()
+    assert lru.stats()["too_large"] > 0 and medio["spilled"] > antes["spilled"]
+    assert list((tmp_path / "s4" / "intermediates").glob("*.npy"))
+
+    # Segunda ejecución: la mediana sale del disco, no se recalcula
+    assert np.array_equal(_segmentar(vol, raiz), primera)
+    despues = estadisticas()
+    assert despues["disk_hits"] > medio["disk_hits"]
+    assert despues["stages"]["mediana"]["misses"] == medio["stages"]["mediana"]["misses"]
+
+    # La versión cambió: se borran también los intermedios en disco
+    CacheEtapas.para_volumen("s4", "v2", lru=lru)
+    assert not (tmp_path / "s4" / "intermediates").exists()
+
+
+def test_memo_de_estadisticas_inmutable_con_tamano():
+    vol = _volumen(3)
+    lru = VolumeLRUCache(64 * 1024 * 1024)
+    raiz = CacheEtapas.para_volumen("s5", "v1", lru=lru)
+    _segmentar(vol, raiz)
+    memo = lru.get(("s5", raiz.hijo("mediana").hijo("estadisticas").clave))
+    assert isinstance(memo, tuple) and memo
+    assert sum(size for _, size in lru._items.values()) == lru.stats()["bytes"]
+    assert lru._items[("s5", raiz.hijo("mediana").hijo("estadisticas").clave)][1] > 0
+
+
+def test_lru_carga_concurrente_una_vez_aunque_no_quepa():
+    import threading
+    import time
+
+    lru = VolumeLRUCache(1024)  # el valor (8 KB) no cabe: no se guarda
+    cargas, resultados = [], []
+    empezar = threading.Barrier(8)
+
+    def _cargar():
+        cargas.append(1)
+        time.sleep(0.1)
+        return np.zeros(1024, dtype=np.float64)
+
+    def _pedir():
+        empezar.wait()
+        resultados.append(lru.get_or_load(("s1", "grande"), _cargar))
+
+    hilos = [threading.Thread(target=_pedir) for _ in range(8)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    assert len(cargas) == 1 and len(resultados) == 8
+    assert all(r is resultados[0] for r in resultados) and not resultados[0].flags.writeable
+    assert lru.stats()["entries"] == 0 and not lru._cargas
@@ -0,0 +1,49 @@
+import io
+import zipfile
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+from api.services.dicom_service import agrupar_por_serie, es_dicom, preescanear_zip
+
+
+def _dicom(series_uid, modality="CT", size=8, part10=True) -> bytes:
+    ds = Dataset()
+    ds.SOPClassUID, ds.SOPInstanceUID = CTImageStorage, generate_uid()
+    ds.SeriesInstanceUID, ds.Modality = series_uid, modality
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+    ds.PixelData = np.zeros((size, size), np.uint16).tobytes()
+    buf = io.BytesIO()
+    if part10:
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.save_as(buf, enforce_file_format=True)
+    else:
+        ds.save_as(buf, implicit_vr=True, little_endian=True)
+    return buf.getvalue()
+
+
+def test_preescaneo_por_preambulo_y_agrupacion_por_serie():
+    a, b = generate_uid(), generate_uid()
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("A/", "")
+        zf.writestr("A/IM1", _dicom(a))
+        zf.writestr("B/IM1.dcm", _dicom(b, "MR"))
+        zf.writestr("A/IM2", _dicom(a))
+        zf.writestr("B/raw.dcm", _dicom(b, "MR", part10=False))
+        zf.writestr("LEEME.txt", "no es DICOM")
+
+    with zipfile.ZipFile(buf) as archive:
+        assert es_dicom(archive.read("A/IM1")) and not es_dicom(archive.read("B/raw.dcm"))
+        cabeceras = preescanear_zip(archive)
+
+    assert [c["name"] for c in cabeceras] == ["A/IM1", "B/IM1.dcm", "A/IM2", "B/raw.dcm"]
+    grupos = agrupar_por_serie(cabeceras)
+    assert [[c["name"] for c in g] for g in grupos] == [["A/IM1", "A/IM2"], ["B/IM1.dcm", "B/raw.dcm"]]
+    assert grupos[1][0]["modality"] == "MR" and grupos[0][0]["frames"] == 1
@@ -0,0 +1,38 @@
+import pytest
+from unittest.mock import patch
+from api.services.segmentation_services import registrar_archivos_dicom_bulk
+
+
+# Reutiliza los existentes e inserta sólo los nuevos, todo en un commit
+@patch('api.services.segmentation_services.execute_values')
+@patch('api.services.segmentation_services.get_connection')
+def test_registro_bulk_una_transaccion(mock_conn, mock_execute_values):
+    mock_cursor = mock_conn.return_value.cursor.return_value
+    mock_cursor.fetchall.return_value = [(10, 'a.dcm', 'serie/a.dcm')]
+    mock_execute_values.return_value = [(11, 'serie/b.dcm'), (12, 'serie/c.dcm')]
+
+    ids = registrar_archivos_dicom_bulk(
+        [('a.dcm', 'serie/a.dcm'), ('b.dcm', 'serie/b.dcm'), ('c.dcm', 'serie/c.dcm')],
+        user_id=1,
+    )
+
+    assert ids == {'serie/a.dcm': 10, 'serie/b.dcm': 11, 'serie/c.dcm': 12}
+    filas = mock_execute_values.call_args[0][2]
+    assert [f[2] for f in filas] == ['b.dcm', 'c.dcm']
+    mock_conn.return_value.commit.assert_called_once()
+    mock_conn.return_value.rollback.assert_not_called()
+
+
+# Un fallo en el INSERT deshace toda la serie
+@patch('api.services.segmentation_services.execute_values', side_effect=RuntimeError('fallo'))
+@patch('api.services.segmentation_services.get_connection')
+def test_registro_bulk_rollback(mock_conn, mock_execute_values):
+    mock_cursor = mock_conn.return_value.cursor.return_value
+    mock_cursor.fetchall.return_value = []
+
+    with pytest.raises(RuntimeError):
+        registrar_archivos_dicom_bulk([('a.dcm', 'serie/a.dcm')], user_id=1)
+
+    mock_conn.return_value.rollback.assert_called_once()
+    mock_conn.return_value.commit.assert_not_called()
+    mock_conn.return_value.close.assert_called_once()
@@ -0,0 +1,249 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from api.services.blockwise_service import percentil
+from api.services.segmentation3d_service import _cierre, _segmentar_en_memoria, _segmentar_por_bloques
+
+
+def _fantoma(shape, seed=0):
+    """CT sintético (HU): cuerpo blando, dos huesos (uno hueco), un objeto pequeño y ruido."""
+    rng = np.random.default_rng(seed)
+    zz, yy, xx = np.indices(shape)
+    nz, ny, nx = shape
+    vol = np.full(shape, -1000.0)
+    vol[np.hypot(yy - ny / 2, xx - nx / 2) < ny * 0.4] = 40.0
+    hueso = np.hypot(yy - ny / 2, xx - nx * 0.35) < ny * 0.12
+    vol[hueso & (zz > 2) & (zz < nz - 3)] = 700.0
+    vol[(np.hypot(yy - ny / 2, xx - nx * 0.35) < ny * 0.05) & (zz > 4) & (zz < nz - 5)] = 40.0
+    vol[nz // 2:nz // 2 + 3, ny // 4:ny // 4 + 3, nx // 2:nx // 2 + 3] = 800.0  # objeto pequeño
+    vol[(np.hypot(yy - ny / 2, xx - nx * 0.7) < ny * 0.06) & (zz > nz // 2)] = 900.0
+    return (vol + rng.normal(0, 30, shape)).astype(np.float32)
+
+
+def _ambos(vol, modality, tmp_path, **kw):
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200,
+                close_radius_mm=1.5, report=lambda f, e: None)
+    args.update(kw)
+    spacing = (1.0, 1.0, 1.0)
+    memoria = _segmentar_en_memoria(vol, spacing, modality, **args)
+    # Presupuesto mínimo: un corte útil por bloque
+    bloques = np.array(_segmentar_por_bloques(vol, spacing, modality, **args,
+                                              tmp_dir=str(tmp_path), presupuesto_bytes=1))
+    return memoria, bloques
+
+
+@pytest.mark.parametrize("modality,kw", [
+    ("CT", {}),
+    ("CT", {"preset": "ct_bone"}),
+    ("CT", {"thr_min": 300.0}),
+    ("MR", {}),
+])
+def test_bloques_igual_que_memoria(tmp_path, modality, kw):
+    memoria, bloques = _ambos(_fantoma((24, 40, 40)), modality, tmp_path, **kw)
+    assert memoria.any()
+    assert np.array_equal(memoria, bloques)
+
+
+def test_bloques_con_mediana(tmp_path):
+    # > 2M voxeles: en ambos modos se aplica el filtro de mediana (halo de 1 corte)
+    memoria, bloques = _ambos(_fantoma((36, 240, 240)), "CT", tmp_path, close_radius_mm=2.0)
+    assert memoria.any()
+    assert np.array_equal(memoria, bloques)
+
+
+def test_percentil_por_bloques_exacto():
+    v = np.random.default_rng(1).normal(0, 500, 10_001).astype(np.float32)
+    trozos = lambda: (v[i:i + 777] for i in range(0, v.size, 777))
+    for q in (0, 2, 40, 98.5, 100, [2, 98]):
+        assert np.array_equal(percentil(trozos, q, v.dtype), np.percentile(v, q))
+
+
+@pytest.mark.parametrize("modality", ["CT", "MR"])
+def test_hilos_igual_que_secuencial(tmp_path, modality):
+    vol = _fantoma((24, 40, 40), seed=2)
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200,
+                close_radius_mm=1.5, report=lambda f, e: None)
+    spacing = (1.0, 1.0, 1.0)
+    secuencial = _segmentar_en_memoria(vol, spacing, modality, **args)
+    for workers in (2, 5):
+        assert np.array_equal(_segmentar_en_memoria(vol, spacing, modality, **args, workers=workers), secuencial)
+        bloques = _segmentar_por_bloques(vol, spacing, modality, **args, tmp_dir=str(tmp_path),
+                                         presupuesto_bytes=1, workers=workers)
+        assert np.array_equal(np.array(bloques), secuencial)
+
+
+def test_cierre_edt_por_bloques(tmp_path):
+    vol = _fantoma((24, 40, 40), seed=3)
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200,
+                close_radius_mm=4.0, report=lambda f, e: None, closing_method="edt")
+    spacing = (2.5, 0.8, 0.8)
+    memoria = _segmentar_en_memoria(vol, spacing, "CT", **args)
+    assert memoria.any()
+    assert np.array_equal(_segmentar_en_memoria(vol, spacing, "CT", **args, workers=3), memoria)
+    bloques = _segmentar_por_bloques(vol, spacing, "CT", **args, tmp_dir=str(tmp_path), presupuesto_bytes=1)
+    assert np.array_equal(np.array(bloques), memoria)
+
+
+@pytest.mark.parametrize("radio", [0.0, -1.0])
+def test_cierre_edt_radio_minimo_un_voxel(radio):
+    # Como ball (r_vox >= 1), un radio <= 0 no falla: se cierra con un voxel
+    mask = np.zeros((5, 9, 9), dtype=bool)
+    mask[1:4, 2:7, 2:4] = mask[1:4, 2:7, 5:7] = True
+    cerrar, halo = _cierre(radio, (1.0, 1.0, 1.0), "edt")
+    cerrada = cerrar(mask)
+    assert cerrada[2, 4, 4] and halo == 2
+    assert np.array_equal(cerrada, _cierre(radio, (1.0, 1.0, 1.0), "ball")[0](mask))
+
+
+def test_cierre_edt_radio_por_eje_y_apertura():
+    from api.services.morphology_service import apertura_edt, cierre_edt
+
+    rng = np.random.default_rng(4)
+    mask = rng.random((8, 24, 24)) > 0.6
+    spacing = (5.0, 0.5, 0.5)
+    # Cortes gruesos: el mínimo de un voxel es por eje (no infla el radio en el plano)
+    assert np.array_equal(_cierre(1.0, spacing, "edt")[0](mask), cierre_edt(mask, (5.0, 1.0, 1.0), spacing))
+    assert np.array_equal(_cierre((6.0, 1.5, 2.0), spacing, "edt")[0](mask),
+                          cierre_edt(mask, (6.0, 1.5, 2.0), spacing))
+    abrir_cerrar, halo = _cierre((6.0, 1.5, 2.0), spacing, "edt", open_radius_mm=1.0)
+    esperado = cierre_edt(apertura_edt(mask, (5.0, 1.0, 1.0), spacing), (6.0, 1.5, 2.0), spacing)
+    assert np.array_equal(abrir_cerrar(mask), esperado) and halo == 2 + 2
+    with pytest.raises(ValueError):
+        _cierre((6.0, 1.5, 2.0), spacing, "ball")
+
+
+def test_apertura_y_radio_por_eje_por_bloques(tmp_path):
+    vol = _fantoma((24, 40, 40), seed=5)
+    args = dict(preset=None, thr_min=None, thr_max=None, min_size_voxels=200, close_radius_mm=(5.0, 2.0, 3.0),
+                report=lambda f, e: None, closing_method="edt", open_radius_mm=(0.0, 1.0, 1.0))
+    spacing = (2.5, 0.8, 0.8)
+    memoria = _segmentar_en_memoria(vol, spacing, "CT", **args)
+    assert memoria.any()
+    assert not np.array_equal(memoria, _segmentar_en_memoria(vol, spacing, "CT", **{**args, "open_radius_mm": 0.0}))
+    assert np.array_equal(_segmentar_en_memoria(vol, spacing, "CT", **args, workers=3), memoria)
+    bloques = _segmentar_por_bloques(vol, spacing, "CT", **args, tmp_dir=str(tmp_path), presupuesto_bytes=1)
+    assert np.array_equal(np.array(bloques), memoria)
+
+
+def _segmentar(monkeypatch, tmp_path, vol, spacing, modality, **kw):
+    """segmentar_serie_3d sin BD ni disco: devuelve (máscara, resultado)."""
+    import api.services.segmentation3d_service as s3
+    import api.services.volume_cache_service as vcs
+    capturada = {}
+
+    def _guardar(session_id, user_id, mask, spacing, modality, report):
+        capturada["mask"] = np.array(mask)
+        return {}
+
+    monkeypatch.setattr(s3, "_load_stack", lambda sid: (vol, spacing, modality))
+    monkeypatch.setattr(s3, "_version_serie", lambda sid: hashlib.sha1(vol.tobytes()).hexdigest())
+    monkeypatch.setattr(s3, "_seg3d_dir", lambda sid: str(tmp_path / "seg"))
+    monkeypatch.setattr(s3, "_guardar_resultado", _guardar)
+    monkeypatch.setattr(s3, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(vcs, "CACHE_DIR", str(tmp_path))
+    resultado = s3.segmentar_serie_3d("sid", user_id=1, min_size_voxels=200, workers=1, **kw)
+    return capturada["mask"], resultado
+
+
+@pytest.mark.parametrize("modality,kw", [("CT", {}), ("CT", {"preset": "ct_bone"}), ("MR", {})])
+def test_coarse_to_fine_dentro_de_tolerancia(monkeypatch, tmp_path, modality, kw):
+    # Objeto en una esquina del campo de visión
+    vol = np.full((40, 96, 96), -1000.0, dtype=np.float32)
+    vol[:, 10:60, 8:58] = _fantoma((40, 50, 50), seed=4)
+    spacing = (1.0, 0.8, 0.8)
+    completa, r1 = _segmentar(monkeypatch, tmp_path, vol, spacing, modality, **kw)
+    roi, r2 = _segmentar(monkeypatch, tmp_path, vol, spacing, modality, coarse_factor=4, **kw)
+
+    assert r1["coarse_to_fine"] is None
+    assert r2["coarse_to_fine"]["roi_fraction"] < 1.0
+    assert completa.sum() > 0
+    assert abs(int(roi.sum()) - int(completa.sum())) <= 0.01 * completa.sum()
+    dice = 2 * np.count_nonzero(roi & completa) / (roi.sum() + completa.sum())
+    assert dice > 0.99
+
+
+def test_multi_etiqueta_igual_que_por_preset(monkeypatch, tmp_path):
+    import api.services.segmentation3d_service as s3
+    vol = _fantoma((24, 40, 40), seed=5)
+    spacing = (1.0, 1.0, 1.0)
+    etiquetas = s3.etiquetas_multi("ct_bone,ct_head,ct_soft,hueso_denso:800.5:4000")
+    args = dict(min_size_voxels=200, close_radius_mm=1.5, report=lambda f, e: None)
+    for workers in (1, 3):
+        memoria = dict(s3._multi_en_memoria(vol, spacing, etiquetas, **args, workers=workers))
+        bloques = {k: np.array(m) for k, m in s3._multi_por_bloques(
+            vol, spacing, etiquetas, **args, tmp_dir=str(tmp_path), presupuesto_bytes=1, workers=workers)}
+        for k, (nombre, tmin, tmax) in enumerate(etiquetas):
+            esperada = _segmentar_en_memoria(vol, spacing, "CT", None, None, None, regla=("rango", tmin, tmax),
+                                             mediana=False, **args)
+            assert np.array_equal(memoria[k], esperada), nombre
+            assert np.array_equal(bloques[k], esperada), nombre
+    assert memoria[0].any() and memoria[2].any()
+
+
+@pytest.mark.parametrize("texto", ["", "ct_bone,ct_bone", "grasa:-30:-190", "grasa:-190", "ct_nada"])
+def test_etiquetas_invalidas(texto):
+    from api.services.segmentation3d_service import etiquetas_multi
+    with pytest.raises(ValueError):
+        etiquetas_multi(texto)
+
+
+def test_region_desde_semilla(monkeypatch, tmp_path):
+    import api.services.segmentation3d_service as s3
+    vol = _fantoma((24, 40, 40), seed=6)
+    spacing = (2.0, 1.0, 1.0)
+    capturada = {}
+
+    def _guardar(session_id, user_id, mask, spacing, modality, report):
+        capturada["mask"] = np.array(mask)
+        return {}
+
+    monkeypatch.setattr(s3, "_load_stack", lambda sid: (vol, spacing, "CT"))
+    monkeypatch.setattr(s3, "_seg3d_dir", lambda sid: str(tmp_path / "seg"))
+    monkeypatch.setattr(s3, "_guardar_resultado", _guardar)
+
+    # Semilla en la pared del hueso hueco (x ≈ 0.35·nx): no alcanza al de la derecha
+    semilla = (17, 20, 12)  # (x, y, z)
+    r = s3.segmentar_region_3d("sid", 1, semilla, thr_min=250.0, connectivity=3)
+    hueso = capturada["mask"]
+    assert hueso[12, 20, 17] and hueso[12, 20, 14] and not hueso[:, :, 24:].any()
+    esperada = s3.flood(vol >= 250.0, (12, 20, 17), connectivity=3)
+    assert np.array_equal(hueso, s3.binary_fill_holes(esperada))
+    assert r["range"] == [250.0, None]
+
+    # Caja de 5 mm: el crecimiento no sale de ella
+    r = s3.segmentar_region_3d("sid", 1, semilla, tolerance=200.0, roi_mm=5.0)
+    assert r["roi"] == [[9, 16], [15, 26], [12, 23]]
+    fuera = capturada["mask"].copy()
+    fuera[9:16, 15:26, 12:23] = False
+    assert capturada["mask"].any() and not fuera.any()
+
+    with pytest.raises(ValueError):
+        s3.segmentar_region_3d("sid", 1, semilla, thr_max=0.0)
+    with pytest.raises(ValueError):
+        s3.segmentar_region_3d("sid", 1, (40, 0, 0), tolerance=10.0)
+
+
+@pytest.mark.parametrize("form", [
+    {"seed": "nan,0,0"},
+    {"seed": "inf,0,0"},
+    {"seed": "1.5,0,0"},
+    {"seed": "1,2"},
+    {"seed": "1,2,3", "roi_mm": "inf"},
+    {"seed": "1,2,3", "roi_mm": "0,5,5"},
+    {"seed": "1,2,3", "close_radius_mm": "-1"},
+    {"seed": "1,2,3", "close_radius_mm": "1,2"},
+    {"seed": "1,2,3", "close_radius_mm": "3,1,1"},
+    {"seed": "1,2,3", "open_radius_mm": "nan"},
+])
+def test_region_endpoint_rechaza_parametros(form):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from api.routers.dicom_router import router
+
+    app = FastAPI()
+    app.include_router(router)
+    r = TestClient(app).post("/segmentar-region-3d/", data={"session_id": "s", "tolerance": "10", **form},
+                             headers={"X-User-Id": "1"})
+    assert r.status_code == 400
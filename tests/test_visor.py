@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from api.services.preview_service import lista_encodings, negociar_encoding
+from api.services.visor_service import (
+    _escala_int16,
+    etag_coincide,
+    parsear_nombre_corte,
+    validar_parametros,
+)
+
+
+def test_parsear_nombre_corte():
+    assert parsear_nombre_corte("image_12.png") == (12, "png")
+    assert parsear_nombre_corte("7.PNG") == (7, "png")
+    assert parsear_nombre_corte("3") == (3, None)
+    with pytest.raises(ValueError):
+        parsear_nombre_corte("mapping.json")
+
+
+def test_etag_coincide():
+    etag = '"abc"'
+    assert etag_coincide('"abc"', etag)
+    assert etag_coincide('"x", W/"abc"', etag)
+    assert etag_coincide("*", etag)
+    assert not etag_coincide('"abd"', etag)
+    assert not etag_coincide(None, etag)
+
+
+def test_validar_parametros():
+    validar_parametros(40.0, 400.0, None, 256, "png")
+    for args in [(40.0, None, None, None, "png"), (40.0, 0.0, None, None, "png"),
+                 (None, None, "ct_foo", None, "png"), (None, None, None, 8, "png"),
+                 (None, None, None, None, "gif")]:
+        with pytest.raises(ValueError):
+            validar_parametros(*args)
+
+
+def test_negociar_encoding():
+    navegador = "image/avif,image/webp,image/apng,image/*,*/*;q=0.8"
+    assert negociar_encoding(navegador) == "webp"
+    assert negociar_encoding("image/jpeg") == "jpeg"
+    assert negociar_encoding("*/*") == "png"
+    assert negociar_encoding(None) == "png"
+    assert negociar_encoding("image/webp;q=0.5, image/png") == "png"
+    assert negociar_encoding(navegador, disponibles=("jpeg", "png")) == "png"
+
+
+def test_lista_encodings():
+    assert lista_encodings("webp,png") == ("webp", "png")
+    assert lista_encodings("jpg") == ("jpeg",)  # PNG bajo demanda, no en la ingesta
+    assert lista_encodings("") == ("png",)
+    with pytest.raises(ValueError):
+        lista_encodings("gif")
+
+
+@pytest.mark.parametrize("valores", [[-1024.0, 3000.0], [0.0, 65535.0], [0.25, 1.0e6]])
+def test_escala_int16_reversible(valores):
+    vol = np.array(valores, dtype=np.float32).reshape(1, 1, -1)
+    offset, factor = _escala_int16(vol)
+    crudo = np.clip(np.rint((vol - offset) / factor), -32768, 32767)
+    assert np.allclose(crudo * factor + offset, vol, atol=factor / 2 + 1e-6)
+
+
+def test_rango_pedido():
+    from api.routers.visor_router import _rango_pedido
+
+    assert _rango_pedido(None, 100) is None
+    assert _rango_pedido("bytes=0-7", 100) == (0, 7)
+    assert _rango_pedido("bytes=90-", 100) == (90, 99)
+    assert _rango_pedido("bytes=-10", 100) == (90, 99)
+    assert _rango_pedido("bytes=50-500", 100) == (50, 99)
+    assert _rango_pedido("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        _rango_pedido("bytes=100-", 100)
+
+
+def test_render_desde_volumen_mr_usa_rescale(monkeypatch):
+    import api.services.visor_service as vs
+    vol = np.arange(2 * 4 * 4, dtype=np.float32).reshape(2, 4, 4)
+    entries = [{"dicom_name": f"IM{z}", "frame": None, "slope": 2.0, "intercept": 10.0 * z} for z in range(2)]
+    monkeypatch.setattr(vs, "_load_volume", lambda sid: (vol, (1.0, 1.0, 1.0), "MR", ["IM0", "IM1"]))
+    monkeypatch.setattr(vs, "_cortes_versionados", lambda sid: (entries, (1.0, 1.0, 1.0), entries[0], "v1"))
+    monkeypatch.setattr(vs, "_cargar_mapping", lambda sid: {"image_1.png": {"dicom_name": "IM1"}})
+
+    assert vs._corte_desde_volumen("s", "IM1")[2:] == (2.0, 10.0)
+    # wl/ww en unidades reescaladas: igual que el corte decodificado del DICOM
+    esperado = vs._codificar(vol[1], "MR", 2.0, 10.0, 60.0, 40.0, None, None, "png", None)
+    assert vs._render("s", 1, 60.0, 40.0, None, None, "png", None) == esperado
+    assert vs._render("s", 1, 60.0, 40.0, None, None, "png", None) != vs._codificar(
+        vol[1], "MR", 1.0, 0.0, 60.0, 40.0, None, None, "png", None)
+
+
+def test_bundle_304_sin_construir_y_range_desde_disco(monkeypatch, tmp_path):
+    import struct
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    import api.services.visor_service as vs
+    from api.routers.visor_router import router
+
+    previews = {}
+    for idx in range(3):
+        previews[idx] = tmp_path / f"image_{idx}.webp"
+        previews[idx].write_bytes(bytes([idx]) * (10 + idx))
+    leidas = []
+
+    def _preview(sid, idx, *args):
+        leidas.append(idx)
+        return str(previews[idx]), "webp"
+
+    mapping = {f"image_{i}.png": {"encodings": ["webp"]} for i in range(3)}
+    monkeypatch.setattr(vs, "_cargar_mapping", lambda sid: mapping)
+    monkeypatch.setattr(vs, "_version_serie", lambda sid: "v1")
+    monkeypatch.setattr(vs, "_preview_de_ingesta", _preview)
+    monkeypatch.setattr(vs, "_volume_cache_dir", lambda sid: str(tmp_path / "cache" / sid))
+    vs.render_lru.invalidate_session("sb")
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+
+    r = client.get("/series/sb/bundle")
+    assert r.status_code == 200 and leidas == [0, 1, 2]
+    n = struct.unpack("<I", r.content[4:8])[0]
+    assert r.content[:4] == b"DPB1" and r.content.endswith(b"\x00" * 10 + b"\x01" * 11 + b"\x02" * 12)
+    etag = r.headers["ETag"]
+
+    assert client.get("/series/sb/bundle", headers={"If-None-Match": etag}).status_code == 304
+    vs.render_lru.invalidate_session("sb")
+    assert client.get("/series/sb/bundle", headers={"If-None-Match": etag}).status_code == 304
+    parcial = client.get("/series/sb/bundle", headers={"Range": f"bytes={8 + n + 10}-{8 + n + 20}"})
+    assert parcial.status_code == 206 and parcial.content == b"\x01" * 11
+    assert parcial.headers["Content-Range"] == f"bytes {8 + n + 10}-{8 + n + 20}/{len(r.content)}"
+    # Ni el 304 ni el Range (con la ruta fuera de la LRU) vuelven a construir el bundle
+    assert leidas == [0, 1, 2]
+
+
+def test_png_bajo_demanda_desde_preview_de_ingesta(monkeypatch, tmp_path):
+    import io
+    from PIL import Image
+    import api.services.visor_service as vs
+    from api.services.preview_service import codificar_preview
+
+    img = (np.arange(64, dtype=np.uint8).reshape(8, 8) * 4)
+    (tmp_path / "image_0.webp").write_bytes(codificar_preview(img, "webp"))
+    monkeypatch.setattr(vs, "_serie_dir", lambda sid: str(tmp_path))
+    monkeypatch.setattr(vs, "_render", lambda *a: pytest.fail("no debe renderizar desde el volumen"))
+    vs.render_lru.invalidate_session("sp")
+
+    assert vs._preview_de_ingesta("sp", 0, None, None, None, None, "png", None) == (
+        str(tmp_path / "image_0.webp"), "webp")
+    content, etag = vs.render_corte("sp", 0, fmt="png")
+    assert content[:8] == b"\x89PNG\r\n\x1a\n"
+    assert Image.open(io.BytesIO(content)).size == (8, 8)
+    assert vs.render_corte("sp", 0, fmt="webp")[0] == (tmp_path / "image_0.webp").read_bytes()
+    assert not (tmp_path / "image_0.png").exists()
@@ -4,6 +4,7 @@ import { useNavigate } from 'react-router-dom';
 import { Download, Loader2, Trash2, FileDown, CheckCircle2, XCircle } from 'lucide-react';
 import Swal from 'sweetalert2';
 import { userHeaders } from '../utils/authHeaders';
+import { previewUrls } from '../utils/previewUrls';
 
 const API = 'http://localhost:8000';
 
@@ -391,9 +392,7 @@ export default function ExportacionSTL() {
                             }
 
                             const mapping = await mappingRes.json();
-                            const imagePaths = Object.keys(mapping).map(
-                              (nombre) => `/static/series/${serie.session_id}/${nombre}`
-                            );
+                            const imagePaths = previewUrls(serie.session_id, mapping);
 
                             // Navegar al visor con las imágenes
                             navigate(`/visor/${serie.session_id}`, {
@@ -3,6 +3,7 @@ import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
 import Swal from "sweetalert2";
 import { userHeaders } from "../utils/authHeaders";
+import { previewUrls } from "../utils/previewUrls";
 import { UserPlus } from 'lucide-react';
 
 const API = 'http://localhost:8000';
@@ -59,9 +60,7 @@ export default function Historial() {
       }
 
       const mapping = await res.json();
-      const imagePaths = Object.keys(mapping).map(
-        (nombre) => `/static/series/${archivo.session_id}/${nombre}`
-      );
+      const imagePaths = previewUrls(archivo.session_id, mapping);
 
       navigate(`/visor/${archivo.session_id}`, {
         state: { images: imagePaths, source: "historial" },
@@ -3,6 +3,7 @@ import React, { useState, useEffect } from 'react';
 import { UserPlus, Search, Edit2, Trash2, FileText, Eye, FolderOpen } from 'lucide-react';
 import Swal from 'sweetalert2';
 import { userHeaders } from '../utils/authHeaders';
+import { previewUrls } from '../utils/previewUrls';
 import { useNavigate } from 'react-router-dom';
 
 const API = 'http://localhost:8000';
@@ -206,9 +207,7 @@ export default function Pacientes() {
       }
 
       const mapping = await mappingRes.json();
-      const imagePaths = Object.keys(mapping).map(
-        (nombre) => `/static/series/${estudio.session_id}/${nombre}`
-      );
+      const imagePaths = previewUrls(estudio.session_id, mapping);
 
       // Cerrar modal de estudios
       setModalEstudios(false);
@@ -52,6 +52,17 @@ export default function UploadPage() {
         throw new Error('No se recibió el session_id del servidor.');
       }
 
+      // Un ZIP con varias series crea una sesión por serie: se abre la principal
+      const series = result.image_series?.series || [];
+      if (series.length > 1) {
+        await Swal.fire({
+          title: 'Varias series detectadas',
+          text: `El ZIP contenía ${series.length} series. Se abrirá la principal; las demás quedan disponibles en el historial.`,
+          icon: 'info',
+          confirmButtonText: 'Continuar',
+        });
+      }
+
       navigate(`/visor/${sessionId}`, {
         replace: true,
         state: { images, source: 'upload' },
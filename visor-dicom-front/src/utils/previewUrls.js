@@ -0,0 +1,15 @@
+// src/utils/previewUrls.js
+// Extensión de cada codificación guardada en la ingesta ("encodings" del mapping)
+const EXTENSIONES = { webp: ".webp", jpeg: ".jpg", png: ".png" };
+
+// URL de la preview de una imagen del mapping.json de la serie:
+// la que trae el backend (meta.url) o, si no, la codificación preferida guardada.
+// Los mappings antiguos sin "encodings" sólo tienen el PNG.
+export const previewUrl = (sessionId, nombre, meta = {}) => {
+  if (meta.url) return meta.url;
+  const ext = EXTENSIONES[meta.encodings?.[0]] || ".png";
+  return `/static/series/${sessionId}/${nombre.replace(/\.png$/, ext)}`;
+};
+
+export const previewUrls = (sessionId, mapping) =>
+  Object.entries(mapping).map(([nombre, meta]) => previewUrl(sessionId, nombre, meta));